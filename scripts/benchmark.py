@@ -0,0 +1,279 @@
+from modules.Synthetic import generate_graph, write_gfa, write_gaf, GRAPH_KINDS
+from modules.Gfa import iterate_gfa_nodes, iterate_gfa_edges, load_gfa, SEQUENCES_LENGTH_ONLY
+from modules.Gaf import GafTable, iter_gaf_alignments, parse_cigar_as_tuples
+from modules.Cigar import count_operations_bulk
+from modules.Layout import build_scaffold, compute_layout, LAYOUT_SFDP, LAYOUT_MULTILEVEL, LAYOUT_BARNES_HUT
+
+import multiprocessing
+import platform
+import argparse
+import datetime
+import resource
+import numpy
+import json
+import time
+import sys
+import os
+
+
+REPORT_VERSION = 1
+
+LAYOUT_BACKENDS = [LAYOUT_SFDP, LAYOUT_MULTILEVEL, LAYOUT_BARNES_HUT]
+
+
+class BenchmarkRun:
+    def __init__(self, repeat=1):
+        self.repeat = repeat
+        self.results = list()
+
+    def run(self, name, kind, scale, function):
+        # function() returns the number of items it processed, and the fastest of the repeats is reported
+        result = {"name": name, "kind": kind, "scale": scale, "status": "ok"}
+        best = None
+
+        try:
+            for r in range(self.repeat):
+                start = time.perf_counter()
+                items = function()
+                seconds = time.perf_counter() - start
+
+                if best is None or seconds < best:
+                    best = seconds
+
+        except Exception as e:
+            result["status"] = "error"
+            result["message"] = str(e)
+            sys.stderr.write("WARNING: benchmark %s (%s, %d) failed: %s\n" % (name, kind, scale, str(e)))
+
+        if best is not None:
+            result["seconds"] = best
+            result["items"] = items
+            result["items_per_second"] = items/best if best > 0 else None
+
+        # Peak of the whole process so far, so it only grows
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+        self.results.append(result)
+        sys.stderr.write("%-24s %-12s %10d  %s\n" % (name, kind, scale, ("%.3fs" % best) if best is not None else result["status"]))
+
+    def skip(self, name, kind, scale, reason):
+        self.results.append({"name": name, "kind": kind, "scale": scale, "status": "skipped", "message": reason})
+        sys.stderr.write("%-24s %-12s %10d  skipped: %s\n" % (name, kind, scale, reason))
+
+
+def get_inputs(directory, kind, scale, sequences):
+    # Generated once per kind and scale, and reused by later runs
+    name = "%s_%d%s" % (kind, scale, "_seq" if sequences else "")
+    gfa_path = os.path.join(directory, name + ".gfa")
+    gaf_path = os.path.join(directory, name + ".gaf")
+
+    if not (os.path.exists(gfa_path) and os.path.exists(gaf_path)):
+        sys.stderr.write("Generating %s ...\n" % name)
+        graph = generate_graph(kind, scale)
+        write_gfa(graph, gfa_path + ".tmp", sequences=sequences)
+        write_gaf(graph, gaf_path + ".tmp", scale)
+
+        os.replace(gfa_path + ".tmp", gfa_path)
+        os.replace(gaf_path + ".tmp", gaf_path)
+
+    return gfa_path, gaf_path
+
+
+def read_cigars(gaf_path):
+    cigars = list()
+
+    with open(gaf_path, 'r') as file:
+        for line in file:
+            i = line.find("cg:Z:")
+
+            if i >= 0:
+                cigars.append(line[i+5:].split('\t', 1)[0].strip())
+
+    return cigars
+
+
+def count(iterator):
+    n = 0
+    for item in iterator:
+        n += 1
+
+    return n
+
+
+def load_gaf_table(gaf_path):
+    table = GafTable()
+    table.load(gaf_path)
+
+    return len(table)
+
+
+def parse_cigars(cigars):
+    for cigar in cigars:
+        parse_cigar_as_tuples(cigar)
+
+    return len(cigars)
+
+
+def get_scene_window():
+    # Scene construction needs a Qt application, which may not be available
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from PyQt5.QtWidgets import QApplication
+    import jackalope
+
+    application = QApplication.instance() or QApplication(sys.argv[:1])
+    window = jackalope.Window()
+
+    return application, window
+
+
+def populate_scene(window, graph, layout):
+    window.clear_scene_bottom()
+    window.graph = graph
+    window.populate_scene(layout)
+
+    return len(graph)
+
+
+def run_benchmarks(args):
+    run = BenchmarkRun(repeat=args.repeat)
+    scene = None
+    scene_error = None if args.scene else "disabled"
+
+    for scale in args.scales:
+        for kind in args.kinds:
+            gfa_path, gaf_path = get_inputs(args.work_directory, kind, scale, args.sequences)
+
+            run.run("iterate_gfa_nodes", kind, scale, lambda: count(iterate_gfa_nodes(gfa_path)))
+            run.run("iterate_gfa_edges", kind, scale, lambda: count(iterate_gfa_edges(gfa_path)))
+
+            graph = load_gfa(gfa_path, sequence_mode=SEQUENCES_LENGTH_ONLY)
+            run.run("load_gfa", kind, scale, lambda: len(load_gfa(gfa_path, sequence_mode=SEQUENCES_LENGTH_ONLY)))
+
+            run.run("iter_gaf_alignments", kind, scale, lambda: count(iter_gaf_alignments(gaf_path)))
+            run.run("gaf_table_load", kind, scale, lambda: load_gaf_table(gaf_path))
+
+            cigars = read_cigars(gaf_path)
+            run.run("parse_cigar_as_tuples", kind, scale, lambda: parse_cigars(cigars))
+            run.run("count_operations_bulk", kind, scale, lambda: len(count_operations_bulk(cigars)))
+
+            run.run("build_scaffold", kind, scale, lambda: len(build_scaffold(graph, args.length_scale_factor, args.min_node_length)))
+
+            layouts = dict()
+
+            for backend in args.backends:
+                name = "layout_" + backend
+
+                if scale > args.max_layout_segments:
+                    run.skip(name, kind, scale, "more than %d segments" % args.max_layout_segments)
+                    continue
+
+                def layout():
+                    layouts[backend] = compute_layout(graph, args.length_scale_factor, args.min_node_length, backend=backend, n_processes=args.n_processes, time_budget=args.time_budget)
+                    return len(graph)
+
+                run.run(name, kind, scale, layout)
+
+            if scene is None and scene_error is None:
+                try:
+                    scene = get_scene_window()
+                except Exception as e:
+                    scene_error = "Qt not available: " + str(e)
+
+            if scene_error is not None or len(layouts) == 0:
+                run.skip("populate_scene", kind, scale, scene_error or "no layout")
+                continue
+
+            layout = next(iter(layouts.values()))
+            run.run("populate_scene", kind, scale, lambda: populate_scene(scene[1], graph, layout))
+
+    return run.results
+
+
+def get_environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": multiprocessing.cpu_count()
+    }
+
+
+def compare_reports(results, baseline_path, tolerance, min_seconds):
+    # Prints the change of each benchmark that is in both reports, and returns the number of regressions. Slowdowns
+    # of less than min_seconds are timer noise on small inputs, and are not counted.
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+
+    previous = {(r["name"], r["kind"], r["scale"]): r for r in baseline["results"] if r["status"] == "ok"}
+    n_regressions = 0
+
+    for result in results:
+        key = (result["name"], result["kind"], result["scale"])
+
+        if result["status"] != "ok" or key not in previous:
+            continue
+
+        ratio = result["seconds"]/max(previous[key]["seconds"], 1e-9)
+        result["baseline_ratio"] = ratio
+
+        flag = ""
+        if ratio > 1 + tolerance and result["seconds"] - previous[key]["seconds"] > min_seconds:
+            flag = "REGRESSION"
+            n_regressions += 1
+
+        sys.stderr.write("%-24s %-12s %10d  %8.3fs -> %8.3fs  x%.2f %s\n" % (key + (previous[key]["seconds"], result["seconds"], ratio, flag)))
+
+    return n_regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time parsing, layout and scene construction on synthetic graphs and alignments")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000], help="Segments in each graph, and alignments in each GAF")
+    parser.add_argument("--kinds", nargs="+", default=GRAPH_KINDS, choices=GRAPH_KINDS)
+    parser.add_argument("--backends", nargs="+", default=LAYOUT_BACKENDS, choices=LAYOUT_BACKENDS)
+    parser.add_argument("--max_layout_segments", type=int, default=10000, help="Larger graphs are not laid out")
+    parser.add_argument("--time_budget", type=float, default=None, help="Seconds, for the layout engines that can stop early")
+    parser.add_argument("--length_scale_factor", type=int, default=100)
+    parser.add_argument("--min_node_length", type=int, default=3)
+    parser.add_argument("-t", "--n_processes", type=int, default=1)
+    parser.add_argument("--sequences", action="store_true", help="Write segment sequences instead of LN tags")
+    parser.add_argument("--no_scene", dest="scene", action="store_false", help="Skip the Qt scene construction")
+    parser.add_argument("--repeat", type=int, default=1, help="Report the fastest of this many runs")
+    parser.add_argument("--work_directory", default="benchmark_data", help="Where generated inputs are kept between runs")
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="Previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown (fraction) that counts as a regression")
+    parser.add_argument("--min_seconds", type=float, default=0.01, help="Smaller slowdowns (seconds) are never regressions")
+
+    args = parser.parse_args()
+
+    os.makedirs(args.work_directory, exist_ok=True)
+
+    results = run_benchmarks(args)
+
+    n_regressions = 0
+    if args.baseline is not None:
+        n_regressions = compare_reports(results, args.baseline, args.tolerance, args.min_seconds)
+
+    report = {
+        "version": REPORT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": get_environment(),
+        "arguments": {k:v for k,v in vars(args).items()},
+        "results": results
+    }
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    sys.stderr.write("Wrote %s\n" % args.output)
+
+    if n_regressions > 0:
+        sys.stderr.write("%d regressions\n" % n_regressions)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
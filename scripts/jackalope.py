@@ -1,35 +1,29 @@
+import time
+
+# Before any other import, so that startup includes the time spent importing
+STARTED = time.perf_counter()
+
 import multiprocessing
-from collections import defaultdict
+import bisect
 import tempfile
 import os.path
-import random
-
-from modules.Gfa import iterate_gfa_edges,iterate_gfa_nodes
-from modules.Gaf import GafElement, iter_gaf_alignments
-from modules.IncrementalIdMap import IncrementalIdMap
-from modules.Align import run_minigraph,run_panaligner,run_graphaligner
 
-import matplotlib
-import networkx
+from modules.Gfa import GfaGraph, load_gfa, SEQUENCES_LENGTH_ONLY, SEQUENCES_MEMORY_MAPPED, SEQUENCES_IN_MEMORY
+from modules.Gaf import GafTable, GafTableRow, GafTail, GafFilter
+from modules.GafIndex import GafIndex
+from modules.Layout import compute_layout, LAYOUT_SFDP, LAYOUT_FORCE_ATLAS2, LAYOUT_MULTILEVEL, LAYOUT_BARNES_HUT
+from modules.Task import TaskProgress, TaskCancelled, set_stage, add_details
+from modules.Lod import LayoutLod
+from modules.Diagnostics import Diagnostics
+from modules.Align import run_minigraph,run_panaligner,run_graphaligner,get_graphaligner_command
 
-import importlib.util
 import numpy
 import math
 import sys
 
-USE_CUDA = False
-if USE_CUDA and importlib.util.find_spec("cugraph") is not None and importlib.util.find_spec("cudf") is not None:
-    sys.stderr.write("Found: cugraph/cudf libs\n")
-    from cugraph import Graph as cuGraph
-    from cugraph import force_atlas2
-    from cudf import DataFrame
-else:
-    sys.stderr.write("NOT found: cugraph/cudf libs\n")
 
-
-from PyQt5.QtCore import Qt, QLineF, QEvent, QUrl
-from PyQt5.QtGui import QBrush, QPainter, QPen, QColor, QPainterPath
-from PyQt5.QtWebEngineWidgets import QWebEngineView
+from PyQt5.QtCore import Qt, QLineF, QRectF, QEvent, QThread, QProcess, QTimer, pyqtSignal
+from PyQt5.QtGui import QBrush, QPainter, QPen, QColor, QPainterPath, QFontDatabase
 from PyQt5.QtWidgets import (
     QDialog,
     QLabel,
@@ -39,13 +33,17 @@ from PyQt5.QtWidgets import (
     QApplication,
     QGraphicsEllipseItem,
     QGraphicsItem,
+    QGraphicsPathItem,
     QGraphicsRectItem,
     QGraphicsTextItem,
     QGraphicsScene,
     QGraphicsView,
     QLineEdit,
+    QListWidget,
+    QListWidgetItem,
     QCheckBox,
     QPlainTextEdit,
+    QProgressBar,
     QHBoxLayout,
     QPushButton,
     QSlider,
@@ -76,20 +74,55 @@ def parse_string_as_numeric_positive_integer(s):
     return i
 
 
-def get_midpoint(a,b):
-    x = float(a[0] + b[0])/2.0
-    y = float(a[1] + b[1])/2.0
+class TaskThread(QThread):
+    progressed = pyqtSignal(str, int, int)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str, bool)
+
+    def __init__(self, name, function, diagnostics=None):
+        super().__init__()
+
+        self.name = name
+        self.function = function
+        self.progress = TaskProgress(self.progressed.emit, diagnostics=diagnostics, task_name=name)
+
+    def run(self):
+        # Results are handed back to the GUI thread through the (queued) signals
+        try:
+            result = self.function(self.progress)
+        except TaskCancelled as e:
+            self.failed.emit(str(e), True)
+            return
+        except Exception as e:
+            self.failed.emit(str(e), False)
+            return
+        finally:
+            self.progress.finish()
 
-    return x,y
+        self.succeeded.emit(result)
+
+    def cancel(self):
+        self.progress.cancel()
 
 
 class RunAlignmentPopup(QDialog):
+    # Complete GAF lines (and their byte offsets) as they are written by the aligner
+    records_available = pyqtSignal(list, list)
+    alignment_started = pyqtSignal(str, bool)
+    alignment_finished = pyqtSignal(str, bool)
+
     def __init__(self, gfa_path):
         super().__init__()
 
         self.gfa_path = gfa_path
         self.gaf_path = None
 
+        self.process = None
+        self.tail = None
+        self.tail_timer = QTimer(self)
+        self.tail_timer.setInterval(500)
+        self.tail_timer.timeout.connect(self.read_new_records)
+
         self.layout = QVBoxLayout()
 
         self.setWindowTitle("Run new alignment (GraphAligner)")
@@ -161,9 +194,25 @@ class RunAlignmentPopup(QDialog):
         self.replacement_checkbox = QCheckBox("Replace alignments (default=append)")
         self.layout.addWidget(self.replacement_checkbox)
 
-        run_button = QPushButton("Run")
-        run_button.clicked.connect(self.run_alignment)
-        self.layout.addWidget(run_button)
+        run_layout = QHBoxLayout()
+
+        self.run_button = QPushButton("Run")
+        self.run_button.clicked.connect(self.run_alignment)
+        run_layout.addWidget(self.run_button)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_alignment)
+        self.cancel_button.setEnabled(False)
+        run_layout.addWidget(self.cancel_button)
+
+        self.layout.addLayout(run_layout)
+
+        # Aligner output, streamed while it runs
+        log_label = QLabel("Log:")
+        self.log_box = QPlainTextEdit()
+        self.log_box.setReadOnly(True)
+        self.layout.addWidget(log_label)
+        self.layout.addWidget(self.log_box)
 
         QBtn = QDialogButtonBox.Ok
 
@@ -196,12 +245,15 @@ class RunAlignmentPopup(QDialog):
             self.input_field.setText(filename)
 
     def run_alignment(self):
+        if self.process is not None:
+            return
+
         args = self.args_field.toPlainText().strip().split()
         n_threads = self.parse_threads()
         fasta_path = self.input_field.text()
         output_dir = self.output_field.text()
 
-        self.gaf_path = run_graphaligner(
+        command, self.gaf_path = get_graphaligner_command(
             output_directory=output_dir,
             gfa_path=self.gfa_path,
             fasta_path=fasta_path,
@@ -209,6 +261,93 @@ class RunAlignmentPopup(QDialog):
             args_override=args
         )
 
+        # The aligner would truncate it anyway, and stale records must not be picked up by the tail
+        if os.path.exists(self.gaf_path):
+            os.remove(self.gaf_path)
+
+        self.log_box.clear()
+        self.append_log(" ".join(command) + '\n')
+
+        self.tail = GafTail(self.gaf_path)
+
+        self.process = QProcess(self)
+        self.process.setProcessChannelMode(QProcess.MergedChannels)
+        self.process.readyReadStandardOutput.connect(self.read_log)
+        self.process.finished.connect(self.on_process_finished)
+        self.process.errorOccurred.connect(self.on_process_error)
+
+        self.run_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+
+        self.alignment_started.emit(self.gaf_path, self.replacement_checkbox.isChecked())
+
+        self.process.start(command[0], command[1:])
+        self.tail_timer.start()
+
+    def append_log(self, text):
+        self.log_box.moveCursor(self.log_box.textCursor().End)
+        self.log_box.insertPlainText(text)
+        self.log_box.ensureCursorVisible()
+
+    def read_log(self):
+        self.append_log(bytes(self.process.readAllStandardOutput()).decode("utf8", errors="replace"))
+
+    def read_new_records(self):
+        if self.tail is None:
+            return
+
+        lines, offsets = self.tail.read_new_lines()
+
+        if len(lines) > 0:
+            self.records_available.emit(lines, offsets)
+
+    def cancel_alignment(self):
+        if self.process is None:
+            return
+
+        self.append_log("\nCancelling...\n")
+
+        # Ask nicely first, the aligner may not respond to SIGTERM while it is loading the graph. Either way the
+        # cancellation completes in on_process_finished, without blocking the GUI.
+        process = self.process
+        process.terminate()
+        QTimer.singleShot(3000, lambda: self.kill_alignment(process))
+
+    def kill_alignment(self, process=None):
+        # Only if it is still the one that is running, another alignment may have been started since
+        if self.process is not None and (process is None or process is self.process):
+            self.process.kill()
+
+    def on_process_error(self, error):
+        if error == QProcess.FailedToStart:
+            self.append_log("ERROR: failed to start aligner: " + self.process.errorString() + '\n')
+            self.finish(False)
+
+    def on_process_finished(self, exit_code, exit_status):
+        self.read_log()
+        self.append_log("\nStatus: " + ("done" if exit_code == 0 and exit_status == QProcess.NormalExit else "FAIL") + '\n')
+        self.finish(exit_code == 0 and exit_status == QProcess.NormalExit)
+
+    def finish(self, success):
+        if self.process is None:
+            return
+
+        self.tail_timer.stop()
+
+        # Anything written between the last poll and the exit of the aligner
+        self.read_new_records()
+
+        self.process = None
+        self.tail = None
+
+        self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+        self.alignment_finished.emit(self.gaf_path, success)
+
+    def is_running(self):
+        return self.process is not None
+
 
 class OkPopup(QDialog):
     def __init__(self, title, message):
@@ -229,7 +368,7 @@ class OkPopup(QDialog):
 
 
 class GafStatsPopup(QDialog):
-    def __init__(self, title, alignment: GafElement):
+    def __init__(self, title, alignment: GafTableRow):
         super().__init__()
 
         self.setWindowTitle(title)
@@ -248,14 +387,15 @@ class GafStatsPopup(QDialog):
         self.path_box = QPlainTextEdit()
 
         cigar_string = ""
-        cigar = None
+        stats = None
 
         try:
-            cigar = alignment.get_cigar()
+            cigar_string = alignment.get_cigar_string()
+            stats = alignment.get_cigar_stats()
         except Exception as e:
             d = OkPopup("ERROR", str(e))
             d.exec()
-            cigar = None
+            stats = None
 
         n_match = 0
         n_mismatch = 0
@@ -263,21 +403,12 @@ class GafStatsPopup(QDialog):
         n_insert = 0
         identity = 0
 
-        if cigar is not None:
-            for c,length in cigar:
-                cigar_string += c
-                cigar_string += str(length)
-
-                if c == "=":
-                    n_match += length
-                if c == "X":
-                    n_mismatch += length
-                if c == "D":
-                    n_delete += length
-                if c == "I":
-                    n_insert += length
-
-            identity = float(n_match) / float(n_match + n_mismatch + n_insert + n_delete)
+        if stats is not None:
+            n_match = stats.n_match
+            n_mismatch = stats.n_mismatch
+            n_delete = stats.n_delete
+            n_insert = stats.n_insert
+            identity = stats.get_identity()
 
         self.stats_text = QLabel(
             "n_match:\t" + str(n_match) + '\n'
@@ -302,16 +433,124 @@ class GafStatsPopup(QDialog):
         self.setLayout(self.layout)
 
 
+class DiagnosticsPopup(QDialog):
+    def __init__(self, diagnostics, max_stages=500):
+        super().__init__()
+
+        self.diagnostics = diagnostics
+
+        self.setWindowTitle("Diagnostics")
+        self.resize(900, 600)
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Ok)
+        self.buttonBox.accepted.connect(self.accept)
+
+        button = self.buttonBox.addButton("Save JSON", QDialogButtonBox.ActionRole)
+        button.clicked.connect(self.save_json)
+
+        button = self.buttonBox.addButton("Clear", QDialogButtonBox.ResetRole)
+        button.clicked.connect(self.clear)
+
+        self.text_box = QPlainTextEdit()
+        self.text_box.setReadOnly(True)
+        self.text_box.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.text_box.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+
+        self.max_stages = max_stages
+        self.update_text()
+
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.text_box)
+        self.layout.addWidget(self.buttonBox)
+        self.setLayout(self.layout)
+
+    def update_text(self):
+        row = "%-20s %-48s %6s %10s %10s %10s %10s"
+        lines = ["Totals by stage", row % ("task", "stage", "count", "wall (s)", "cpu (s)", "peak (MB)", "")]
+
+        for total in self.diagnostics.get_totals():
+            lines.append(row % (total["task"] or "", total["name"], total["count"], "%.3f" % total["wall_seconds"], "%.3f" % total["cpu_seconds"], "%.1f" % total["peak_rss_mb"], ""))
+
+        records = self.diagnostics.get_records()[-self.max_stages:]
+
+        lines.append("")
+        lines.append("Most recent stages")
+        lines.append(row % ("task", "stage", "", "wall (s)", "cpu (s)", "peak (MB)", "+peak (MB)"))
+
+        for record in records:
+            if record.is_running():
+                lines.append(row % (record.task or "", record.name, "", "running", "", "", ""))
+            else:
+                lines.append(row % (record.task or "", record.name, "", "%.3f" % record.wall_seconds, "%.3f" % record.cpu_seconds, "%.1f" % record.peak_rss_mb, "%.1f" % record.peak_increase_mb))
+
+            if len(record.details) > 0:
+                lines.append("    " + ", ".join("%s=%s" % item for item in record.details.items()))
+
+        self.text_box.setPlainText("\n".join(lines))
+
+    def save_json(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save diagnostics", "diagnostics.json", "JSON Files (*.json)")
+
+        if path == "":
+            return
+
+        try:
+            self.diagnostics.write_json(path)
+        except Exception as e:
+            d = OkPopup("ERROR", str(e))
+            d.exec()
+
+    def clear(self):
+        self.diagnostics.clear()
+        self.update_text()
+
+
 class Window(QWidget):
+    sequence_modes = [
+        (SEQUENCES_LENGTH_ONLY, "Lengths only"),
+        (SEQUENCES_MEMORY_MAPPED, "Memory-mapped"),
+        (SEQUENCES_IN_MEMORY, "In memory")
+    ]
+
+    layout_backends = [
+        (LAYOUT_SFDP, "sfdp (graphviz)"),
+        (LAYOUT_MULTILEVEL, "Multilevel (CPU)"),
+        (LAYOUT_BARNES_HUT, "Barnes-Hut (CPU)"),
+        (LAYOUT_FORCE_ATLAS2, "ForceAtlas2 (cugraph)")
+    ]
+
     def __init__(self, gfa_path=None, gaf_path=None):
         super().__init__()
         self.use_cugraph = False
+        self.layout_backend = LAYOUT_FORCE_ATLAS2 if self.use_cugraph else LAYOUT_SFDP
+
+        # Seconds, for the backends that can stop early
+        self.layout_time_budget = 120
 
         self.line_width = 2
         self.highlight_width = 1
         self.length_scale_factor = 100
         self.layout_iterations = 100
         self.min_node_length = 3
+        self.max_node_alignments = 1000
+
+        # Redraws start from the current polylines and only refine them, instead of a full layout from scratch
+        self.warm_start = True
+        self.graph_layout = None
+
+        # Non-branching chains of segments are laid out as one segment each
+        self.collapse_chains = False
+
+        # Local mode: only the segments within this many L-lines of the seed segments are laid out and drawn.
+        # The neighborhood is a (seed ids, hops) pair, or None for the whole graph, and the one of the current
+        # layout is kept separately since warm starts only apply to a layout of the same segments.
+        self.neighborhood_hops = 2
+        self.neighborhood = None
+        self.layout_neighborhood = None
+        self.layout_ids = None
+
+        # Drawing only needs segment lengths, so bases are not loaded unless requested
+        self.sequence_mode = SEQUENCES_LENGTH_ONLY
 
         self.scene_middle = QGraphicsScene()
         self.scene_bottom = QGraphicsScene()
@@ -359,32 +598,74 @@ class Window(QWidget):
         self.alignment_combobox.currentIndexChanged.connect(self.on_select_alignment)
         self.control_panel_top.addWidget(self.alignment_combobox)
 
-        self.colormap = matplotlib.colormaps['jet']
+        # matplotlib is slow to import, so the colormap is only loaded when the first alignment is colored
+        self.colormap_name = 'jet'
+
+        # Pens are shared between nodes, keyed by color (None for the default gray) and line width
+        self.node_pens = dict()
+
+        # Alignment paths are colored from a fixed palette of pens per line width, sampled once from the colormap
+        self.palette_size = 256
+        self.palettes = dict()
 
         # Graph data structures
-        self.sequences = dict()
-        self.edges = list()
-        self.name_to_edge = defaultdict(list)
+        self.graph = GfaGraph()
+
+        # Path items of the drawn segments, keyed by segment id. Only the ones near the viewport are in the scene,
+        # with polylines that are simplified to the current zoom level.
         self.qt_nodes = dict()
+        self.lod = None
+        self.shown_nodes = set()
+
+        # Ids of the nodes that are colored by the selected alignments, the others have the default pen
+        self.colored_nodes = set()
+
+        # Edges are drawn as one path item per (level, tile)
+        self.edge_tile_items = dict()
+        self.shown_edge_tiles = set()
+
+        # Visible items are updated once zooming or scrolling pauses
+        self.lod_timer = QTimer(self)
+        self.lod_timer.setSingleShot(True)
+        self.lod_timer.setInterval(50)
+        self.lod_timer.timeout.connect(self.update_visible_items)
+
+        # Alignment data, stored column-wise, with each parsed query name mapped to its sorted row indexes.
+        # Queries are only parsed from the GAF (via the byte offset index) when they are selected, and only the
+        # alignments that pass the filter are kept.
+        self.gaf_filter = GafFilter()
+        self.gaf_table = GafTable(gaf_filter=self.gaf_filter)
+        self.gaf_indexes = list()
+        self.alignments = dict()
+
+        self.bottom_highlight_items = list()
+
+        # Aligner that is run from the GUI, and the GAF it is writing to
+        self.alignment_popup = None
+        self.live_gaf_path = None
 
-        # Alignment data
-        self.alignments = defaultdict(list)
+        # Loading and layout run in a worker thread, one task at a time
+        self.task = None
+
+        # Timing and memory of each stage of the tasks, and of the scene updates on the GUI thread
+        self.diagnostics = Diagnostics()
+        self.pending_tasks = list()
 
         self.gfa_path = gfa_path
         self.gaf_path = gaf_path
 
         if gfa_path is not None:
             self.load_gfa()
-            self.draw_graph()
 
         if gaf_path is not None:
             self.load_gaf()
 
-        self.bottom_highlight_items = list()
-
         self.scene_middle.selectionChanged.connect(self.on_select_alignment_block)
+        self.scene_bottom.selectionChanged.connect(self.on_select_node)
 
         self.view_bottom.viewport().installEventFilter(self)
+        self.view_bottom.horizontalScrollBar().valueChanged.connect(self.lod_timer.start)
+        self.view_bottom.verticalScrollBar().valueChanged.connect(self.lod_timer.start)
 
         for i in range(self.grid.columnCount()):
             w = 0 if i==0 else 8
@@ -400,20 +681,101 @@ class Window(QWidget):
     def load_finished(self):
         print("done")
 
+    def run_task(self, name, function, on_success):
+        self.pending_tasks.append((name, function, on_success))
+
+        if self.task is None:
+            self.start_next_task()
+
+    def start_next_task(self):
+        if len(self.pending_tasks) == 0:
+            self.task = None
+            self.set_progress_visible(False)
+            return
+
+        name, function, on_success = self.pending_tasks.pop(0)
+
+        self.task = TaskThread(name, function, self.diagnostics)
+        self.task.progressed.connect(self.on_task_progress)
+        self.task.succeeded.connect(lambda result: self.on_task_succeeded(on_success, result))
+        self.task.failed.connect(self.on_task_failed)
+
+        self.progress_label.setText(name)
+        self.progress_bar.setRange(0,0)
+        self.set_progress_visible(True)
+
+        self.task.start()
+
+    def on_task_progress(self, stage, value, total):
+        self.progress_label.setText(self.task.name + ": " + stage if self.task is not None else stage)
+
+        if total > 0:
+            self.progress_bar.setRange(0,1000)
+            self.progress_bar.setValue(int(1000*float(value)/float(total)))
+        else:
+            # Unknown amount of work
+            self.progress_bar.setRange(0,0)
+
+    def on_task_succeeded(self, on_success, result):
+        self.task.wait()
+        self.task = None
+
+        try:
+            on_success(result)
+        finally:
+            if self.task is None:
+                self.start_next_task()
+
+    def on_task_failed(self, message, cancelled):
+        self.task.wait()
+        self.task = None
+
+        # Queued tasks may depend on the one that failed
+        self.pending_tasks = list()
+
+        if not cancelled:
+            d = OkPopup("ERROR", message)
+            d.exec()
+
+        self.start_next_task()
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.pending_tasks = list()
+            self.task.cancel()
+
+    def set_progress_visible(self, visible):
+        self.progress_label.setVisible(visible)
+        self.progress_bar.setVisible(visible)
+        self.cancel_button.setVisible(visible)
+
+    def closeEvent(self, event):
+        if self.task is not None:
+            self.cancel_task()
+            self.task.wait()
+
+        if self.alignment_popup is not None:
+            self.alignment_popup.cancel_alignment()
+            self.alignment_popup.kill_alignment()
+            self.alignment_popup.close()
+
+        # The scenes emit selection changes while they are being destroyed
+        self.scene_middle.selectionChanged.disconnect(self.on_select_alignment_block)
+        self.scene_bottom.selectionChanged.disconnect(self.on_select_node)
+
+        super().closeEvent(event)
+
     def open_gfa(self):
-        self.clear_highlights()
-        self.scene_bottom.clear()
+        self.clear_scene_bottom()
 
         # https://pythonspot.com/pyqt5-file-dialog/
         options = QFileDialog.Options()
         options |= QFileDialog.DontUseNativeDialog
-        filename, _ = QFileDialog.getOpenFileName(self,"QFileDialog.getOpenFileName()", "","GFA Files (*.gfa)", options=options)
+        filename, _ = QFileDialog.getOpenFileName(self,"QFileDialog.getOpenFileName()", "","GFA Files (*.gfa *.gfa.gz)", options=options)
 
         if filename != '':
             self.gfa_path = filename
             self.load_gfa()
-            self.draw_graph()
-            self.on_select_gaf_query()
 
     def open_gaf(self):
         # https://pythonspot.com/pyqt5-file-dialog/
@@ -426,28 +788,43 @@ class Window(QWidget):
             self.load_gaf()
 
     def load_gfa(self):
+        # Parameters are copied so that the worker is not affected by later edits in the GUI
+        gfa_path = self.gfa_path
+        sequence_mode = self.sequence_mode
+        length_scale_factor = self.length_scale_factor
+        min_node_length = self.min_node_length
+        layout_backend = self.layout_backend
+        layout_time_budget = self.layout_time_budget
+        collapse_chains = self.collapse_chains
+
+        def task(progress):
+            graph = load_gfa(gfa_path, sequence_mode=sequence_mode, progress=progress)
+            layout = compute_layout(graph, length_scale_factor, min_node_length, progress=progress, in_subprocess=True, read_cache=True, write_cache=True, backend=layout_backend, time_budget=layout_time_budget, collapse_chains=collapse_chains)
+
+            return graph, layout
+
+        self.run_task("Loading GFA", task, self.on_gfa_loaded)
+
+    def on_gfa_loaded(self, result):
+        graph, layout = result
+
         # This will be called repeatedly in some cases, so reset the relevant datastructures
-        self.scene_bottom.clear()
-        self.clear_highlights()
+        self.clear_scene_bottom()
         self.clear_gaf()
 
         self.qt_nodes = dict()
-        self.sequences = dict()
-        self.edges = list()
-        self.name_to_edge = defaultdict(list)
-
-        for sequence in iterate_gfa_nodes(self.gfa_path):
-            self.sequences[sequence.name] = sequence.sequence
+        self.graph.close()
+        self.graph = graph
+        self.neighborhood = None
 
-        for edge in iterate_gfa_edges(self.gfa_path):
-            self.edges.append(edge)
-            self.name_to_edge[edge.name_a].append(len(self.edges) - 1)
-            self.name_to_edge[edge.name_b].append(len(self.edges) - 1)
+        self.populate_scene(layout)
 
     def clear_gaf(self):
         self.scene_middle.clear()
         self.clear_highlights()
-        self.alignments = defaultdict(list)
+        self.gaf_table = GafTable(gaf_filter=self.gaf_filter)
+        self.gaf_indexes = list()
+        self.alignments = dict()
         self.alignment_combobox.blockSignals(True)
         self.alignment_combobox.clear()
         self.alignment_combobox.blockSignals(False)
@@ -456,41 +833,142 @@ class Window(QWidget):
         self.gaf_query_combobox.blockSignals(False)
 
     def load_gaf(self, replace=True):
+        gaf_path = self.gaf_path
+
+        # Only the byte offsets of each query are loaded here, alignments are parsed when the query is selected
+        def task(progress):
+            return GafIndex.load_or_build(gaf_path, progress=progress)
+
+        self.run_task("Loading GAF", task, lambda index: self.on_gaf_loaded(index, replace))
+
+    def on_gaf_loaded(self, index, replace):
         if replace:
             self.clear_gaf()
-            self.alignments = defaultdict(list)
-
-        for a in iter_gaf_alignments(self.gaf_path):
-            self.alignments[a.get_query_name()].append(a)
 
-            for name,reversal in a.get_path():
-                if name not in self.qt_nodes:
-                    print(a.get_query_name() + " not found in graph")
-                    d = OkPopup("ERROR", "GAF contains node names which do not exist in GFA, or GFA is not loaded. \n\n"
-                                         "Please open compatible GFA first.")
-                    d.exec()
+        self.gaf_indexes.append(index)
 
-                    # TODO: make clearing optional
-                    self.clear_gaf()
+        # Queries that were already parsed from other files need to be re-read to include this one
+        for query_name in index.get_query_names():
+            self.alignments.pop(query_name, None)
 
-                    return
+        self.update_query_names()
 
-        self.gaf_query_combobox.addItems(sorted(self.alignments.keys()))
+    def update_query_names(self):
+        query_names = set()
+        for index in self.gaf_indexes:
+            query_names.update(name for name in index.get_query_names() if self.gaf_filter.accepts_query_name(name))
 
-        for query_name in self.alignments.keys():
-            self.alignments[query_name] = sorted(self.alignments[query_name], key=lambda x: x.get_query_midpoint())
+        self.gaf_query_combobox.blockSignals(True)
+        self.gaf_query_combobox.clear()
+        self.gaf_query_combobox.addItems(sorted(query_names))
+        self.gaf_query_combobox.blockSignals(False)
 
         # Initialize the menu with whichever query is first
         self.on_select_gaf_query()
 
+    def apply_gaf_filter(self):
+        min_map_quality = parse_string_as_numeric_positive_integer(self.min_map_quality_field.text())
+        min_aligned_length = parse_string_as_numeric_positive_integer(self.min_aligned_length_field.text())
+
+        # Invalid values have already been reported
+        if (min_map_quality is None and self.min_map_quality_field.text() != "") or (min_aligned_length is None and self.min_aligned_length_field.text() != ""):
+            return
+
+        min_identity = None
+        s = self.min_identity_field.text().strip()
+
+        if s != "":
+            try:
+                min_identity = float(s)
+            except ValueError:
+                min_identity = -1
+
+            if not 0 <= min_identity <= 1:
+                d = OkPopup("ERROR", "Minimum identity must be a number from 0 to 1")
+                d.exec()
+                return
+
+        query_names = self.filter_query_names_field.text().replace(",", " ").split()
+
+        self.gaf_filter = GafFilter(
+            min_map_quality=min_map_quality or 0,
+            min_aligned_length=min_aligned_length or 0,
+            query_names=query_names if len(query_names) > 0 else None,
+            min_identity=min_identity,
+            primary_only=self.primary_only_checkbox.isChecked()
+        )
+
+        # Alignments are re-read from the indexes as they are selected, so only the table needs to be replaced
+        self.scene_middle.clear()
+        self.clear_highlights()
+        self.gaf_table = GafTable(gaf_filter=self.gaf_filter)
+        self.alignments = dict()
+
+        self.update_query_names()
+
+    def validate_alignments(self, start, stop):
+        unknown_paths = self.gaf_table.find_unknown_paths(start, stop)
+
+        if len(unknown_paths) > 0:
+            print(unknown_paths[0] + " not found in graph")
+            d = OkPopup("ERROR", "GAF contains node names which do not exist in GFA, or GFA is not loaded. \n\n"
+                                 "Please open compatible GFA first.")
+            d.exec()
+
+            return False
+
+        return True
+
+    def get_alignments(self, query_name):
+        if query_name not in self.alignments:
+            if query_name == "" or len(self.gaf_indexes) == 0:
+                return list()
+
+            self.gaf_table.set_node_id_map(self.graph.id_map)
+            start = len(self.gaf_table)
+
+            with self.diagnostics.measure("Parsing GAF alignments", query=query_name) as record:
+                for index in self.gaf_indexes:
+                    lines, offsets = index.read_lines(query_name)
+                    self.gaf_table.load_lines(lines, source=index.gaf_path, offsets=offsets)
+
+                record.details["alignments"] = len(self.gaf_table) - start
+
+            stop = len(self.gaf_table)
+
+            if not self.validate_alignments(start, stop):
+                # TODO: make clearing optional
+                self.clear_gaf()
+                return list()
+
+            rows = numpy.arange(start, stop)
+            midpoints = self.gaf_table.query_starts[start:stop] + self.gaf_table.query_stops[start:stop]
+
+            self.alignments[query_name] = rows[numpy.argsort(midpoints, kind="stable")]
+
+        return [self.gaf_table.get_row(i) for i in self.alignments[query_name]]
+
     def on_select_gaf_query(self):
         query_name = str(self.gaf_query_combobox.currentText())
 
+        # The menu lists every query that passes the name filter, whether any of its alignments pass the other
+        # filters is only known once they are parsed. Queries with none left are removed as they are reached.
+        if not self.gaf_filter.is_empty():
+            while query_name != "" and len(self.get_alignments(query_name)) == 0:
+                i = self.gaf_query_combobox.currentIndex()
+
+                self.gaf_query_combobox.blockSignals(True)
+                self.gaf_query_combobox.removeItem(i)
+                self.gaf_query_combobox.setCurrentIndex(min(i, self.gaf_query_combobox.count() - 1))
+                self.gaf_query_combobox.blockSignals(False)
+
+                query_name = str(self.gaf_query_combobox.currentText())
+
         self.alignment_combobox.blockSignals(True)
         self.alignment_combobox.clear()
 
         self.alignment_combobox.addItem("all")
-        for i in range(len(self.alignments[query_name])):
+        for i in range(len(self.get_alignments(query_name))):
             self.alignment_combobox.addItem(str(i))
 
         self.alignment_combobox.blockSignals(False)
@@ -524,7 +1002,7 @@ class Window(QWidget):
 
         self.scene_middle.addItem(rect)
 
-        for i,alignment in enumerate(self.alignments[query_name]):
+        for i,alignment in enumerate(self.get_alignments(query_name)):
             a = alignment.get_query_start()
             b = alignment.get_query_stop()
             l = alignment.get_query_length()
@@ -553,39 +1031,82 @@ class Window(QWidget):
             y = item.pos().y()
             item.setPos(text_target_limit - w, y)
 
-    def color_alignment(self, alignment: GafElement):
-        path = alignment.get_path()
+    def color_alignment(self, alignment: GafTableRow):
+        ids, reversals = alignment.get_path_ids()
+
+        if (ids < 0).any() or (ids >= len(self.graph)).any():
+            raise Exception("ERROR: bad GAF node")
+
+        palette = self.get_palette()
+
+        # Position along the path, as an index into the palette
+        indexes = (numpy.arange(len(ids))*len(palette))//max(1,len(ids))
 
-        for p,[name,reversal] in enumerate(path):
-            color = self.colormap(float(p)/float(len(path)))
+        for id,index in zip(ids.tolist(), indexes.tolist()):
+            item = self.qt_nodes.get(id)
 
-            color = [int(round(255*c)) for c in color]
+            # Not drawn, when it is outside of the neighborhood in local mode
+            if item is None:
+                continue
 
-            pen = QPen(QColor.fromRgb(color[0], color[1], color[2]))
+            item.setPen(palette[index])
+            self.colored_nodes.add(id)
+
+    def get_palette(self):
+        if self.line_width not in self.palettes:
+            import matplotlib
+
+            colormap = matplotlib.colormaps[self.colormap_name]
+            colors = colormap(numpy.arange(self.palette_size)/self.palette_size)
+            colors = numpy.rint(255*colors[:,:3]).astype(int)
+
+            self.palettes[self.line_width] = [self.get_node_pen(tuple(color)) for color in colors.tolist()]
+
+        return self.palettes[self.line_width]
+
+    def get_node_pen(self, color=None):
+        key = (color, self.line_width)
+
+        if key not in self.node_pens:
+            pen = QPen(Qt.gray if color is None else QColor.fromRgb(*color))
             pen.setWidth(self.line_width)
+            self.node_pens[key] = pen
 
-            if name in self.qt_nodes:
-                self.qt_nodes[name].setPen(pen)
-            else:
+        return self.node_pens[key]
+
+    def highlight_alignment(self, alignment: GafTableRow):
+        ids, reversals = alignment.get_path_ids()
+
+        for id in ids.tolist():
+            if not 0 <= id < len(self.graph):
                 raise Exception("ERROR: bad GAF node")
 
-    def highlight_alignment(self, alignment: GafElement):
-        path = alignment.get_path()
+            path = self.qt_nodes.get(id)
 
-        for p,[name,reversal] in enumerate(path):
-            if name in self.qt_nodes:
-                path = self.qt_nodes[name]
+            # Not drawn, when it is outside of the neighborhood in local mode
+            if path is None:
+                continue
 
-                pen = path.pen()
-                pen.setWidth(self.line_width+self.highlight_width)
-                pen.setColor(Qt.black)
+            pen = path.pen()
+            pen.setWidth(self.line_width+self.highlight_width)
+            pen.setColor(Qt.black)
 
-                item = self.scene_bottom.addPath(path.path(), pen)
-                item.setZValue(path.zValue()-1)
-                self.bottom_highlight_items.append(item)
+            # Highlights are few, so they are always drawn at full detail
+            item = self.scene_bottom.addPath(self.build_path(self.graph_layout.get_segment_points(path.local_id).tolist()), pen)
+            item.setZValue(path.zValue()-1)
+            self.bottom_highlight_items.append(item)
 
-            else:
-                raise Exception("ERROR: bad GAF node")
+    def clear_scene_bottom(self):
+        self.clear_highlights()
+        self.scene_bottom.clear()
+
+        # Items that were in the scene are deleted along with it
+        self.qt_nodes = dict()
+        self.colored_nodes = set()
+        self.lod = None
+        self.shown_nodes = set()
+        self.edge_tile_items = dict()
+        self.shown_edge_tiles = set()
 
     def clear_highlights(self):
         for item in self.bottom_highlight_items:
@@ -602,35 +1123,127 @@ class Window(QWidget):
                 alignment_index = item.instance_item
 
                 query_name = str(self.gaf_query_combobox.currentText())
-                a = self.alignments[query_name][alignment_index]
+                a = self.get_alignments(query_name)[alignment_index]
 
                 self.highlight_alignment(a)
 
     def on_select_alignment(self):
-        # First reset the colors
-        for node in self.qt_nodes.values():
-            pen = QPen(Qt.gray)
-            pen.setWidth(self.line_width)
-            node.setPen(pen)
+        with self.diagnostics.measure("Recoloring") as record:
+            self.recolor_alignments()
+            record.details["colored_nodes"] = len(self.colored_nodes)
+
+    def recolor_alignments(self):
+        # First reset the colors, of the nodes that were colored
+        pen = self.get_node_pen()
+
+        for id in self.colored_nodes:
+            self.qt_nodes[id].setPen(pen)
+
+        self.colored_nodes = set()
 
         query_name = str(self.gaf_query_combobox.currentText())
         selection = self.alignment_combobox.currentText()
 
         if selection == "all":
-            for a,alignment in enumerate(self.alignments[query_name]):
+            for a,alignment in enumerate(self.get_alignments(query_name)):
                 self.color_alignment(alignment)
 
         else:
             alignment_index = int(selection)
-            alignment = self.alignments[query_name][alignment_index]
+            alignment = self.get_alignments(query_name)[alignment_index]
             self.color_alignment(alignment)
 
+    def on_select_node(self):
+        self.node_alignments_list.clear()
+        self.node_alignments_label.setText("Alignments at selected node:")
+
+        items = self.scene_bottom.selectedItems()
+
+        if len(items) != 1 or not hasattr(items[0], "node_id"):
+            return
+
+        node_name = self.graph.id_map.get_name(items[0].node_id)
+
+        n_total = 0
+        for index in self.gaf_indexes:
+            query_ids, ranks = index.get_alignments_at_node(node_name)
+            records = index.get_node_records(node_name)
+            n_total += len(records)
+
+            for query_id,rank,record in zip(query_ids.tolist(), ranks.tolist(), records.tolist()):
+                if self.node_alignments_list.count() >= self.max_node_alignments:
+                    break
+
+                query_name = index.query_names[query_id]
+
+                # The other filters would need the GAF lines to be read, those alignments are just not found when clicked
+                if not self.gaf_filter.accepts_query_name(query_name):
+                    continue
+
+                item = QListWidgetItem(query_name + " (" + str(rank) + ")")
+                item.setData(Qt.UserRole, (query_name, index.gaf_path, int(index.record_offsets[record])))
+                self.node_alignments_list.addItem(item)
+
+        self.node_alignments_label.setText("Alignments at " + node_name + ": " + str(n_total))
+
+    def on_select_node_alignment(self, item):
+        query_name, gaf_path, offset = item.data(Qt.UserRole)
+
+        i = self.gaf_query_combobox.findText(query_name)
+        if i < 0:
+            return
+
+        self.gaf_query_combobox.setCurrentIndex(i)
+
+        # The rank in a single file may not match the order in the menu when several GAFs are loaded,
+        # so find the alignment by its location in the source file instead
+        for a,alignment in enumerate(self.get_alignments(query_name)):
+            row = alignment.index
+
+            if self.gaf_table.line_offsets[row] == offset and self.gaf_table.sources.get_name(int(self.gaf_table.source_ids[row])) == gaf_path:
+                self.alignment_combobox.setCurrentIndex(a + 1)
+                break
+
     def redraw_graph(self):
-        if self.gfa_path is not None and len(self.sequences) > 0:
-            self.clear_highlights()
-            self.scene_bottom.clear()
+        if self.gfa_path is not None and len(self.graph) > 0:
             self.draw_graph()
-            self.on_select_gaf_query()
+
+    def draw_neighborhood(self):
+        if self.gfa_path is None or len(self.graph) == 0:
+            return
+
+        names = self.neighborhood_field.text().replace(",", " ").split()
+
+        if len(names) > 0:
+            ids = [self.graph.id_map.get_id(name) for name in names]
+            unknown = [name for name,id in zip(names, ids) if id is None]
+
+            if len(unknown) > 0:
+                d = OkPopup("ERROR", "Nodes not found in GFA: " + ", ".join(unknown[:10]))
+                d.exec()
+                return
+
+        else:
+            query_name = str(self.gaf_query_combobox.currentText())
+            selection = self.alignment_combobox.currentText()
+
+            alignments = self.get_alignments(query_name)
+            if selection != "all" and selection != "":
+                alignments = [alignments[int(selection)]]
+
+            ids = [id for alignment in alignments for id in alignment.get_path_ids()[0].tolist()]
+
+            if len(ids) == 0:
+                d = OkPopup("ERROR", "Enter node names or select an alignment to draw its neighborhood")
+                d.exec()
+                return
+
+        self.neighborhood = (numpy.unique(numpy.array(ids, dtype=numpy.int64)), self.neighborhood_hops)
+        self.draw_graph()
+
+    def draw_whole_graph(self):
+        self.neighborhood = None
+        self.redraw_graph()
 
     def run_new_alignment(self):
         if self.gfa_path is None:
@@ -639,20 +1252,88 @@ class Window(QWidget):
 
             return
 
-        d = RunAlignmentPopup(self.gfa_path)
-        if d.exec_() == QDialog.Accepted:
-            print(d.gaf_path)
-            self.gaf_path = d.gaf_path
+        # The dialog is not modal, so the window stays usable while the aligner runs
+        if self.alignment_popup is None or (self.alignment_popup.gfa_path != self.gfa_path and not self.alignment_popup.is_running()):
+            self.alignment_popup = RunAlignmentPopup(self.gfa_path)
+            self.alignment_popup.alignment_started.connect(self.on_alignment_started)
+            self.alignment_popup.records_available.connect(self.ingest_alignments)
+            self.alignment_popup.alignment_finished.connect(self.on_alignment_finished)
 
-            if d.replacement_checkbox.isChecked():
-                self.clear_gaf()
-                self.load_gaf()
-            else:
-                self.load_gaf(replace=False)
+        self.alignment_popup.show()
+        self.alignment_popup.raise_()
+
+    def on_alignment_started(self, gaf_path, replace):
+        if replace:
+            self.clear_gaf()
+
+        self.live_gaf_path = gaf_path
+
+    def ingest_alignments(self, lines, offsets):
+        self.gaf_table.set_node_id_map(self.graph.id_map)
+
+        start, stop = self.gaf_table.load_lines(lines, source=self.live_gaf_path, offsets=offsets)
+
+        current_query = str(self.gaf_query_combobox.currentText())
+        updated_queries = set()
+
+        for row in range(start, stop):
+            ids, reversals = self.gaf_table.get_path_ids(row)
+
+            if (ids < 0).any():
+                print(self.gaf_table.get_path_string(row) + " not found in graph")
+                continue
+
+            query_name = self.gaf_table.get_query_name(row)
+
+            # Make sure alignments of this query from other loaded GAFs are included before appending
+            if query_name not in self.alignments:
+                self.get_alignments(query_name)
+
+            rows = self.alignments.get(query_name, numpy.zeros(0, dtype=numpy.int64))
+            self.alignments[query_name] = numpy.append(rows, row)
+            updated_queries.add(query_name)
+
+        for query_name in updated_queries:
+            rows = self.alignments[query_name]
+            midpoints = self.gaf_table.query_starts[rows] + self.gaf_table.query_stops[rows]
+            self.alignments[query_name] = rows[numpy.argsort(midpoints, kind="stable")]
+
+        # Keep the menu sorted
+        names = [self.gaf_query_combobox.itemText(i) for i in range(self.gaf_query_combobox.count())]
+        new_names = sorted(updated_queries.difference(names))
+
+        if len(new_names) > 0:
+            self.gaf_query_combobox.blockSignals(True)
+            for query_name in new_names:
+                self.gaf_query_combobox.insertItem(bisect.bisect_left(names, query_name), query_name)
+                bisect.insort(names, query_name)
+            self.gaf_query_combobox.setCurrentIndex(max(0, self.gaf_query_combobox.findText(current_query)))
+            self.gaf_query_combobox.blockSignals(False)
+
+        if current_query == "" or current_query in updated_queries:
+            self.on_select_gaf_query()
+
+    def on_alignment_finished(self, gaf_path, success):
+        self.live_gaf_path = None
+
+        # Replace the records that were ingested while running with the indexed file
+        if success:
+            self.gaf_path = gaf_path
+            self.load_gaf(replace=False)
 
     def construct_left_control_panel(self):
         self.control_panel_left = QVBoxLayout()
 
+        # Status of the background task, hidden while idle
+        self.progress_label = QLabel("")
+        self.progress_bar = QProgressBar()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_task)
+        self.control_panel_left.addWidget(self.progress_label)
+        self.control_panel_left.addWidget(self.progress_bar)
+        self.control_panel_left.addWidget(self.cancel_button)
+        self.set_progress_visible(False)
+
         button = QPushButton("Open GFA (graph)")
         button.clicked.connect(self.open_gfa)
         self.control_panel_left.addWidget(button)
@@ -669,10 +1350,77 @@ class Window(QWidget):
         button.clicked.connect(self.redraw_graph)
         self.control_panel_left.addWidget(button)
 
+        # Seed segments for the local mode, the selected alignment is used if no names are given
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Neighborhood of:")
+        self.neighborhood_field = QLineEdit("")
+        self.neighborhood_field.setPlaceholderText("selected alignment")
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.neighborhood_field)
+        self.control_panel_left.addLayout(field_layout)
+
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Neighborhood hops:")
+        self.neighborhood_hops_field = QLineEdit(str(self.neighborhood_hops))
+        self.neighborhood_hops_field.textChanged.connect(self.adjust_neighborhood_hops)
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.neighborhood_hops_field)
+        self.control_panel_left.addLayout(field_layout)
+
+        button = QPushButton("Draw neighborhood")
+        button.clicked.connect(self.draw_neighborhood)
+        self.control_panel_left.addWidget(button)
+
+        button = QPushButton("Draw whole graph")
+        button.clicked.connect(self.draw_whole_graph)
+        self.control_panel_left.addWidget(button)
+
         button = QPushButton("Show alignment details")
         button.clicked.connect(self.show_alignment_details)
         self.control_panel_left.addWidget(button)
 
+        # Alignment filters, empty fields are not applied
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Minimum MAPQ:")
+        self.min_map_quality_field = QLineEdit("")
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.min_map_quality_field)
+        self.control_panel_left.addLayout(field_layout)
+
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Minimum aligned length:")
+        self.min_aligned_length_field = QLineEdit("")
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.min_aligned_length_field)
+        self.control_panel_left.addLayout(field_layout)
+
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Minimum identity:")
+        self.min_identity_field = QLineEdit("")
+        self.min_identity_field.setPlaceholderText("0-1")
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.min_identity_field)
+        self.control_panel_left.addLayout(field_layout)
+
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Only queries:")
+        self.filter_query_names_field = QLineEdit("")
+        self.filter_query_names_field.setPlaceholderText("all")
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.filter_query_names_field)
+        self.control_panel_left.addLayout(field_layout)
+
+        self.primary_only_checkbox = QCheckBox("Primary alignments only")
+        self.control_panel_left.addWidget(self.primary_only_checkbox)
+
+        button = QPushButton("Apply alignment filters")
+        button.clicked.connect(self.apply_gaf_filter)
+        self.control_panel_left.addWidget(button)
+
+        button = QPushButton("Show diagnostics")
+        button.clicked.connect(self.show_diagnostics)
+        self.control_panel_left.addWidget(button)
+
         # Node width field
         field_layout = QHBoxLayout()
         field_label = QLabel("Node width:")
@@ -700,6 +1448,45 @@ class Window(QWidget):
         field_layout.addWidget(self.min_node_length_field)
         self.control_panel_left.addLayout(field_layout)
 
+        self.warm_start_checkbox = QCheckBox("Redraw from current layout")
+        self.warm_start_checkbox.setChecked(self.warm_start)
+        self.warm_start_checkbox.stateChanged.connect(self.adjust_warm_start)
+        self.control_panel_left.addWidget(self.warm_start_checkbox)
+
+        self.collapse_chains_checkbox = QCheckBox("Collapse unitig chains")
+        self.collapse_chains_checkbox.setChecked(self.collapse_chains)
+        self.collapse_chains_checkbox.stateChanged.connect(self.adjust_collapse_chains)
+        self.control_panel_left.addWidget(self.collapse_chains_checkbox)
+
+        field_layout = QHBoxLayout()
+        field_label = QLabel("Layout engine:")
+        self.layout_backend_combobox = QComboBox()
+        for backend,label in self.layout_backends:
+            self.layout_backend_combobox.addItem(label, backend)
+        self.layout_backend_combobox.setCurrentIndex(self.layout_backend_combobox.findData(self.layout_backend))
+        self.layout_backend_combobox.currentIndexChanged.connect(self.adjust_layout_backend)
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.layout_backend_combobox)
+        self.control_panel_left.addLayout(field_layout)
+
+        # Sequence storage mode, applied the next time a GFA is opened
+        field_layout = QHBoxLayout()
+        field_label = QLabel("GFA sequences:")
+        self.sequence_mode_combobox = QComboBox()
+        for mode,label in self.sequence_modes:
+            self.sequence_mode_combobox.addItem(label, mode)
+        self.sequence_mode_combobox.currentIndexChanged.connect(self.adjust_sequence_mode)
+        field_layout.addWidget(field_label)
+        field_layout.addWidget(self.sequence_mode_combobox)
+        self.control_panel_left.addLayout(field_layout)
+
+        # Alignments which traverse the node that is selected in the graph view
+        self.node_alignments_label = QLabel("Alignments at selected node:")
+        self.node_alignments_list = QListWidget()
+        self.node_alignments_list.itemClicked.connect(self.on_select_node_alignment)
+        self.control_panel_left.addWidget(self.node_alignments_label)
+        self.control_panel_left.addWidget(self.node_alignments_list)
+
         # field_layout = QHBoxLayout()
         # field_label = QLabel("Graph layout iterations:")
         # self.layout_iterations_field = QLineEdit(str(self.layout_iterations))
@@ -714,21 +1501,28 @@ class Window(QWidget):
 
     def adjust_node_width(self):
         s = self.line_width_field.text()
-        i = self.parse_string_as_numeric_positive_integer(s)
+        i = parse_string_as_numeric_positive_integer(s)
 
         if i is None:
             return
 
         self.line_width = i
+        self.node_pens = dict()
+        self.palettes = dict()
+
+        # Every node goes back to the shared gray pen of the new width, and the selection is colored again from
+        # the new palette
+        pen = self.get_node_pen()
 
         for item in self.qt_nodes.values():
-            pen = item.pen()
-            pen.setWidth(self.line_width)
             item.setPen(pen)
 
+        self.colored_nodes = set()
+        self.on_select_alignment()
+
     def adjust_length_scale_factor(self):
         s = self.length_scale_factor_field.text()
-        i = self.parse_string_as_numeric_positive_integer(s)
+        i = parse_string_as_numeric_positive_integer(s)
 
         if i is None:
             return
@@ -737,16 +1531,37 @@ class Window(QWidget):
 
     def adjust_min_node_length(self):
         s = self.min_node_length_field.text()
-        i = self.parse_string_as_numeric_positive_integer(s)
+        i = parse_string_as_numeric_positive_integer(s)
 
         if i is None:
             return
 
         self.min_node_length = i
 
+    def adjust_neighborhood_hops(self):
+        s = self.neighborhood_hops_field.text()
+        i = parse_string_as_numeric_positive_integer(s)
+
+        if i is None:
+            return
+
+        self.neighborhood_hops = i
+
+    def adjust_warm_start(self):
+        self.warm_start = self.warm_start_checkbox.isChecked()
+
+    def adjust_collapse_chains(self):
+        self.collapse_chains = self.collapse_chains_checkbox.isChecked()
+
+    def adjust_layout_backend(self):
+        self.layout_backend = self.layout_backend_combobox.currentData()
+
+    def adjust_sequence_mode(self):
+        self.sequence_mode = self.sequence_mode_combobox.currentData()
+
     def adjust_layout_iterations(self):
         s = self.length_scale_factor_field.text()
-        i = self.parse_string_as_numeric_positive_integer(s)
+        i = parse_string_as_numeric_positive_integer(s)
 
         if i is None:
             return
@@ -764,7 +1579,7 @@ class Window(QWidget):
             alignment_index = items[0].instance_item
 
             query_name = str(self.gaf_query_combobox.currentText())
-            a = self.alignments[query_name][alignment_index]
+            a = self.get_alignments(query_name)[alignment_index]
 
             d = GafStatsPopup("Alignment details", alignment=a)
             d.exec()
@@ -773,6 +1588,10 @@ class Window(QWidget):
             d = OkPopup("ERROR", "Too many alignments selected, please select one at a time")
             d.exec()
 
+    def show_diagnostics(self):
+        d = DiagnosticsPopup(self.diagnostics)
+        d.exec()
+
     def construct_top_control_panel(self):
         self.top_label = QLabel("Alignments")
         self.control_panel_top = QVBoxLayout()
@@ -797,8 +1616,12 @@ class Window(QWidget):
             self.view_bottom.scale(factor, factor)
             delta = self.view_bottom.mapToScene(view_pos) - self.view_bottom.mapToScene(self.view_bottom.viewport().rect().center())
             self.view_bottom.centerOn(scene_pos - delta)            # do not propagate the event to the scroll area scrollbars
+            self.lod_timer.start()
             return True
 
+        elif source == self.view_bottom.viewport() and event.type() == QEvent.Resize:
+            self.lod_timer.start()
+
         elif event.type() == QEvent.GraphicsSceneMousePress:
             pass
 
@@ -820,239 +1643,169 @@ class Window(QWidget):
 
         return path
 
-    def layout_with_cugraph(self, seed_positions, seed_edges_as_ids, edges_as_ids, id_map, seed_id_map, scale):
-        seed_df = DataFrame(seed_positions, columns=['vertex','x','y'])
-
-        seed_edge_df = DataFrame(seed_edges_as_ids)
-        edge_df = DataFrame(edges_as_ids)
-
-        seed_graph = cuGraph()
-        graph = cuGraph()
-
-        seed_graph.from_cudf_edgelist(seed_edge_df, source=0, destination=1, weight=2)
-        seed_result = force_atlas2(seed_graph, max_iter=1000, pos_list=seed_df, scaling_ratio=8.0, verbose=True)
-
-        print(type(seed_result))
-        print(seed_result.shape)
-
-        initial_positions = list()
-        prev_name = None
-        item = None
-
-        for id,name in id_map:
-            seed_name = name.split('_')[0]
-            seed_id = seed_id_map.get_id(seed_name)
-
-            if seed_name != prev_name:
-                item = seed_result.iloc[seed_id]
-
-            x = item['x']
-            y = item['y']
-            # print(seed_name, item)
-
-            # print(seed_name, x, y)
-
-            initial_positions.append((id,x,y))
-
-            prev_name = seed_name
-
-        print("Loading full graph as CuDF...")
-        initial_positions_df = DataFrame(initial_positions, columns=['vertex','x','y'])
-
-        print()
-        print("Graph layout...")
-
-        print(edge_df.shape)
-
-        graph.from_cudf_edgelist(edge_df, source=0, destination=1, weight=2)
-
-        result = force_atlas2(graph, pos_list=initial_positions_df, max_iter=4000, jitter_tolerance=0.3, scaling_ratio=4.0, verbose=True, barnes_hut_theta=0.90)
-
-        layout = dict()
-        for i in range(len(result["vertex"])):
-            id = int(result["vertex"][i])
-            name = id_map.get_name(id)
-
-            layout[name] = (scale*result['x'][i], scale*result['y'][i])
-
-        return layout
-
-    def layout_with_graphviz(self, edges_as_ids, id_map, scale):
-        graph = networkx.Graph()
-
-        print()
-        print("Graph layout...")
-
-        graph.add_nodes_from(range(len(id_map)))
-
-        for a,b,w in edges_as_ids:
-            graph.add_edge(a,b,weight=w)
-
-        s = random.randint(0,2**16-1)
-        result = networkx.drawing.nx_agraph.graphviz_layout(graph, prog="sfdp", args="-Grepulsiveforce=1.2 -Gstart=%d" % s)
-
-        layout = dict()
-        for id,item in result.items():
-            name = id_map.get_name(id)
-
-            layout[name] = item
-
-        return layout
-
     def draw_graph(self):
-        # interval_size = 500
-
-        seed_edges_as_ids = list()
-        seed_id_map = IncrementalIdMap()
+        graph = self.graph
+        length_scale_factor = self.length_scale_factor
+        min_node_length = self.min_node_length
+        layout_backend = self.layout_backend
+        layout_time_budget = self.layout_time_budget
+        collapse_chains = self.collapse_chains
+        neighborhood = self.neighborhood
 
-        edges_as_ids = list()
-        id_map = IncrementalIdMap()
+        previous_layout = None
+        if self.warm_start and self.layout_neighborhood is None and neighborhood is None:
+            previous_layout = self.graph_layout
 
-        total_length = 0
-        for sequence in self.sequences.values():
-            total_length += len(sequence)
+        def task(progress):
+            if neighborhood is None:
+                return compute_layout(graph, length_scale_factor, min_node_length, progress=progress, in_subprocess=True, write_cache=True, previous_layout=previous_layout, backend=layout_backend, time_budget=layout_time_budget, collapse_chains=collapse_chains), None
 
-        interval_size = (float(total_length)/float(self.length_scale_factor))
+            # Only the subgraph is laid out and drawn, segment_ids maps its segments back to the whole graph
+            set_stage(progress, "Extracting neighborhood")
+            seed_ids, n_hops = neighborhood
+            segment_ids = graph.get_neighborhood(seed_ids, n_hops)
+            subgraph = graph.get_subgraph(segment_ids)
+            add_details(progress, segments=len(segment_ids))
 
-        print("total_length:", total_length)
-        print("length_scale_factor:", self.length_scale_factor)
-        print("interval_size:", interval_size)
+            layout = compute_layout(subgraph, length_scale_factor, min_node_length, progress=progress, in_subprocess=True, read_cache=True, write_cache=True, backend=layout_backend, time_budget=layout_time_budget, collapse_chains=collapse_chains)
 
-        subnodes = defaultdict(list)
+            return layout, segment_ids
 
-        for name,sequence in self.sequences.items():
-            n = max(self.min_node_length,int(round(float(len(sequence)) / float(interval_size))))
-            w = 1
+        self.run_task("Drawing graph", task, lambda result: self.on_graph_drawn(result, neighborhood))
 
-            seed_id_map.add(name)
+    def on_graph_drawn(self, result, neighborhood=None):
+        layout, segment_ids = result
 
-            name_left = name + "_left"
-            name_right = name + "_right"
+        self.clear_scene_bottom()
+        self.populate_scene(layout, neighborhood, segment_ids)
 
-            id_left = id_map.add(name_left)
-            id_right = id_map.add(name_right)
+    def populate_scene(self, layout, neighborhood=None, segment_ids=None):
+        # In local mode the layout only has the segments of the neighborhood, and segment_ids[i] is the id in the
+        # whole graph of its segment i
+        self.graph_layout = layout
+        self.layout_neighborhood = neighborhood
+        self.layout_ids = segment_ids
+        self.progress_label.setText("Populating scene")
 
-            # edges_as_ids.append((id_left,id_right,-0.01))
+        with self.diagnostics.measure("Populating scene", segments=len(layout), points=len(layout.points), edges=len(layout.edge_lines)):
+            self.build_scene_items(layout)
 
-            for i in range(n):
-                name_top = name + "_" + str(i) + "_top"
-                name_bottom = name + "_" + str(i) + "_bottom"
+        self.on_select_gaf_query()
 
-                id_top = id_map.add(name_top)
-                id_bottom = id_map.add(name_bottom)
+    def build_scene_items(self, layout):
+        self.lod = LayoutLod(layout)
+        self.shown_nodes = set()
+        self.edge_tile_items = dict()
+        self.shown_edge_tiles = set()
 
-                # Keep track of which middle pairs of nodes constitute the scaffolding for a given node
-                subnodes[name].append([name_top,name_bottom])
+        # Items are created for every drawn segment so that they can be colored while off screen, but their paths
+        # are only built once they are shown
+        self.qt_nodes = dict()
+        self.colored_nodes = set()
 
-                edges_as_ids.append((id_top,id_bottom,w))
+        pen = self.get_node_pen()
 
-                if i > 0:
-                    prev_id_top = id_map.get_id(name + "_" + str(i-1) + "_top")
-                    prev_id_bottom = id_map.get_id(name + "_" + str(i-1) + "_bottom")
+        local_ids = numpy.flatnonzero(numpy.diff(layout.point_starts))
+        ids = local_ids if self.layout_ids is None else self.layout_ids[local_ids]
 
-                    edges_as_ids.append((id_top, prev_id_top, w))
-                    edges_as_ids.append((id_bottom, prev_id_bottom, w))
-                    edges_as_ids.append((id_top, prev_id_bottom, w))
-                    edges_as_ids.append((id_bottom, prev_id_top, w))
+        for local_id,id in zip(local_ids.tolist(), ids.tolist()):
+            item = QGraphicsPathItem()
+            item.setPen(pen)
+            item.setZValue(1)
+            item.setFlag(QGraphicsItem.ItemIsSelectable)
+            item.node_id = id
+            item.local_id = local_id
+            item.lod_level = None
+            self.qt_nodes[id] = item
 
-                if i == 0:
-                    edges_as_ids.append((id_left, id_top, w))
-                    edges_as_ids.append((id_left, id_bottom, w))
+        # The scene would otherwise only cover the items that happen to be shown
+        x_min, y_min, x_max, y_max = self.lod.get_extent()
+        margin = 2*self.line_width
+        self.scene_bottom.setSceneRect(QRectF(x_min - margin, y_min - margin, x_max - x_min + 2*margin, y_max - y_min + 2*margin))
 
-                if i == n-1:
-                    edges_as_ids.append((id_right, id_top, w))
-                    edges_as_ids.append((id_right, id_bottom, w))
+        self.update_visible_items()
 
-        for edge in self.edges:
-            l_a = len(self.sequences[edge.name_a])
-            l_b = len(self.sequences[edge.name_b])
+    def update_visible_items(self):
+        if self.lod is None:
+            return
 
-            a = None
-            b = None
+        # Half a viewport of margin on each side, so that short scrolls are already drawn
+        rect = self.view_bottom.mapToScene(self.view_bottom.viewport().rect()).boundingRect()
+        x_min = rect.left() - rect.width()/2
+        x_max = rect.right() + rect.width()/2
+        y_min = rect.top() - rect.height()/2
+        y_max = rect.bottom() + rect.height()/2
 
-            if edge.reversal_a:
-                a = edge.name_a + "_left"
-            else:
-                a = edge.name_a + "_right"
+        pixel_size = 1.0/max(abs(self.view_bottom.transform().m11()), 1e-12)
+        level = self.lod.get_level(pixel_size)
 
-            if edge.reversal_b:
-                b = edge.name_b + "_right"
-            else:
-                b = edge.name_b + "_left"
+        visible = self.lod.get_visible_segments(x_min, y_min, x_max, y_max)
+        if self.layout_ids is not None:
+            visible = self.layout_ids[visible]
 
-            a_seed = seed_id_map.get_id(edge.name_a)
-            b_seed = seed_id_map.get_id(edge.name_b)
-            # w_seed = 1 / math.log10(max(len(self.sequences[edge.name_a]), len(self.sequences[edge.name_b])) + 10)
+        visible = set(visible.tolist())
 
-            seed_edges_as_ids.append((a_seed, b_seed, 0.5))
+        for id in self.shown_nodes - visible:
+            self.scene_bottom.removeItem(self.qt_nodes[id])
 
-            edges_as_ids.append((id_map.get_id(a), id_map.get_id(b), 0.5))
+        point_starts, points = self.lod.get_polylines(level)
 
-        print("Loading coarse graph as CuDF...")
+        for id in visible:
+            item = self.qt_nodes[id]
 
-        seed_positions = list()
-        for id,name in seed_id_map:
-            x = random.randint(-50,50)
-            y = random.randint(-50,50)
-            seed_positions.append((id,x,y))
+            if item.lod_level != level:
+                item.setPath(self.build_path(points[point_starts[item.local_id]:point_starts[item.local_id+1]].tolist()))
+                item.lod_level = level
 
-        if self.use_cugraph:
-            scale = 0.03
-            layout = self.layout_with_cugraph(seed_positions, seed_edges_as_ids, edges_as_ids, id_map, seed_id_map, scale)
-        else:
-            scale = 10
-            layout = self.layout_with_graphviz(edges_as_ids, id_map, scale)
+            if id not in self.shown_nodes:
+                self.scene_bottom.addItem(item)
 
-        for edge in self.edges:
-            x_a = None
-            y_a = None
-            x_b = None
-            y_b = None
+        self.shown_nodes = visible
 
-            if edge.reversal_a:
-                x_a,y_a = layout[edge.name_a + "_left"]
-            else:
-                x_a,y_a = layout[edge.name_a + "_right"]
+        visible_tiles = set((level,tile) for tile in self.lod.get_visible_tiles(level, x_min, y_min, x_max, y_max))
 
-            if edge.reversal_b:
-                x_b,y_b = layout[edge.name_b + "_right"]
-            else:
-                x_b,y_b = layout[edge.name_b + "_left"]
+        for key in self.shown_edge_tiles - visible_tiles:
+            self.scene_bottom.removeItem(self.edge_tile_items[key])
 
-            color = QColor(Qt.black)
-            color.setAlphaF(0.7)
+        for key in visible_tiles - self.shown_edge_tiles:
+            if key not in self.edge_tile_items:
+                self.edge_tile_items[key] = self.build_edge_tile(self.lod.get_edge_tiles(level)[key[1]])
 
-            pen = QPen(color)
-            pen.setWidth(max(1,self.line_width//3))
+            self.scene_bottom.addItem(self.edge_tile_items[key])
 
-            item = self.scene_bottom.addLine(QLineF(x_a, y_a, x_b, y_b), pen=pen)
+        self.shown_edge_tiles = visible_tiles
 
-        for name,node_pairs in subnodes.items():
-            start = name + "_left"
-            stop = name + "_right"
+    def build_edge_tile(self, lines):
+        path = QPainterPath()
 
-            points = [layout[start]] + [get_midpoint(layout[a],layout[b]) for a,b in node_pairs] + [layout[stop]]
+        for x_a,y_a,x_b,y_b in lines.tolist():
+            path.moveTo(x_a,y_a)
+            path.lineTo(x_b,y_b)
 
-            path = self.build_path(points)
+        color = QColor(Qt.black)
+        color.setAlphaF(0.7)
 
-            pen = QPen(Qt.gray | Qt.FlatCap | Qt.BevelJoin)
-            pen.setWidth(self.line_width)
-            item = self.scene_bottom.addPath(path, pen)
+        pen = QPen(color)
+        pen.setWidth(max(1,self.line_width//3))
 
-            item.setFlag(QGraphicsItem.ItemIsSelectable)
-            self.qt_nodes[name] = item
+        item = QGraphicsPathItem(path)
+        item.setPen(pen)
+        item.setZValue(0)
 
-        self.scene_bottom.update()
+        return item
 
 
 def main():
-    sys.argv.append("--disable-web-security")
-
     app = QApplication(sys.argv)
     w = Window()
     w.resize(1000,600)
 
     w.show()
+
+    # From the start of the import to the first paint of the empty window
+    app.processEvents()
+    w.diagnostics.stop(w.diagnostics.start("Startup", since=STARTED))
+
     app.exec()
 
 
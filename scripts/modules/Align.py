@@ -110,7 +110,7 @@ def run_panaligner(output_directory, gfa_path, fasta_path, n_threads, args_overr
     return output_path
 
 
-def run_graphaligner(output_directory, gfa_path, fasta_path, n_threads, args_override=None):
+def get_graphaligner_command(output_directory, gfa_path, fasta_path, n_threads, args_override=None):
     output_path = os.path.join(output_directory, "reads_vs_graph.gaf")
 
     # GraphAligner -g test/graph.gfa -f test/read.fa -a test/aln.gaf -x vg
@@ -134,6 +134,12 @@ def run_graphaligner(output_directory, gfa_path, fasta_path, n_threads, args_ove
                 "-f", fasta_path
             ]
 
+    return args, output_path
+
+
+def run_graphaligner(output_directory, gfa_path, fasta_path, n_threads, args_override=None):
+    args, output_path = get_graphaligner_command(output_directory, gfa_path, fasta_path, n_threads, args_override)
+
     sys.stderr.write(" ".join(args)+'\n')
 
     try:
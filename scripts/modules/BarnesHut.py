@@ -0,0 +1,232 @@
+from modules.Task import update_progress
+import numpy
+import time
+
+
+# Quadtree depth, cell coordinates must fit in 16 bits each for the interleaved (Morton) codes
+MAX_DEPTH = 16
+
+# Number of nodes whose tree traversals are vectorized together, bounds the size of the (node, cell) pair arrays
+CHUNK_SIZE = 20000
+
+
+def spread_bits(x):
+    # Inserts a 0 bit between each of the lower 16 bits
+    x = x & 0xFFFF
+    x = (x | (x << 8)) & 0x00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F
+    x = (x | (x << 2)) & 0x33333333
+    x = (x | (x << 1)) & 0x55555555
+
+    return x
+
+
+class QuadTreeLevel:
+    def __init__(self, codes, counts, centroids, size):
+        self.codes = codes
+        self.counts = counts
+        self.centroids = centroids
+        self.size = size
+
+        # Range of child cells in the next level, for each cell of this level
+        self.child_starts = None
+        self.child_stops = None
+
+
+class QuadTree:
+    def __init__(self, positions, depth=MAX_DEPTH):
+        # Cells at each level are found from prefixes of the nodes' Morton codes, which all stay sorted
+        # after a single sort at the finest level
+        self.depth = depth
+
+        low = positions.min(axis=0)
+        size = float((positions.max(axis=0) - low).max())
+        if size == 0:
+            size = 1.0
+
+        n_cells = 1 << depth
+        grid = numpy.minimum(((positions - low)/size*n_cells).astype(numpy.int64), n_cells - 1)
+
+        self.node_codes = spread_bits(grid[:,0]) | (spread_bits(grid[:,1]) << 1)
+
+        self.order = numpy.argsort(self.node_codes, kind="stable")
+        sorted_codes = self.node_codes[self.order]
+        sorted_positions = positions[self.order]
+
+        self.levels = list()
+
+        for l in range(depth + 1):
+            codes = sorted_codes >> (2*(depth - l))
+
+            starts = numpy.concatenate([[0], numpy.flatnonzero(codes[1:] != codes[:-1]) + 1])
+            counts = numpy.diff(numpy.concatenate([starts, [len(codes)]]))
+            centroids = numpy.add.reduceat(sorted_positions, starts, axis=0)/counts[:,None]
+
+            self.levels.append(QuadTreeLevel(codes[starts], counts, centroids, size/(1 << l)))
+
+        for l in range(depth):
+            parent_codes = self.levels[l + 1].codes >> 2
+
+            self.levels[l].child_starts = numpy.searchsorted(parent_codes, self.levels[l].codes, side="left")
+            self.levels[l].child_stops = numpy.searchsorted(parent_codes, self.levels[l].codes, side="right")
+
+    def get_repulsion(self, positions, k, theta, nodes):
+        # Force on each of the given nodes from all others, with magnitude mass*k^2/distance. A cell is treated as a
+        # single mass at its centroid when it is small relative to its distance (size/distance < theta).
+        force = numpy.zeros((len(nodes),2), dtype=numpy.float64)
+
+        # Positions and codes are carried along with the pairs rather than gathered again at every level
+        pair_nodes = numpy.arange(len(nodes))
+        pair_cells = numpy.zeros(len(nodes), dtype=numpy.int64)
+        pair_positions = positions[nodes]
+        pair_codes = self.node_codes[nodes]
+
+        min_distance2 = (0.01*k)**2
+
+        for l,level in enumerate(self.levels):
+            if len(pair_nodes) == 0:
+                break
+
+            mass = level.counts[pair_cells]
+            centroid = level.centroids[pair_cells]
+
+            contains_self = (pair_codes >> (2*(self.depth - l))) == level.codes[pair_cells]
+
+            # The node's own contribution is removed from the cell that contains it
+            own_mass = mass - contains_self
+            corrected = numpy.flatnonzero(contains_self & (own_mass > 0))
+            centroid[corrected] = (centroid[corrected]*mass[corrected,None] - pair_positions[corrected])/own_mass[corrected,None]
+
+            diff = pair_positions - centroid
+            distance2 = diff[:,0]*diff[:,0] + diff[:,1]*diff[:,1]
+
+            if l == self.depth:
+                accept = own_mass > 0
+            else:
+                # A cell holding a single other node is exact, and cells containing the node are always opened
+                accept = (~contains_self) & ((level.size*level.size < theta*theta*distance2) | (mass == 1))
+
+            scale = own_mass[accept]*(k*k)/numpy.maximum(distance2[accept], min_distance2)
+            accepted_nodes = pair_nodes[accept]
+
+            force[:,0] += numpy.bincount(accepted_nodes, weights=diff[accept,0]*scale, minlength=len(nodes))
+            force[:,1] += numpy.bincount(accepted_nodes, weights=diff[accept,1]*scale, minlength=len(nodes))
+
+            if l == self.depth:
+                break
+
+            opened = numpy.flatnonzero((~accept) & (own_mass > 0))
+            starts = level.child_starts[pair_cells[opened]]
+            counts = level.child_stops[pair_cells[opened]] - starts
+
+            pair_nodes = numpy.repeat(pair_nodes[opened], counts)
+            pair_positions = numpy.repeat(pair_positions[opened], counts, axis=0)
+            pair_codes = numpy.repeat(pair_codes[opened], counts)
+
+            offsets = numpy.arange(len(pair_nodes)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+            pair_cells = numpy.repeat(starts, counts) + offsets
+
+        return force
+
+
+def get_repulsion(positions, k, theta=0.9):
+    tree = QuadTree(positions)
+    force = numpy.zeros_like(positions)
+
+    # Chunks of nearby nodes (in Morton order) visit mostly the same cells
+    for start in range(0, len(positions), CHUNK_SIZE):
+        nodes = tree.order[start:start + CHUNK_SIZE]
+        force[nodes] = tree.get_repulsion(positions, k, theta, nodes)
+
+    return force
+
+
+def layout_barnes_hut(n, edges, weights=None, positions=None, edge_length=4.0, iterations=300, time_budget=None, theta=0.9, callback=None, progress=None):
+    # Fruchterman-Reingold forces with Barnes-Hut repulsion. Starts from the given positions if any, and stops after
+    # the number of iterations, the time budget (seconds), or when callback(iteration, positions) returns True.
+    k = edge_length
+
+    if positions is None:
+        positions = numpy.random.uniform(-0.5, 0.5, size=(n,2))*numpy.sqrt(n)*k
+    else:
+        positions = numpy.array(positions, dtype=numpy.float64)
+
+    if n < 2:
+        return positions
+
+    edges = numpy.asarray(edges, dtype=numpy.int64).reshape((-1,2))
+    a = edges[:,0]
+    b = edges[:,1]
+
+    # Cools from a fraction of the layout extent down to a fraction of the edge length
+    extent = float((positions.max(axis=0) - positions.min(axis=0)).max())
+    start_temperature = max(0.1*extent, k)
+    stop_temperature = 0.01*k
+    cooling = (stop_temperature/start_temperature)**(1.0/max(1, iterations - 1))
+
+    temperature = start_temperature
+    start_time = time.monotonic()
+
+    for i in range(iterations):
+        update_progress(progress, i, iterations)
+
+        displacement = get_repulsion(positions, k, theta)
+
+        d = positions[b] - positions[a]
+        distance = numpy.sqrt((d**2).sum(axis=1))
+        f = d*(distance/k)[:,None]
+
+        if weights is not None:
+            f *= weights[:,None]
+
+        for axis in range(2):
+            displacement[:,axis] += numpy.bincount(a, weights=f[:,axis], minlength=n) - numpy.bincount(b, weights=f[:,axis], minlength=n)
+
+        length = numpy.sqrt((displacement**2).sum(axis=1))
+        length[length == 0] = 1
+
+        positions += displacement*(numpy.minimum(length, temperature)/length)[:,None]
+        temperature *= cooling
+
+        if callback is not None and callback(i, positions):
+            break
+
+        if time_budget is not None and time.monotonic() - start_time > time_budget:
+            break
+
+    return positions
+
+
+def test():
+    positions = numpy.random.uniform(-100, 100, size=(500,2))
+    positions[1] = positions[0]
+
+    k = 4.0
+    approximate = get_repulsion(positions, k, theta=0.5)
+
+    diff = positions[:,None,:] - positions[None,:,:]
+    distance2 = numpy.maximum((diff**2).sum(axis=2), (0.01*k)**2)
+    numpy.fill_diagonal(distance2, numpy.inf)
+    exact = (diff*(k*k/distance2)[:,:,None]).sum(axis=1)
+
+    error = numpy.sqrt(((approximate - exact)**2).sum(axis=1))/numpy.sqrt((exact**2).sum(axis=1))
+
+    if not numpy.median(error) < 0.05:
+        raise Exception("ERROR: Barnes-Hut repulsion differs from exact: median relative error " + str(numpy.median(error)))
+
+    # A path should unfold to roughly its length in edges
+    n = 50
+    edges = numpy.stack([numpy.arange(n - 1), numpy.arange(1, n)], axis=1)
+    iterations = list()
+
+    positions = layout_barnes_hut(n, edges, edge_length=k, iterations=200, callback=lambda i,p: iterations.append(i))
+    distance = numpy.sqrt(((positions[edges[:,0]] - positions[edges[:,1]])**2).sum(axis=1))
+
+    if not (len(iterations) == 200 and 0.5*k < numpy.median(distance) < 4*k):
+        raise Exception("ERROR: unexpected path layout, median edge length: " + str(numpy.median(distance)))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
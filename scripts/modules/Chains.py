@@ -0,0 +1,242 @@
+from modules.Gfa import GfaGraph
+import numpy
+
+
+def get_side_ids(edge_a, reversal_a, edge_b, reversal_b):
+    # Each segment has a left (2*id) and right (2*id + 1) side, an edge leaves a from one and enters b at another
+    side_a = 2*edge_a + numpy.where(reversal_a, 0, 1)
+    side_b = 2*edge_b + numpy.where(reversal_b, 1, 0)
+
+    return side_a, side_b
+
+
+def find_unitig_chains(n_segments, edge_a, reversal_a, edge_b, reversal_b):
+    # Groups segments into maximal non-branching paths: two segments are merged when the sides that the edge joins
+    # have no other edges. Returns the chain id of each segment, its rank along the chain, and whether it is
+    # traversed from right to left.
+    edge_a = numpy.asarray(edge_a, dtype=numpy.int64)
+    edge_b = numpy.asarray(edge_b, dtype=numpy.int64)
+    side_a, side_b = get_side_ids(edge_a, numpy.asarray(reversal_a, dtype=bool), edge_b, numpy.asarray(reversal_b, dtype=bool))
+
+    degree = numpy.bincount(numpy.concatenate([side_a, side_b]), minlength=2*n_segments)
+    joinable = (degree[side_a] == 1) & (degree[side_b] == 1) & (edge_a != edge_b)
+
+    partner = numpy.full(2*n_segments, -1, dtype=numpy.int64)
+    partner[side_a[joinable]] = side_b[joinable]
+    partner[side_b[joinable]] = side_a[joinable]
+
+    partner = partner.tolist()
+    chain_ids = [-1]*n_segments
+    ranks = [0]*n_segments
+    reversals = [False]*n_segments
+
+    # Walk from chain ends first, whatever is left after that is a cycle, which can start anywhere
+    has_left = [p >= 0 for p in partner[0::2]]
+    has_right = [p >= 0 for p in partner[1::2]]
+    starts = [s for s in range(n_segments) if not (has_left[s] and has_right[s])]
+
+    n_chains = 0
+    for start in starts + list(range(n_segments)):
+        if chain_ids[start] >= 0:
+            continue
+
+        # Leave through whichever side is connected, if any
+        side = 2*start if has_left[start] and not has_right[start] else 2*start + 1
+        s = start
+        rank = 0
+
+        while chain_ids[s] < 0:
+            chain_ids[s] = n_chains
+            ranks[s] = rank
+            reversals[s] = side % 2 == 0
+            rank += 1
+
+            next_side = partner[side]
+            if next_side < 0:
+                break
+
+            s = next_side//2
+            side = next_side ^ 1
+
+        n_chains += 1
+
+    return numpy.array(chain_ids, dtype=numpy.int64), numpy.array(ranks, dtype=numpy.int64), numpy.array(reversals, dtype=bool)
+
+
+class ChainCollapse:
+    def __init__(self, graph):
+        # Replaces every unitig chain of the graph by a single segment, of the combined length. The chain is named
+        # after its first segment, and its left end is the left end of the chain in walking order.
+        self.graph = graph
+
+        edge_a = numpy.asarray(graph.edge_a, dtype=numpy.int64)
+        edge_b = numpy.asarray(graph.edge_b, dtype=numpy.int64)
+        reversal_a = numpy.asarray(graph.edge_reversal_a, dtype=bool)
+        reversal_b = numpy.asarray(graph.edge_reversal_b, dtype=bool)
+
+        self.chain_ids, self.ranks, self.reversals = find_unitig_chains(len(graph), edge_a, reversal_a, edge_b, reversal_b)
+
+        n_chains = int(self.chain_ids.max()) + 1 if len(graph) > 0 else 0
+
+        # Segments of chain c in walking order are chain_segments[chain_starts[c]:chain_starts[c+1]]
+        self.chain_segments = numpy.lexsort((self.ranks, self.chain_ids))
+        self.chain_starts = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(self.chain_ids, minlength=n_chains))]).astype(numpy.int64)
+
+        lengths = numpy.asarray(graph.lengths, dtype=numpy.int64)
+        chain_lengths = numpy.bincount(self.chain_ids, weights=lengths, minlength=n_chains).astype(numpy.int64)
+
+        # Position of each segment along its chain, as a fraction of the chain length
+        offsets = numpy.zeros(len(graph), dtype=numpy.int64)
+        ordered_lengths = lengths[self.chain_segments]
+        cumulative = numpy.cumsum(ordered_lengths) - ordered_lengths
+        offsets[self.chain_segments] = cumulative - cumulative[self.chain_starts[self.chain_ids[self.chain_segments]]]
+
+        total = chain_lengths[self.chain_ids].astype(numpy.float64)
+        counts = numpy.diff(self.chain_starts)[self.chain_ids]
+
+        # Chains without any length fall back on splitting by rank
+        has_length = total > 0
+        self.fraction_starts = numpy.where(has_length, offsets/numpy.maximum(total, 1), self.ranks/counts)
+        self.fraction_stops = numpy.where(has_length, (offsets + lengths)/numpy.maximum(total, 1), (self.ranks + 1)/counts)
+
+        # Only edges between consecutive segments of a chain are absorbed, all others are kept between chain ends
+        side_a, side_b = get_side_ids(edge_a, reversal_a, edge_b, reversal_b)
+        exit_sides = 2*numpy.arange(len(graph)) + numpy.where(self.reversals, 0, 1)
+        entry_sides = exit_sides ^ 1
+
+        same_chain = self.chain_ids[edge_a] == self.chain_ids[edge_b]
+        forward = (self.ranks[edge_b] == self.ranks[edge_a] + 1) & (side_a == exit_sides[edge_a]) & (side_b == entry_sides[edge_b])
+        backward = (self.ranks[edge_a] == self.ranks[edge_b] + 1) & (side_b == exit_sides[edge_b]) & (side_a == entry_sides[edge_a])
+        internal = same_chain & (forward | backward)
+
+        kept = ~internal
+
+        # A side is on the left of the chain if it is the left side of a segment in walking direction
+        chain_left_a = (side_a[kept] % 2 == 0) != self.reversals[edge_a[kept]]
+        chain_left_b = (side_b[kept] % 2 == 0) != self.reversals[edge_b[kept]]
+
+        collapsed = GfaGraph()
+        for c in range(n_chains):
+            collapsed.id_map.add(graph.id_map.id_to_name[self.chain_segments[self.chain_starts[c]]])
+
+        collapsed.lengths = chain_lengths
+        collapsed.edge_a = self.chain_ids[edge_a[kept]].astype(numpy.int32)
+        collapsed.edge_b = self.chain_ids[edge_b[kept]].astype(numpy.int32)
+        collapsed.edge_reversal_a = chain_left_a
+        collapsed.edge_reversal_b = ~chain_left_b
+
+        self.collapsed = collapsed
+
+    def expand_polylines(self, chain_point_starts, chain_points):
+        # Cuts each chain polyline into the pieces that belong to its segments, by length. Points are interpolated
+        # at the cuts and the existing points in between are kept.
+        chain_counts = numpy.diff(chain_point_starts)[self.chain_ids]
+        base = chain_point_starts[self.chain_ids]
+
+        t_starts = self.fraction_starts*(chain_counts - 1)
+        t_stops = self.fraction_stops*(chain_counts - 1)
+
+        first_inner = numpy.floor(t_starts).astype(numpy.int64) + 1
+        last_inner = numpy.ceil(t_stops).astype(numpy.int64) - 1
+        counts = numpy.maximum(0, last_inner - first_inner + 1) + 2
+
+        point_starts = numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64)
+        segments = numpy.repeat(numpy.arange(len(counts)), counts)
+        k = numpy.arange(point_starts[-1]) - point_starts[segments]
+
+        # Segments that are walked right to left take their piece backwards
+        k = numpy.where(self.reversals[segments], counts[segments] - 1 - k, k)
+
+        t = numpy.where(k == 0, t_starts[segments], numpy.where(k == counts[segments] - 1, t_stops[segments], first_inner[segments] + k - 1))
+
+        i = numpy.minimum(numpy.floor(t).astype(numpy.int64), numpy.maximum(chain_counts[segments] - 2, 0))
+        f = (t - i)[:,None]
+        j = numpy.minimum(i + 1, chain_counts[segments] - 1)
+
+        points = chain_points[base[segments] + i]*(1 - f) + chain_points[base[segments] + j]*f
+
+        return point_starts, points
+
+    def merge_polylines(self, point_starts, points):
+        # The reverse of expand_polylines, joins the segment polylines of each chain in walking order
+        counts = numpy.diff(point_starts)
+        ordered = self.chain_segments
+
+        ordered_counts = counts[ordered]
+        segments = numpy.repeat(ordered, ordered_counts)
+        k = numpy.arange(ordered_counts.sum()) - numpy.repeat(numpy.cumsum(ordered_counts) - ordered_counts, ordered_counts)
+
+        index = numpy.where(self.reversals[segments], point_starts[segments + 1] - 1 - k, point_starts[segments] + k)
+
+        chain_counts = numpy.bincount(self.chain_ids, weights=counts, minlength=len(self.chain_starts) - 1).astype(numpy.int64)
+        chain_point_starts = numpy.concatenate([[0], numpy.cumsum(chain_counts)]).astype(numpy.int64)
+
+        return chain_point_starts, points[index]
+
+
+def test():
+    # Two chains a-b-c and d-e joined through a branching node x: a+ b+ c+ x+ d+ e+, x+ a+
+    names = ["a","b","c","x","d","e"]
+    edges = [(0,1),(1,2),(2,3),(3,4),(4,5),(3,0)]
+
+    edge_a = numpy.array([a for a,b in edges])
+    edge_b = numpy.array([b for a,b in edges])
+    reversals = numpy.zeros(len(edges), dtype=bool)
+
+    chain_ids, ranks, segment_reversals = find_unitig_chains(len(names), edge_a, reversals, edge_b, reversals)
+
+    chains = dict()
+    for name,c,r in zip(names, chain_ids.tolist(), ranks.tolist()):
+        chains.setdefault(c, list()).append((r,name))
+
+    result = sorted("".join(name for r,name in sorted(chain)) for chain in chains.values())
+
+    # x has two edges on its right side, so it can't be joined to d or a
+    if not result == ["abcx", "de"]:
+        raise Exception("ERROR: unexpected chains: " + str(result))
+
+    # A cycle is a single chain
+    edge_a = numpy.array([0,1,2])
+    edge_b = numpy.array([1,2,0])
+    reversals = numpy.zeros(3, dtype=bool)
+    chain_ids, ranks, segment_reversals = find_unitig_chains(3, edge_a, reversals, edge_b, reversals)
+
+    if not len(set(chain_ids.tolist())) == 1 or not sorted(ranks.tolist()) == [0,1,2]:
+        raise Exception("ERROR: unexpected cycle chain: " + str(chain_ids) + " " + str(ranks))
+
+    # p+ q- r+ with lengths 1,2,1: a single chain in which q is walked backwards, and the cycle-closing edge
+    # r+ p+ is kept as a self edge of the chain
+    graph = GfaGraph()
+    for name in ["p","q","r"]:
+        graph.id_map.add(name)
+
+    graph.lengths = numpy.array([1,2,1])
+    graph.edge_a = numpy.array([0,1,2])
+    graph.edge_b = numpy.array([1,2,0])
+    graph.edge_reversal_a = numpy.array([False,True,False])
+    graph.edge_reversal_b = numpy.array([True,False,False])
+
+    collapse = ChainCollapse(graph)
+
+    if not (len(collapse.collapsed) == 1 and collapse.collapsed.get_edge_count() == 1 and collapse.reversals.tolist() == [False,True,False]):
+        raise Exception("ERROR: unexpected collapsed graph")
+
+    # A straight chain polyline from x=0 to x=4 is split at x=1 and x=3, and q runs from right to left
+    chain_points = numpy.array([[0,0],[1,0],[2,0],[3,0],[4,0]], dtype=numpy.float64)
+    point_starts, points = collapse.expand_polylines(numpy.array([0,5]), chain_points)
+
+    result = [points[point_starts[s]:point_starts[s+1],0].tolist() for s in range(3)]
+
+    if not result == [[0,1], [3,2,1], [3,4]]:
+        raise Exception("ERROR: unexpected segment polylines: " + str(result))
+
+    chain_point_starts, merged = collapse.merge_polylines(point_starts, points)
+
+    if not merged[:,0].tolist() == [0,1,1,2,3,3,4]:
+        raise Exception("ERROR: unexpected merged polyline: " + str(merged[:,0].tolist()))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
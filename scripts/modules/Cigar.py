@@ -0,0 +1,161 @@
+import numpy
+
+
+# Operation codes are the index of each character in this string
+CIGAR_OPERATIONS = "MIDNSHP=X"
+
+M, I, D, N, S, H, P, EQUAL, X = range(len(CIGAR_OPERATIONS))
+
+REFERENCE_MOVES = numpy.array([True, False, True, True, False, False, False, True, True])
+QUERY_MOVES = numpy.array([True, True, False, False, True, False, False, True, True])
+
+# Byte value -> operation code, -1 for digits and -2 for anything that is not allowed in a cigar
+OPERATION_LUT = numpy.full(256, -2, dtype=numpy.int8)
+OPERATION_LUT[ord('0'):ord('9')+1] = -1
+for c,character in enumerate(CIGAR_OPERATIONS):
+    OPERATION_LUT[ord(character)] = c
+
+
+class CigarStats:
+    __slots__ = ("n_match", "n_mismatch", "n_insert", "n_delete", "n_aligned", "ref_span", "query_span")
+
+    def __init__(self, operation_counts):
+        self.n_match = int(operation_counts[EQUAL])
+        self.n_mismatch = int(operation_counts[X])
+        self.n_insert = int(operation_counts[I])
+        self.n_delete = int(operation_counts[D])
+
+        # Ambiguous match/mismatch, as reported by aligners that don't output =/X
+        self.n_aligned = int(operation_counts[M])
+
+        self.ref_span = int(numpy.dot(operation_counts, REFERENCE_MOVES))
+        self.query_span = int(numpy.dot(operation_counts, QUERY_MOVES))
+
+    def get_identity(self):
+        total = self.n_match + self.n_mismatch + self.n_insert + self.n_delete
+
+        if total == 0:
+            return 0.0
+
+        return float(self.n_match) / float(total)
+
+
+def parse_cigar_buffer(buffer):
+    # Vectorized parse of one or more concatenated cigars, returns the operation codes, their lengths and
+    # the position of each operation character in the buffer
+    characters = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    codes = OPERATION_LUT[characters]
+
+    if (codes == -2).any():
+        raise Exception("ERROR: cigar string contains unrecognized character")
+
+    is_operation = codes >= 0
+    positions = numpy.flatnonzero(is_operation)
+
+    if len(positions) == 0 and len(characters) == 0:
+        return numpy.zeros(0, dtype=numpy.uint8), numpy.zeros(0, dtype=numpy.int64), positions
+
+    if len(positions) == 0 or positions[-1] != len(characters) - 1:
+        raise Exception("ERROR: cigar string ends with a length that has no operation")
+
+    # Every operation must be preceded by at least one digit
+    previous = numpy.concatenate([[-1], positions[:-1]])
+    if ((positions - previous) < 2).any():
+        raise Exception("ERROR: cigar string contains impossible sequence of numeric and alphabetic characters")
+
+    # Each digit contributes d*10^k to the operation that follows it, where k is its distance from that operation
+    digit_positions = numpy.flatnonzero(~is_operation)
+    owner = numpy.searchsorted(positions, digit_positions)
+    powers = positions[owner] - 1 - digit_positions
+    values = (characters[digit_positions] - ord('0')).astype(numpy.int64) * (10 ** powers.astype(numpy.int64))
+
+    lengths = numpy.bincount(owner, weights=values, minlength=len(positions)).astype(numpy.int64)
+
+    return codes[positions].astype(numpy.uint8), lengths, positions
+
+
+def parse_cigar(cigar_string):
+    if isinstance(cigar_string, str):
+        cigar_string = cigar_string.encode("ascii")
+
+    operations, lengths, positions = parse_cigar_buffer(cigar_string)
+
+    return operations, lengths
+
+
+def count_operations(operations, lengths):
+    return numpy.bincount(operations, weights=lengths, minlength=len(CIGAR_OPERATIONS)).astype(numpy.int64)
+
+
+def get_cigar_stats(cigar_string):
+    return CigarStats(count_operations(*parse_cigar(cigar_string)))
+
+
+def count_operations_bulk(cigar_strings):
+    # Parses many cigars in one pass and returns an (n, len(CIGAR_OPERATIONS)) matrix of summed operation lengths
+    n = len(cigar_strings)
+
+    if n == 0:
+        return numpy.zeros((0, len(CIGAR_OPERATIONS)), dtype=numpy.int64)
+
+    encoded = [c.encode("ascii") if isinstance(c, str) else c for c in cigar_strings]
+    boundaries = numpy.cumsum(numpy.array([len(c) for c in encoded], dtype=numpy.int64))
+
+    buffer = b"".join(encoded)
+    operations, lengths, positions = parse_cigar_buffer(buffer)
+
+    # Digits at the end of one cigar would otherwise be attributed to the first operation of the next one
+    ends = boundaries[numpy.diff(numpy.concatenate([[0], boundaries])) > 0] - 1
+    if (OPERATION_LUT[numpy.frombuffer(buffer, dtype=numpy.uint8)[ends]] < 0).any():
+        raise Exception("ERROR: cigar string ends with a length that has no operation")
+
+    # An operation belongs to the first cigar whose end lies beyond its position
+    owner = numpy.searchsorted(boundaries, positions, side="right")
+
+    counts = numpy.bincount(
+        owner*len(CIGAR_OPERATIONS) + operations,
+        weights=lengths,
+        minlength=n*len(CIGAR_OPERATIONS)
+    )
+
+    return counts.astype(numpy.int64).reshape((n, len(CIGAR_OPERATIONS)))
+
+
+def test():
+    operations, lengths = parse_cigar("10=2X3I1D4=")
+
+    result = [(CIGAR_OPERATIONS[o], int(l)) for o,l in zip(operations, lengths)]
+    if not result == [('=', 10), ('X', 2), ('I', 3), ('D', 1), ('=', 4)]:
+        raise Exception("ERROR: unexpected parse: " + str(result))
+
+    stats = get_cigar_stats("10=2X3I1D4=")
+    if not (stats.n_match, stats.n_mismatch, stats.n_insert, stats.n_delete) == (14, 2, 3, 1):
+        raise Exception("ERROR: unexpected stats")
+
+    if not (stats.ref_span, stats.query_span) == (17, 19):
+        raise Exception("ERROR: unexpected spans: %d %d" % (stats.ref_span, stats.query_span))
+
+    counts = count_operations_bulk(["100M", "", "5S12=", "123456X"])
+    if not (counts[0][M] == 100 and counts[1].sum() == 0 and counts[2][S] == 5 and counts[2][EQUAL] == 12 and counts[3][X] == 123456):
+        raise Exception("ERROR: unexpected bulk counts: " + str(counts))
+
+    counts = count_operations_bulk([])
+    if not counts.shape == (0, len(CIGAR_OPERATIONS)):
+        raise Exception("ERROR: unexpected bulk counts for no cigars: " + str(counts.shape))
+
+    for bad in ["=10", "10==", "10Q", "10", ["10", "M"]]:
+        try:
+            if isinstance(bad, list):
+                count_operations_bulk(bad)
+            else:
+                parse_cigar(bad)
+        except Exception:
+            continue
+
+        raise Exception("ERROR: malformed cigar was accepted: " + str(bad))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,219 @@
+from collections import deque
+import contextlib
+import threading
+import resource
+import json
+import time
+import sys
+import os
+
+
+def get_rss_mb():
+    # Current resident set size, where /proc is available
+    try:
+        with open("/proc/self/statm", 'r') as file:
+            n_pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return n_pages*os.sysconf("SC_PAGE_SIZE")/2**20
+
+
+def get_peak_rss_mb():
+    # The larger of the peak of this process and that of its largest subprocess (e.g. a layout worker), once it has
+    # exited, so that stages which run in subprocesses are not reported at the peak of the GUI
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    # Bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak/2**20
+
+    return peak/2**10
+
+
+def get_cpu_seconds():
+    # CPU time of the calling thread only, so that stages running concurrently in other threads (e.g. the GUI thread
+    # while a task runs) are not counted. Includes subprocesses (e.g. graphviz layout, or render workers), once they
+    # have exited.
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.thread_time() + children.ru_utime + children.ru_stime
+
+
+class StageRecord:
+    def __init__(self, name, task=None, details=None, since=None):
+        # If since (a perf_counter() time) is given, the stage is taken to have begun then, and its CPU time is
+        # counted from the start of the process. This is for startup, which begins before anything can be recorded.
+        self.name = name
+        self.task = task
+        self.details = dict() if details is None else details
+        self.thread = threading.current_thread().name
+
+        self.started = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = get_cpu_seconds()
+        self.peak_start = get_peak_rss_mb()
+
+        if since is not None:
+            self.started -= self.wall_start - since
+            self.wall_start = since
+            self.cpu_start = 0.0
+            self.peak_start = 0.0
+
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.rss_mb = None
+        self.peak_rss_mb = None
+        self.peak_increase_mb = None
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self.wall_start
+        self.cpu_seconds = get_cpu_seconds() - self.cpu_start
+        self.rss_mb = get_rss_mb()
+        self.peak_rss_mb = get_peak_rss_mb()
+
+        # Only non-zero if the process reached a new peak during this stage
+        self.peak_increase_mb = max(0.0, self.peak_rss_mb - self.peak_start)
+
+    def is_running(self):
+        return self.wall_seconds is None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "task": self.task,
+            "thread": self.thread,
+            "started": self.started,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "rss_mb": self.rss_mb,
+            "peak_rss_mb": self.peak_rss_mb,
+            "peak_increase_mb": self.peak_increase_mb,
+            "details": self.details
+        }
+
+
+class Diagnostics:
+    def __init__(self, max_records=10000):
+        # Records are appended from the GUI thread and from task threads. Only the most recent max_records are kept,
+        # because some stages (e.g. recoloring) repeat for as long as the program runs.
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        self.created = time.time()
+
+    def start(self, name, task=None, since=None, **details):
+        record = StageRecord(name, task=task, details=details, since=since)
+
+        with self.lock:
+            self.records.append(record)
+
+        return record
+
+    def stop(self, record):
+        if record.is_running():
+            record.stop()
+
+    @contextlib.contextmanager
+    def measure(self, name, task=None, **details):
+        record = self.start(name, task=task, **details)
+
+        try:
+            yield record
+        finally:
+            self.stop(record)
+
+    def get_records(self):
+        with self.lock:
+            return list(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def get_totals(self):
+        # Finished records summed by (task, name), in order of first appearance
+        totals = dict()
+
+        for record in self.get_records():
+            if record.is_running():
+                continue
+
+            key = (record.task, record.name)
+
+            if key not in totals:
+                totals[key] = {"task": record.task, "name": record.name, "count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": 0.0}
+
+            total = totals[key]
+            total["count"] += 1
+            total["wall_seconds"] += record.wall_seconds
+            total["cpu_seconds"] += record.cpu_seconds
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], record.peak_rss_mb)
+
+        return list(totals.values())
+
+    def to_dict(self):
+        return {
+            "created": self.created,
+            "pid": os.getpid(),
+            "rss_mb": get_rss_mb(),
+            "peak_rss_mb": get_peak_rss_mb(),
+            "totals": self.get_totals(),
+            "stages": [record.to_dict() for record in self.get_records()]
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+def test():
+    diagnostics = Diagnostics(max_records=3)
+
+    with diagnostics.measure("sum", n=10**6) as record:
+        total = sum(range(10**6))
+
+    if not (total == 499999500000 and not record.is_running()):
+        raise Exception("ERROR: measured stage did not run or stop")
+
+    if not (record.wall_seconds > 0 and record.cpu_seconds >= 0 and record.peak_rss_mb > 0):
+        raise Exception("ERROR: unexpected measurements: " + str(record.to_dict()))
+
+    if record.details != {"n": 10**6}:
+        raise Exception("ERROR: unexpected details: " + str(record.details))
+
+    try:
+        with diagnostics.measure("failing"):
+            raise ValueError()
+    except ValueError:
+        pass
+
+    if diagnostics.get_records()[-1].is_running():
+        raise Exception("ERROR: stage is still running after an exception")
+
+    for i in range(3):
+        with diagnostics.measure("repeated", task="loop"):
+            pass
+
+    records = diagnostics.get_records()
+    if not (len(records) == 3 and all(r.name == "repeated" for r in records)):
+        raise Exception("ERROR: unexpected records: " + str([r.name for r in records]))
+
+    totals = diagnostics.get_totals()
+    if not (len(totals) == 1 and totals[0]["count"] == 3 and totals[0]["task"] == "loop"):
+        raise Exception("ERROR: unexpected totals: " + str(totals))
+
+    # Peak memory includes subprocesses that have exited
+    import subprocess
+    subprocess.run([sys.executable, "-c", "b = bytearray(300*2**20); b[::4096] = b'x'*len(b[::4096])"], check=True)
+
+    if get_peak_rss_mb() < 300:
+        raise Exception("ERROR: peak memory does not include subprocesses: " + str(get_peak_rss_mb()))
+
+    report = json.loads(json.dumps(diagnostics.to_dict()))
+    if len(report["stages"]) != 3:
+        raise Exception("ERROR: unexpected number of stages in report: " + str(len(report["stages"])))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,64 +1,52 @@
+from modules.IncrementalIdMap import IncrementalIdMap
+from modules.Cigar import CIGAR_OPERATIONS, REFERENCE_MOVES, QUERY_MOVES, CigarStats, parse_cigar, count_operations, count_operations_bulk, get_cigar_stats
+from array import array
+import numpy
 import sys
+import os
+import re
+
+
+# Orientation (optional, for stable coordinate paths) followed by the node name
+PATH_PATTERN = re.compile(r'([<>]?)([^<>]+)')
+
+
+# Cigars up to this many characters are parsed with a regex, which is faster than the vectorized parser for short
+# strings because the latter has a fixed cost per call
+MAX_REGEX_CIGAR_LENGTH = 512
+
+CIGAR_PATTERN = re.compile(r'(\d+)([' + re.escape(CIGAR_OPERATIONS) + r'])')
 
 
 def parse_cigar_as_tuples(cigar_string):
-    operations = list()
+    if isinstance(cigar_string, str) and len(cigar_string) <= MAX_REGEX_CIGAR_LENGTH:
+        operations = CIGAR_PATTERN.findall(cigar_string)
 
-    length_string = ""
-    prev_is_numeric = True
+        # Matches don't overlap, so they cover the whole string only if it is well formed. Otherwise the
+        # vectorized parser reports the error.
+        if sum(len(l) + 1 for l,o in operations) == len(cigar_string):
+            return [(o, int(l)) for l,o in operations]
 
-    for i,c in enumerate(cigar_string):
-        if c.isalpha() or c == '=':
-            if i > 0 and not prev_is_numeric:
-                exit("ERROR: cigar string contains impossible sequence of numeric and alphabetic characters")
+    operations, lengths = parse_cigar(cigar_string)
 
-            operations.append((c, int(length_string)))
-            length_string = ""
-            prev_is_numeric = False
+    return [(CIGAR_OPERATIONS[o], int(l)) for o,l in zip(operations.tolist(), lengths.tolist())]
 
-        if c.isnumeric():
-            length_string += c
-            prev_is_numeric = True
 
-    return operations
+def get_operation_code(cigar_type):
+    c = CIGAR_OPERATIONS.find(cigar_type)
+
+    if c < 0 or len(cigar_type) != 1:
+        exit("ERROR: unrecognized cigar type: " + cigar_type)
+
+    return c
 
 
 def is_reference_move(cigar_type):
-    if cigar_type == 'M':
-        return True
-    elif cigar_type == 'I':
-        return False
-    elif cigar_type == 'D':
-        return True
-    elif cigar_type == '=':
-        return True
-    elif cigar_type == 'X':
-        return True
-    elif cigar_type == 'S':
-        return False
-    elif cigar_type == 'H':
-        return False
-    else:
-        exit("ERROR: unrecognized cigar type: " + cigar_type)
+    return bool(REFERENCE_MOVES[get_operation_code(cigar_type)])
 
 
 def is_query_move(cigar_type):
-    if cigar_type == 'M':
-        return True
-    elif cigar_type == 'I':
-        return True
-    elif cigar_type == 'D':
-        return False
-    elif cigar_type == '=':
-        return True
-    elif cigar_type == 'X':
-        return True
-    elif cigar_type == 'S':
-        return True
-    elif cigar_type == 'H':
-        return False
-    else:
-        exit("ERROR: unrecognized cigar type: " + cigar_type)
+    return bool(QUERY_MOVES[get_operation_code(cigar_type)])
 
 
 def get_ref_alignment_length(cigar_operations):
@@ -133,32 +121,7 @@ class GafElement:
         return self.tokens[4]
 
     def get_path(self):
-        path = list()
-        reversal = None
-        node_name = ""
-
-        i = 0
-        for i,c in enumerate(self.tokens[5]):
-            if c == ">":
-                reversal = False
-
-                if i > 0:
-                    path.append((node_name, reversal))
-                    node_name = ""
-
-            elif c == "<":
-                reversal = True
-
-                if i > 0:
-                    path.append((node_name, reversal))
-                    node_name = ""
-            else:
-                node_name += c
-
-        if i > 0:
-            path.append((node_name, reversal))
-
-        return path
+        return parse_path_string(self.tokens[5])
 
     def get_path_string(self):
         return self.tokens[5]
@@ -209,8 +172,612 @@ class GafElement:
         return midpoint
 
 
-def iter_gaf_alignments(gaf_path):
-    with open(gaf_path, 'r') as file:
+class GafTableRow:
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def get_query_name(self):
+        return self.table.get_query_name(self.index)
+
+    def get_query_length(self):
+        return int(self.table.query_lengths[self.index])
+
+    def get_query_start(self):
+        return int(self.table.query_starts[self.index])
+
+    def get_query_stop(self):
+        return int(self.table.query_stops[self.index])
+
+    def get_reversal(self):
+        return bool(self.table.reversals[self.index])
+
+    def get_path(self):
+        return self.table.get_path(self.index)
+
+    def get_path_string(self):
+        return self.table.get_path_string(self.index)
+
+    def get_path_ids(self):
+        return self.table.get_path_ids(self.index)
+
+    def get_ref_length(self):
+        return int(self.table.ref_lengths[self.index])
+
+    def get_ref_start(self):
+        return int(self.table.ref_starts[self.index])
+
+    def get_ref_stop(self):
+        return int(self.table.ref_stops[self.index])
+
+    def get_map_quality(self):
+        return int(self.table.map_qualities[self.index])
+
+    def get_cigar(self):
+        return self.table.get_cigar(self.index)
+
+    def get_cigar_string(self):
+        return self.table.get_cigar_string(self.index)
+
+    def get_cigar_stats(self):
+        return self.table.get_cigar_stats(self.index)
+
+    def find_tag(self, tag_substring):
+        return self.table.find_tag(self.index, tag_substring)
+
+    def get_query_midpoint(self):
+        return float(self.table.query_starts[self.index] + self.table.query_stops[self.index])/2.0
+
+
+class GafFilter:
+    def __init__(self, min_map_quality=0, min_aligned_length=0, query_names=None, min_identity=None, primary_only=False):
+        # Applied to the split line of each alignment before anything is parsed from it or stored. The aligned length
+        # is the span on the query. Identity is read from the id:f tag, or computed from the cigar if there is none
+        # (as in CigarStats). Cigars with M operations (as written by minimap2 and minigraph) don't tell matches from
+        # mismatches, so without an id:f tag those alignments are not filtered by identity, and a warning is written
+        # once. Alignments without a tp:A tag are taken to be primary.
+        self.min_map_quality = min_map_quality
+        self.min_aligned_length = min_aligned_length
+        self.min_identity = min_identity
+        self.primary_only = primary_only
+
+        self.n_unknown_identity = 0
+
+        self.query_names = None
+        if query_names is not None:
+            self.query_names = set(name.encode("utf8") if isinstance(name, str) else name for name in query_names)
+
+    def is_empty(self):
+        return self.min_map_quality <= 0 and self.min_aligned_length <= 0 and self.query_names is None and self.min_identity is None and not self.primary_only
+
+    def accepts_query_name(self, query_name):
+        if self.query_names is None:
+            return True
+
+        return (query_name.encode("utf8") if isinstance(query_name, str) else query_name) in self.query_names
+
+    def accepts(self, tokens):
+        # tokens are the bytes of a line split with maxsplit=12, checked from cheapest to most expensive
+        if self.min_map_quality > 0 and int(tokens[11]) < self.min_map_quality:
+            return False
+
+        if self.min_aligned_length > 0 and int(tokens[3]) - int(tokens[2]) < self.min_aligned_length:
+            return False
+
+        if self.query_names is not None and tokens[0] not in self.query_names:
+            return False
+
+        if not self.primary_only and self.min_identity is None:
+            return True
+
+        tags = tokens[12].split() if len(tokens) > 12 else list()
+
+        if self.primary_only:
+            for tag in tags:
+                if tag.startswith(b"tp:A:") and tag != b"tp:A:P":
+                    return False
+
+        if self.min_identity is not None:
+            identity = None
+            cigar = b""
+
+            for tag in tags:
+                if tag.startswith(b"id:f:"):
+                    identity = float(tag[5:])
+                    break
+                elif tag.startswith(b"cg:Z:"):
+                    cigar = tag[5:]
+
+            if identity is None:
+                stats = get_cigar_stats(cigar)
+
+                if stats.n_aligned > 0 or len(cigar) == 0:
+                    if self.n_unknown_identity == 0:
+                        sys.stderr.write("WARNING: alignments without an id:f tag, and with M operations or no cigar, are not filtered by identity\n")
+
+                    self.n_unknown_identity += 1
+                else:
+                    identity = stats.get_identity()
+
+            if identity is not None and identity < self.min_identity:
+                return False
+
+        return True
+
+
+GAF_COLUMNS = [
+    ("query_ids", numpy.int32),
+    ("path_ids", numpy.int32),
+    ("query_lengths", numpy.int64),
+    ("query_starts", numpy.int64),
+    ("query_stops", numpy.int64),
+    ("reversals", bool),
+    ("ref_lengths", numpy.int64),
+    ("ref_starts", numpy.int64),
+    ("ref_stops", numpy.int64),
+    ("map_qualities", numpy.uint8),
+    ("source_ids", numpy.int32),
+    ("line_offsets", numpy.int64),
+]
+
+
+def column_property(name):
+    return property(lambda self: self.buffers[name][:self.n_rows])
+
+
+class GafTable:
+    # Each column is a view of the filled part of a buffer that grows by doubling, so that many small loads (e.g. one
+    # query at a time from an index) take time proportional to the total number of rows, and columns can still be
+    # read in between loads without copying
+    query_ids = column_property("query_ids")
+    path_ids = column_property("path_ids")
+    query_lengths = column_property("query_lengths")
+    query_starts = column_property("query_starts")
+    query_stops = column_property("query_stops")
+    reversals = column_property("reversals")
+    ref_lengths = column_property("ref_lengths")
+    ref_starts = column_property("ref_starts")
+    ref_stops = column_property("ref_stops")
+    map_qualities = column_property("map_qualities")
+    source_ids = column_property("source_ids")
+    line_offsets = column_property("line_offsets")
+
+    def __init__(self, store_tags=False, gaf_filter=None):
+        # Interned strings, each row only holds the integer ids
+        self.query_names = IncrementalIdMap()
+        self.path_strings = IncrementalIdMap()
+
+        self.n_rows = 0
+        self.buffers = {name: numpy.zeros(0, dtype=dtype) for name,dtype in GAF_COLUMNS}
+
+        # Tags are not kept in memory by default, they are re-read from the source file using the line offsets.
+        # Sources are interned by path, so loading from the same file again reuses its id (None for lines that
+        # were not read from a file).
+        self.sources = IncrementalIdMap()
+
+        self.store_tags = store_tags
+        self.tags = dict()
+
+        # Lines that are rejected by the filter are skipped by load_lines, and take no space in the table
+        self.gaf_filter = None if gaf_filter is None or gaf_filter.is_empty() else gaf_filter
+
+        # Paths parsed to node ids of the graph, cached per distinct path string
+        self.node_id_map = None
+        self.parsed_paths = dict()
+
+        # Per-row cigar statistics, either computed for the whole table at once or cached one row at a time
+        self.cigar_operation_counts = None
+        self.cigar_stats = dict()
+
+    def __len__(self):
+        return self.n_rows
+
+    def append_columns(self, columns):
+        n = len(columns[0])
+        stop = self.n_rows + n
+
+        for (name,dtype),values in zip(GAF_COLUMNS, columns):
+            buffer = self.buffers[name]
+
+            if stop > len(buffer):
+                grown = numpy.zeros(max(stop, 2*len(buffer)), dtype=dtype)
+                grown[:self.n_rows] = buffer[:self.n_rows]
+                self.buffers[name] = buffer = grown
+
+            buffer[self.n_rows:stop] = values
+
+        self.n_rows = stop
+
+    def load(self, gaf_path):
+        with open(gaf_path, 'rb') as file:
+            return self.load_lines(file, source=gaf_path)
+
+    def load_lines(self, lines, source=None, offsets=None):
+        start = len(self)
+
+        source_id = self.sources.add(source)
+
+        query_ids = array('i')
+        path_ids = array('i')
+        query_lengths = array('q')
+        query_starts = array('q')
+        query_stops = array('q')
+        reversals = array('b')
+        ref_lengths = array('q')
+        ref_starts = array('q')
+        ref_stops = array('q')
+        map_qualities = array('B')
+        line_offsets = array('q')
+
+        add_query = self.query_names.add
+        add_path = self.path_strings.add
+        accepts = self.gaf_filter.accepts if self.gaf_filter is not None else None
+
+        offset = 0
+        for l,line in enumerate(lines):
+            if offsets is not None:
+                offset = offsets[l]
+
+            if isinstance(line, str):
+                line = line.encode("utf8")
+
+            tokens = line.split(maxsplit=12)
+
+            if len(tokens) < 12 or (accepts is not None and not accepts(tokens)):
+                offset += len(line)
+                continue
+
+            query_ids.append(add_query(tokens[0].decode("utf8")))
+            query_lengths.append(int(tokens[1]))
+            query_starts.append(int(tokens[2]))
+            query_stops.append(int(tokens[3]))
+            reversals.append(tokens[4] == b'-')
+            path_ids.append(add_path(tokens[5].decode("utf8")))
+            ref_lengths.append(int(tokens[6]))
+            ref_starts.append(int(tokens[7]))
+            ref_stops.append(int(tokens[8]))
+            map_qualities.append(min(255,int(tokens[11])))
+            line_offsets.append(offset)
+
+            # Keyed by row, because rows that were loaded from a file in between have no entry
+            if self.store_tags or source is None:
+                self.tags[start + len(query_ids) - 1] = tokens[12].decode("utf8").strip() if len(tokens) > 12 else ""
+
+            offset += len(line)
+
+        n = len(query_ids)
+
+        if n > 0:
+            self.append_columns([
+                numpy.frombuffer(query_ids, dtype=numpy.int32),
+                numpy.frombuffer(path_ids, dtype=numpy.int32),
+                numpy.frombuffer(query_lengths, dtype=numpy.int64),
+                numpy.frombuffer(query_starts, dtype=numpy.int64),
+                numpy.frombuffer(query_stops, dtype=numpy.int64),
+                numpy.frombuffer(reversals, dtype=numpy.int8).astype(bool),
+                numpy.frombuffer(ref_lengths, dtype=numpy.int64),
+                numpy.frombuffer(ref_starts, dtype=numpy.int64),
+                numpy.frombuffer(ref_stops, dtype=numpy.int64),
+                numpy.frombuffer(map_qualities, dtype=numpy.uint8),
+                numpy.full(n, source_id, dtype=numpy.int32),
+                numpy.frombuffer(line_offsets, dtype=numpy.int64)
+            ])
+
+        return start, start + n
+
+    def get_row(self, i):
+        return GafTableRow(self, i)
+
+    def get_query_name(self, i):
+        return self.query_names.get_name(int(self.query_ids[i]))
+
+    def get_path_string(self, i):
+        return self.path_strings.get_name(int(self.path_ids[i]))
+
+    def get_path(self, i):
+        return parse_path_string(self.get_path_string(i))
+
+    def set_node_id_map(self, id_map):
+        if id_map is not self.node_id_map:
+            self.node_id_map = id_map
+            self.parsed_paths = dict()
+
+    def get_parsed_path(self, path_id):
+        path = self.parsed_paths.get(path_id)
+
+        if path is None:
+            path = parse_path_ids(self.path_strings.get_name(path_id), self.node_id_map)
+            self.parsed_paths[path_id] = path
+
+        return path
+
+    def get_path_ids(self, i):
+        if self.node_id_map is None:
+            raise Exception("ERROR: cannot resolve path ids without a node id map")
+
+        return self.get_parsed_path(int(self.path_ids[i]))
+
+    def find_unknown_paths(self, start=0, stop=None):
+        # Each distinct path only needs to be checked once
+        unknown = list()
+
+        for path_id in numpy.unique(self.path_ids[start:stop]).tolist():
+            ids, reversals = self.get_parsed_path(path_id)
+
+            if (ids < 0).any():
+                unknown.append(self.path_strings.get_name(path_id))
+
+        return unknown
+
+    def get_query_midpoints(self):
+        return (self.query_starts + self.query_stops)/2.0
+
+    def group_by_query(self):
+        # Sort by query first and then by the midpoint along the query, in a single vectorized pass
+        order = numpy.lexsort((self.get_query_midpoints(), self.query_ids))
+        sorted_query_ids = self.query_ids[order]
+
+        boundaries = numpy.flatnonzero(numpy.diff(sorted_query_ids)) + 1
+        groups = dict()
+
+        for indexes in numpy.split(order, boundaries):
+            if len(indexes) == 0:
+                continue
+
+            groups[self.get_query_name(indexes[0])] = indexes
+
+        return groups
+
+    def get_tags(self, i):
+        source = self.sources.get_name(int(self.source_ids[i]))
+
+        if source is None or self.store_tags:
+            return self.tags.get(int(i), "").split()
+
+        with open(source, 'rb') as file:
+            file.seek(int(self.line_offsets[i]))
+            tokens = file.readline().split(maxsplit=12)
+
+        if len(tokens) < 13:
+            return list()
+
+        return tokens[12].decode("utf8").split()
+
+    def find_tag(self, i, tag_substring):
+        for token in self.get_tags(i):
+            if token.startswith(tag_substring):
+                return token
+
+    def get_cigar_string(self, i):
+        token = self.find_tag(i, "cg:Z:")
+
+        if token is None:
+            raise Exception("WARNING: tag not found: cg:Z:")
+
+        return token[5:]
+
+    def get_cigar(self, i):
+        return parse_cigar_as_tuples(self.get_cigar_string(i))
+
+    def get_cigar_stats(self, i):
+        if self.cigar_operation_counts is not None and i < len(self.cigar_operation_counts):
+            return CigarStats(self.cigar_operation_counts[i])
+
+        stats = self.cigar_stats.get(i)
+
+        if stats is None:
+            stats = CigarStats(count_operations(*parse_cigar(self.get_cigar_string(i))))
+            self.cigar_stats[i] = stats
+
+        return stats
+
+    def iter_cigar_strings(self):
+        # Reads the cigars of all rows, visiting each source file once, in order of line offset
+        cigars = [""]*len(self)
+
+        for source_id,source in self.sources:
+            rows = numpy.flatnonzero(self.source_ids == source_id)
+
+            if source is None or self.store_tags:
+                for i in rows:
+                    cigars[i] = find_cigar_in_tags(self.tags.get(int(i), "").split())
+                continue
+
+            rows = rows[numpy.argsort(self.line_offsets[rows], kind="stable")]
+
+            with open(source, 'rb') as file:
+                for i in rows:
+                    file.seek(int(self.line_offsets[i]))
+                    tokens = file.readline().split()
+                    cigars[i] = find_cigar_in_tags(t.decode("utf8") for t in tokens[12:])
+
+        return cigars
+
+    def compute_cigar_stats(self):
+        # Alignments without a cigar are counted as empty
+        self.cigar_operation_counts = count_operations_bulk(self.iter_cigar_strings())
+        self.cigar_stats = dict()
+
+        return self.cigar_operation_counts
+
+
+def find_cigar_in_tags(tags):
+    for token in tags:
+        if token.startswith("cg:Z:"):
+            return token[5:]
+
+    return ""
+
+
+def parse_path_string(path_string):
+    return [(name, orientation == "<") for orientation,name in PATH_PATTERN.findall(path_string)]
+
+
+def parse_path_ids(path_string, id_map):
+    # Returns the node ids (-1 for names that are not in the id map) and a mask of reversed nodes
+    tokens = PATH_PATTERN.findall(path_string)
+    get_id = id_map.name_to_id.get
+
+    ids = numpy.fromiter((get_id(name, -1) for orientation,name in tokens), dtype=numpy.int32, count=len(tokens))
+    reversals = numpy.fromiter((orientation == "<" for orientation,name in tokens), dtype=bool, count=len(tokens))
+
+    return ids, reversals
+
+
+class GafTail:
+    def __init__(self, gaf_path):
+        # Follows a GAF that is still being written, only complete lines are returned
+        self.gaf_path = gaf_path
+        self.offset = 0
+
+    def read_new_lines(self):
+        if not os.path.exists(self.gaf_path):
+            return list(), list()
+
+        # The file was truncated or replaced
+        if os.path.getsize(self.gaf_path) < self.offset:
+            self.offset = 0
+
+        with open(self.gaf_path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+
+        end = data.rfind(b'\n') + 1
+
+        lines = list()
+        offsets = list()
+
+        offset = self.offset
+        for line in data[:end].splitlines(keepends=True):
+            lines.append(line)
+            offsets.append(offset)
+            offset += len(line)
+
+        self.offset += end
+
+        return lines, offsets
+
+
+def iter_gaf_alignments(gaf_path, gaf_filter=None):
+    if gaf_filter is not None and gaf_filter.is_empty():
+        gaf_filter = None
+
+    with open(gaf_path, 'rb') as file:
         for l,line in enumerate(file):
-            yield GafElement(line,True)
+            if gaf_filter is not None:
+                tokens = line.split(maxsplit=12)
+
+                if len(tokens) < 12 or not gaf_filter.accepts(tokens):
+                    continue
+
+            yield GafElement(line.decode("utf8"),True)
+
+
+def test():
+    import tempfile
+
+    lines = [
+        "a\t100\t0\t90\t+\t>x\t10\t0\t10\t10\t10\t60\ttp:A:P\tcg:Z:8=2X\n",
+        "a\t100\t0\t20\t+\t>x\t10\t0\t10\t10\t10\t60\ttp:A:S\tcg:Z:10=\n",
+        "b\t100\t0\t90\t+\t>y\t10\t0\t10\t10\t10\t5\tid:f:0.99\tcg:Z:5=5X\n",
+        "c\t100\t10\t90\t+\t>y\t10\t0\t10\t10\t10\t30\tcg:Z:10=\n",
+    ]
+
+    cases = [
+        (GafFilter(), ["a", "a", "b", "c"]),
+        (GafFilter(min_map_quality=30), ["a", "a", "c"]),
+        (GafFilter(min_aligned_length=50), ["a", "b", "c"]),
+        (GafFilter(query_names=["b", "c"]), ["b", "c"]),
+        (GafFilter(primary_only=True), ["a", "b", "c"]),
+        (GafFilter(min_identity=0.9), ["a", "b", "c"]),
+        (GafFilter(min_identity=0.995), ["a", "c"]),
+        (GafFilter(min_map_quality=10, min_aligned_length=50, min_identity=0.5, primary_only=True), ["a", "c"]),
+    ]
+
+    for gaf_filter,expected in cases:
+        table = GafTable(gaf_filter=gaf_filter)
+        table.load_lines(lines)
+
+        result = [table.get_query_name(i) for i in range(len(table))]
+
+        if result != expected:
+            raise Exception("ERROR: unexpected filtered queries: " + str(result) + " expected: " + str(expected))
+
+    # Identity is unknown for cigars with M operations and no id:f tag, those alignments are kept
+    gaf_filter = GafFilter(min_identity=0.9)
+    table = GafTable(gaf_filter=gaf_filter)
+    table.load_lines([
+        "d\t100\t0\t90\t+\t>x\t10\t0\t10\t10\t10\t60\tcg:Z:10M\n",
+        "e\t100\t0\t90\t+\t>x\t10\t0\t10\t10\t10\t60\tid:f:0.5\tcg:Z:10M\n",
+        "f\t100\t0\t90\t+\t>x\t10\t0\t10\t10\t10\t60\n",
+    ])
+
+    if [table.get_query_name(i) for i in range(len(table))] != ["d", "f"] or gaf_filter.n_unknown_identity != 2:
+        raise Exception("ERROR: unexpected identity filtering of alignments without =/X operations")
+
+    # Tags of rows without a source are found by row, also after rows that were loaded from a file
+    directory = tempfile.mkdtemp()
+    gaf_path = os.path.join(directory, "test.gaf")
+
+    with open(gaf_path, 'w') as file:
+        file.write("".join(lines[:2]))
+
+    table = GafTable()
+    table.load(gaf_path)
+    table.load_lines(lines[2:])
+
+    cigars = [table.get_cigar_string(i) for i in range(len(table))]
+
+    if cigars != ["8=2X", "10=", "5=5X", "10="] or table.iter_cigar_strings() != cigars:
+        raise Exception("ERROR: unexpected cigars: " + str(cigars))
+
+    # Offsets of the surviving lines still point at their position in the file
+    table = GafTable(gaf_filter=GafFilter(query_names=["c"]))
+    table.load_lines(lines, source="test.gaf")
+
+    if table.line_offsets.tolist() != [sum(len(l) for l in lines[:3])]:
+        raise Exception("ERROR: unexpected line offsets: " + str(table.line_offsets.tolist()))
+
+    # Loading one line at a time from the same file (as for one query at a time from an index) reuses its source
+    table = GafTable()
+    n_loads = 70000
+
+    for i in range(n_loads):
+        table.load_lines(lines[i % 2:i % 2 + 1], source=gaf_path, offsets=[len(lines[0])*(i % 2)])
+
+    if len(table) != n_loads or len(table.sources) != 1 or table.source_ids.max() != 0:
+        raise Exception("ERROR: unexpected table after repeated loads")
+
+    if table.get_cigar_string(n_loads - 1) != "10=" or table.query_stops[:2].tolist() != [90, 20]:
+        raise Exception("ERROR: unexpected rows after repeated loads")
+
+    # A table where the filter rejected every line
+    table = GafTable(gaf_filter=GafFilter(min_map_quality=100))
+    table.load_lines(lines)
+
+    if table.compute_cigar_stats().shape != (0, len(CIGAR_OPERATIONS)):
+        raise Exception("ERROR: unexpected cigar stats for an empty table")
+
+    # Short and long cigars are parsed the same way, and malformed ones are rejected by both parsers
+    for cigar in ["10=2X3I1D4=", "7M" + "1I3=2X"*200]:
+        operations, lengths = parse_cigar(cigar)
+
+        if parse_cigar_as_tuples(cigar) != [(CIGAR_OPERATIONS[o], int(l)) for o,l in zip(operations, lengths)]:
+            raise Exception("ERROR: unexpected cigar tuples: " + cigar[:20])
+
+    for cigar in ["=10", "10==", "10Q", "10", "10M3", "M" + "1=" * 300]:
+        try:
+            parse_cigar_as_tuples(cigar)
+        except Exception:
+            continue
+
+        raise Exception("ERROR: malformed cigar was accepted: " + cigar[:20])
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
 
@@ -0,0 +1,302 @@
+from modules.Gaf import PATH_PATTERN
+from modules.Task import set_stage, update_progress
+from array import array
+import numpy
+import sys
+import os
+
+
+INDEX_VERSION = 2
+
+
+def encode_names(names):
+    return numpy.frombuffer("\n".join(names).encode("utf8"), dtype=numpy.uint8)
+
+
+def decode_names(blob):
+    if len(blob) == 0:
+        return list()
+
+    return blob.tobytes().decode("utf8").split("\n")
+
+
+def get_index_path(gaf_path):
+    return gaf_path + ".jidx"
+
+
+class GafIndex:
+    def __init__(self, gaf_path):
+        self.gaf_path = gaf_path
+
+        # Size and modification time of the GAF when it was read, see get_source_stamp
+        self.stamp = None
+
+        self.query_names = list()
+        self.query_to_id = dict()
+
+        # CSR layout: the records of query i are record_offsets[query_starts[i]:query_starts[i+1]],
+        # sorted by their midpoint along the query
+        self.query_starts = numpy.zeros(1, dtype=numpy.int64)
+        self.record_offsets = numpy.zeros(0, dtype=numpy.int64)
+
+        # Inverted index, also CSR: the records that traverse node i are node_records[node_starts[i]:node_starts[i+1]],
+        # given as positions in record_offsets, from which the query and the rank within the query can be recovered
+        self.node_names = list()
+        self.node_to_id = dict()
+        self.node_starts = numpy.zeros(1, dtype=numpy.int64)
+        self.node_records = numpy.zeros(0, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.record_offsets)
+
+    @staticmethod
+    def build(gaf_path, index_nodes=True, progress=None):
+        index = GafIndex(gaf_path)
+
+        # Taken before reading, so that an index of a GAF that grows while it is being read (e.g. the output of a
+        # running aligner) is found to be stale
+        index.stamp = index.get_source_stamp()
+
+        query_to_id = dict()
+        query_names = list()
+
+        query_ids = array('i')
+        offsets = array('q')
+        midpoints = array('d')
+
+        node_to_id = dict()
+        node_names = list()
+        posting_nodes = array('i')
+        posting_records = array('i')
+
+        total_size = os.path.getsize(gaf_path)
+        set_stage(progress, "Indexing GAF", total_size)
+
+        offset = 0
+        with open(gaf_path, 'rb') as file:
+            for l,line in enumerate(file):
+                if progress is not None and l % 10000 == 0:
+                    update_progress(progress, offset, total_size)
+
+                tokens = line.split(maxsplit=6)
+
+                if len(tokens) < 6:
+                    offset += len(line)
+                    continue
+
+                if index_nodes:
+                    record = len(offsets)
+
+                    # Nodes that are visited more than once by the same path only get one posting
+                    for node_name in set(name for orientation,name in PATH_PATTERN.findall(tokens[5].decode("utf8"))):
+                        node_id = node_to_id.get(node_name)
+
+                        if node_id is None:
+                            node_id = len(node_names)
+                            node_to_id[node_name] = node_id
+                            node_names.append(node_name)
+
+                        posting_nodes.append(node_id)
+                        posting_records.append(record)
+
+                name = tokens[0]
+                id = query_to_id.get(name)
+
+                if id is None:
+                    id = len(query_names)
+                    query_to_id[name] = id
+                    query_names.append(name.decode("utf8"))
+
+                query_ids.append(id)
+                offsets.append(offset)
+                midpoints.append((int(tokens[2]) + int(tokens[3]))/2.0)
+
+                offset += len(line)
+
+        query_ids = numpy.frombuffer(query_ids, dtype=numpy.int32)
+        offsets = numpy.frombuffer(offsets, dtype=numpy.int64)
+        midpoints = numpy.frombuffer(midpoints, dtype=numpy.float64)
+
+        order = numpy.lexsort((midpoints, query_ids))
+        counts = numpy.bincount(query_ids, minlength=len(query_names))
+
+        index.query_names = query_names
+        index.query_starts = numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64)
+        index.record_offsets = offsets[order]
+
+        if index_nodes:
+            # Translate file order records to their sorted position, then group the postings by node
+            positions = numpy.empty(len(order), dtype=numpy.int32)
+            positions[order] = numpy.arange(len(order), dtype=numpy.int32)
+
+            posting_nodes = numpy.frombuffer(posting_nodes, dtype=numpy.int32)
+            posting_records = positions[numpy.frombuffer(posting_records, dtype=numpy.int32)]
+
+            posting_order = numpy.lexsort((posting_records, posting_nodes))
+
+            index.node_names = node_names
+            index.node_starts = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(posting_nodes, minlength=len(node_names)))]).astype(numpy.int64)
+            index.node_records = posting_records[posting_order]
+
+        index.update_name_map()
+
+        return index
+
+    @staticmethod
+    def load_or_build(gaf_path, write=True, progress=None):
+        index_path = get_index_path(gaf_path)
+
+        if os.path.exists(index_path):
+            try:
+                index = GafIndex.read(gaf_path, index_path)
+
+                if index is not None:
+                    return index
+
+            except Exception as e:
+                sys.stderr.write("WARNING: could not read GAF index, rebuilding: " + str(e) + '\n')
+
+        index = GafIndex.build(gaf_path, progress=progress)
+
+        if write:
+            try:
+                index.write(index_path)
+            except OSError as e:
+                sys.stderr.write("WARNING: could not write GAF index: " + str(e) + '\n')
+
+        return index
+
+    def get_source_stamp(self):
+        stat = os.stat(self.gaf_path)
+        return numpy.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+
+    def write(self, index_path):
+        # Written to a temporary file first, so that concurrent readers never see a partial index
+        temp_path = index_path + ".%d.tmp" % os.getpid()
+
+        with open(temp_path, 'wb') as file:
+            numpy.savez(
+                file,
+                stamp=self.stamp,
+                query_names=encode_names(self.query_names),
+                query_starts=self.query_starts,
+                record_offsets=self.record_offsets,
+                node_names=encode_names(self.node_names),
+                node_starts=self.node_starts,
+                node_records=self.node_records
+            )
+
+        os.replace(temp_path, index_path)
+
+    @staticmethod
+    def read(gaf_path, index_path):
+        index = GafIndex(gaf_path)
+
+        with numpy.load(index_path) as data:
+            # The index is stale if the GAF was modified after it was written
+            if not numpy.array_equal(data["stamp"], index.get_source_stamp()):
+                return None
+
+            index.stamp = data["stamp"]
+
+            index.query_names = decode_names(data["query_names"])
+            index.query_starts = data["query_starts"]
+            index.record_offsets = data["record_offsets"]
+            index.node_names = decode_names(data["node_names"])
+            index.node_starts = data["node_starts"]
+            index.node_records = data["node_records"]
+
+        index.update_name_map()
+
+        return index
+
+    def update_name_map(self):
+        self.query_to_id = {name:i for i,name in enumerate(self.query_names)}
+        self.node_to_id = {name:i for i,name in enumerate(self.node_names)}
+
+    def get_node_records(self, node_name):
+        id = self.node_to_id.get(node_name)
+
+        if id is None:
+            return self.node_records[:0]
+
+        return self.node_records[self.node_starts[id]:self.node_starts[id+1]]
+
+    def get_alignments_at_node(self, node_name):
+        # Returns parallel arrays of query ids and the rank of each alignment among the alignments of its query
+        records = self.get_node_records(node_name)
+
+        query_ids = numpy.searchsorted(self.query_starts, records, side="right") - 1
+        ranks = records - self.query_starts[query_ids]
+
+        return query_ids, ranks
+
+    def get_query_names(self):
+        return self.query_names
+
+    def get_offsets(self, query_name):
+        id = self.query_to_id.get(query_name)
+
+        if id is None:
+            return self.record_offsets[:0]
+
+        return self.record_offsets[self.query_starts[id]:self.query_starts[id+1]]
+
+    def read_lines(self, query_name):
+        offsets = self.get_offsets(query_name)
+        lines = list()
+
+        with open(self.gaf_path, 'rb') as file:
+            for offset in offsets:
+                file.seek(int(offset))
+                lines.append(file.readline())
+
+        return lines, offsets
+
+
+def test():
+    import tempfile
+
+    lines = [
+        "b\t100\t50\t90\t+\t>x\t10\t0\t10\t10\t10\t60\n",
+        "a\t100\t0\t50\t+\t>x>y\t10\t0\t10\t10\t10\t60\n",
+        "b\t100\t0\t10\t+\t>y\t10\t0\t10\t10\t10\t60\n",
+    ]
+
+    directory = tempfile.mkdtemp()
+    gaf_path = os.path.join(directory, "test.gaf")
+
+    with open(gaf_path, 'w') as file:
+        file.write("".join(lines))
+
+    for i in range(2):
+        # First iteration builds and writes the sidecar, second one reads it back
+        index = GafIndex.load_or_build(gaf_path)
+
+        result, offsets = index.read_lines("b")
+        result = [l.decode("utf8") for l in result]
+
+        if not result == [lines[2], lines[0]]:
+            raise Exception("ERROR: unexpected lines for query b: " + str(result))
+
+        if not sorted(index.get_query_names()) == ["a","b"]:
+            raise Exception("ERROR: unexpected query names: " + str(index.get_query_names()))
+
+    # Lines appended after the index was built make it stale
+    with open(gaf_path, 'a') as file:
+        file.write(lines[0].replace("b", "c", 1))
+
+    if GafIndex.read(gaf_path, get_index_path(gaf_path)) is not None:
+        raise Exception("ERROR: index of a modified GAF was not found to be stale")
+
+    query_ids, ranks = index.get_alignments_at_node("y")
+    result = sorted((index.query_names[q], int(r)) for q,r in zip(query_ids, ranks))
+
+    if not result == [("a", 0), ("b", 0)]:
+        raise Exception("ERROR: unexpected alignments at node y: " + str(result))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,3 +1,24 @@
+from modules.IncrementalIdMap import IncrementalIdMap
+from modules.Task import set_stage, update_progress
+from array import array
+import tempfile
+import numpy
+import gzip
+import mmap
+import os
+
+
+# How segment sequences are kept after loading
+SEQUENCES_IN_MEMORY = "memory"
+SEQUENCES_MEMORY_MAPPED = "mmap"
+SEQUENCES_LENGTH_ONLY = "length"
+
+
+def open_gfa(gfa_path, mode='r'):
+    if gfa_path.endswith(".gz"):
+        return gzip.open(gfa_path, mode + 't' if mode == 'r' else mode)
+
+    return open(gfa_path, mode)
 
 
 class GfaSequence:
@@ -31,7 +52,7 @@ class GfaEdge:
 
 
 def iterate_gfa_nodes(gfa_path):
-    with open(gfa_path, 'r') as file:
+    with open_gfa(gfa_path) as file:
         for line in file:
             if line.startswith("#"):
                 continue
@@ -43,7 +64,7 @@ def iterate_gfa_nodes(gfa_path):
 
 
 def iterate_gfa_edges(gfa_path):
-    with open(gfa_path, 'r') as file:
+    with open_gfa(gfa_path) as file:
         for line in file:
             if line.startswith("#"):
                 continue
@@ -53,3 +74,377 @@ def iterate_gfa_edges(gfa_path):
             if data[0] == "L":
                 yield GfaEdge(data)
 
+
+class MappedSequences:
+    def __init__(self, file, offsets, lengths):
+        # Sequences are sliced out of the file on demand, using a per-segment offset table
+        self.file = file
+        self.offsets = offsets
+        self.lengths = lengths
+        self.map = None
+
+        file.flush()
+        if os.fstat(file.fileno()).st_size > 0:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, id):
+        length = int(self.lengths[id])
+
+        if length == 0 or self.map is None:
+            return ""
+
+        offset = int(self.offsets[id])
+
+        return self.map[offset:offset + length].decode("utf8")
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        self.file.close()
+
+
+class GfaGraph:
+    def __init__(self):
+        # Segments are identified by contiguous integer ids, in the order they were first seen
+        self.id_map = IncrementalIdMap()
+        self.lengths = numpy.zeros(0, dtype=numpy.int64)
+
+        # Depending on the load mode this is None, a list of strings, or a MappedSequences
+        self.sequences = None
+
+        # One entry per L-line
+        self.edge_a = numpy.zeros(0, dtype=numpy.int32)
+        self.edge_b = numpy.zeros(0, dtype=numpy.int32)
+        self.edge_reversal_a = numpy.zeros(0, dtype=bool)
+        self.edge_reversal_b = numpy.zeros(0, dtype=bool)
+
+        # CSR adjacency: the edges touching segment i are adjacency_edges[adjacency_starts[i]:adjacency_starts[i+1]]
+        # and the segment on the other side of each one is found at the same position in adjacency_nodes
+        self.adjacency_starts = numpy.zeros(1, dtype=numpy.int64)
+        self.adjacency_edges = numpy.zeros(0, dtype=numpy.int32)
+        self.adjacency_nodes = numpy.zeros(0, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.id_map)
+
+    def get_edge_count(self):
+        return len(self.edge_a)
+
+    def get_total_length(self):
+        return int(self.lengths.sum())
+
+    def get_length(self, name):
+        return int(self.lengths[self.id_map.get_id(name)])
+
+    def get_sequence(self, name):
+        if self.sequences is None:
+            return None
+
+        return self.sequences[self.id_map.get_id(name)]
+
+    def close(self):
+        if isinstance(self.sequences, MappedSequences):
+            self.sequences.close()
+
+        self.sequences = None
+
+    def iter_edges(self):
+        for i in range(len(self.edge_a)):
+            yield (
+                self.id_map.get_name(int(self.edge_a[i])),
+                bool(self.edge_reversal_a[i]),
+                self.id_map.get_name(int(self.edge_b[i])),
+                bool(self.edge_reversal_b[i])
+            )
+
+    def get_neighbors(self, id):
+        return self.adjacency_nodes[self.adjacency_starts[id]:self.adjacency_starts[id+1]]
+
+    def get_incident_edges(self, id):
+        return self.adjacency_edges[self.adjacency_starts[id]:self.adjacency_starts[id+1]]
+
+    def get_neighborhood(self, ids, n_hops):
+        # Segments within n_hops L-lines of any of the given ones, sorted by id. Expands one hop at a time
+        # through the adjacency, so only the neighborhood itself is visited, and nothing the size of the whole
+        # graph is allocated.
+        reached = numpy.unique(numpy.asarray(ids, dtype=numpy.int64))
+        frontier = reached
+
+        for i in range(n_hops):
+            if len(frontier) == 0:
+                break
+
+            neighbors = numpy.unique(self.adjacency_nodes[self.get_adjacency_index(frontier)].astype(numpy.int64))
+            frontier = numpy.setdiff1d(neighbors, reached, assume_unique=True)
+            reached = numpy.union1d(reached, frontier)
+
+        return reached
+
+    def get_adjacency_index(self, ids):
+        # Positions in adjacency_nodes/adjacency_edges of the entries of all the given segments
+        starts = self.adjacency_starts[ids]
+        counts = self.adjacency_starts[ids + 1] - starts
+
+        return numpy.repeat(starts - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())
+
+    def get_subgraph(self, ids):
+        # Copy of the given segments (segment i of the subgraph is ids[i]) and of the L-lines between them, in
+        # the same order as in this graph. Only the L-lines of the given segments are visited.
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+
+        order = numpy.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+
+        edges = numpy.unique(self.adjacency_edges[self.get_adjacency_index(ids)])
+
+        def get_local_ids(global_ids):
+            positions = numpy.minimum(numpy.searchsorted(sorted_ids, global_ids), max(0, len(ids) - 1))
+            found = sorted_ids[positions] == global_ids if len(ids) > 0 else numpy.zeros(len(global_ids), dtype=bool)
+            return numpy.where(found, order[positions] if len(ids) > 0 else -1, -1)
+
+        subgraph = GfaGraph()
+        for id in ids.tolist():
+            subgraph.id_map.add(self.id_map.id_to_name[id])
+
+        subgraph.lengths = self.lengths[ids]
+
+        if self.sequences is not None:
+            subgraph.sequences = [self.sequences[id] for id in ids.tolist()]
+
+        a = get_local_ids(numpy.asarray(self.edge_a)[edges])
+        b = get_local_ids(numpy.asarray(self.edge_b)[edges])
+        kept = (a >= 0) & (b >= 0)
+        edges = edges[kept]
+
+        subgraph.edge_a = a[kept].astype(numpy.int32)
+        subgraph.edge_b = b[kept].astype(numpy.int32)
+        subgraph.edge_reversal_a = numpy.asarray(self.edge_reversal_a)[edges]
+        subgraph.edge_reversal_b = numpy.asarray(self.edge_reversal_b)[edges]
+
+        subgraph.build_adjacency()
+
+        return subgraph
+
+    def build_adjacency(self):
+        n = len(self.id_map)
+        e = len(self.edge_a)
+
+        nodes = numpy.concatenate([self.edge_a, self.edge_b])
+        others = numpy.concatenate([self.edge_b, self.edge_a])
+        edges = numpy.concatenate([numpy.arange(e, dtype=numpy.int32), numpy.arange(e, dtype=numpy.int32)])
+
+        order = numpy.argsort(nodes, kind="stable")
+
+        self.adjacency_starts = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(nodes, minlength=n))]).astype(numpy.int64)
+        self.adjacency_edges = edges[order]
+        self.adjacency_nodes = others[order]
+
+
+def get_segment_length(tokens):
+    if tokens[2] != b'*':
+        return len(tokens[2])
+
+    # Sequence may be omitted, in which case the length should be given as a tag
+    for token in tokens[3:]:
+        if token.startswith(b"LN:i:"):
+            return int(token[5:])
+
+    return 0
+
+
+def load_gfa(gfa_path, sequence_mode=SEQUENCES_IN_MEMORY, progress=None):
+    if sequence_mode not in (SEQUENCES_IN_MEMORY, SEQUENCES_MEMORY_MAPPED, SEQUENCES_LENGTH_ONLY):
+        raise Exception("ERROR: unrecognized sequence mode: " + str(sequence_mode))
+
+    graph = GfaGraph()
+    id_map = graph.id_map
+
+    # Edges may refer to segments that are defined later in the file, so lengths are filled in by id at the end
+    segment_ids = array('i')
+    segment_lengths = array('q')
+    sequences = dict()
+
+    # For memory mapping, the offset of each sequence in the GFA itself or, if the GFA is compressed,
+    # in a temporary file that the sequences are spilled into
+    is_compressed = gfa_path.endswith(".gz")
+    spill_file = None
+    spill_offset = 0
+    sequence_offsets = array('q')
+    sequence_lengths = array('q')
+
+    if sequence_mode == SEQUENCES_MEMORY_MAPPED and is_compressed:
+        spill_file = tempfile.TemporaryFile()
+
+    line_offset = 0
+
+    edge_a = array('i')
+    edge_b = array('i')
+    edge_reversal_a = array('b')
+    edge_reversal_b = array('b')
+
+    # Progress is measured in bytes read from disk, which for gzipped files is the compressed position
+    total_size = os.path.getsize(gfa_path)
+    set_stage(progress, "Parsing GFA", total_size)
+
+    with open_gfa(gfa_path, 'rb') as file:
+        for l,line in enumerate(file):
+            if progress is not None and l % 10000 == 0:
+                update_progress(progress, file.fileobj.tell() if is_compressed else line_offset, total_size)
+
+            if line.startswith(b'S'):
+                tokens = line.rstrip().split(b'\t')
+                id = id_map.add(tokens[1].decode("utf8"))
+
+                segment_ids.append(id)
+                segment_lengths.append(get_segment_length(tokens))
+
+                if sequence_mode == SEQUENCES_IN_MEMORY:
+                    sequences[id] = tokens[2].decode("utf8") if tokens[2] != b'*' else ""
+
+                elif sequence_mode == SEQUENCES_MEMORY_MAPPED:
+                    sequence = tokens[2] if tokens[2] != b'*' else b''
+
+                    if spill_file is not None:
+                        spill_file.write(sequence)
+                        sequence_offsets.append(spill_offset)
+                        spill_offset += len(sequence)
+                    else:
+                        sequence_offsets.append(line_offset + len(tokens[0]) + len(tokens[1]) + 2)
+
+                    sequence_lengths.append(len(sequence))
+
+            elif line.startswith(b'L'):
+                tokens = line.split(b'\t', 5)
+
+                edge_a.append(id_map.add(tokens[1].decode("utf8")))
+                edge_reversal_a.append(GfaEdge.get_reversal(tokens[2].decode("utf8")))
+                edge_b.append(id_map.add(tokens[3].decode("utf8")))
+                edge_reversal_b.append(GfaEdge.get_reversal(tokens[4].strip().decode("utf8")))
+
+            line_offset += len(line)
+
+    graph.lengths = numpy.zeros(len(id_map), dtype=numpy.int64)
+    graph.lengths[numpy.frombuffer(segment_ids, dtype=numpy.int32)] = numpy.frombuffer(segment_lengths, dtype=numpy.int64)
+
+    if sequence_mode == SEQUENCES_IN_MEMORY:
+        graph.sequences = [sequences.get(id, "") for id in range(len(id_map))]
+
+    elif sequence_mode == SEQUENCES_MEMORY_MAPPED:
+        ids = numpy.frombuffer(segment_ids, dtype=numpy.int32)
+
+        offsets = numpy.zeros(len(id_map), dtype=numpy.int64)
+        offsets[ids] = numpy.frombuffer(sequence_offsets, dtype=numpy.int64)
+
+        lengths = numpy.zeros(len(id_map), dtype=numpy.int64)
+        lengths[ids] = numpy.frombuffer(sequence_lengths, dtype=numpy.int64)
+
+        if spill_file is None:
+            spill_file = open(gfa_path, 'rb')
+
+        graph.sequences = MappedSequences(spill_file, offsets, lengths)
+
+    graph.edge_a = numpy.frombuffer(edge_a, dtype=numpy.int32).copy()
+    graph.edge_b = numpy.frombuffer(edge_b, dtype=numpy.int32).copy()
+    graph.edge_reversal_a = numpy.frombuffer(edge_reversal_a, dtype=numpy.int8).astype(bool)
+    graph.edge_reversal_b = numpy.frombuffer(edge_reversal_b, dtype=numpy.int8).astype(bool)
+
+    graph.build_adjacency()
+
+    return graph
+
+
+def find_connected_components(n, edge_a, edge_b):
+    # Label propagation with pointer jumping, so that long paths converge in a logarithmic number of rounds.
+    # Returns the component id of each node (numbered by first appearance) and the number of components.
+    parents = numpy.arange(n, dtype=numpy.int64)
+    edge_a = numpy.asarray(edge_a, dtype=numpy.int64)
+    edge_b = numpy.asarray(edge_b, dtype=numpy.int64)
+
+    while True:
+        a = parents[edge_a]
+        b = parents[edge_b]
+
+        if numpy.array_equal(a, b):
+            break
+
+        numpy.minimum.at(parents, numpy.maximum(a, b), numpy.minimum(a, b))
+
+        while True:
+            grandparents = parents[parents]
+
+            if numpy.array_equal(grandparents, parents):
+                break
+
+            parents = grandparents
+
+    roots, components = numpy.unique(parents, return_inverse=True)
+
+    return components, len(roots)
+
+
+def test():
+    import tempfile
+
+    lines = [
+        "S\ta\tAAAA\n",
+        "S\tb\tAAAAAAAA\n",
+        "S\tc\tAA\n",
+        "S\td\tAAA\n",
+        "S\te\tA\n",
+        "L\ta\t+\tb\t-\t0M\n",
+        "L\tb\t+\tc\t+\t0M\n",
+        "L\tc\t-\td\t+\t0M\n",
+        "L\td\t+\td\t+\t0M\n",
+    ]
+
+    directory = tempfile.mkdtemp()
+    gfa_path = os.path.join(directory, "test.gfa")
+
+    with open(gfa_path, 'w') as file:
+        file.write("".join(lines))
+
+    graph = load_gfa(gfa_path)
+    a, b, c, d, e = [graph.id_map.get_id(name) for name in "abcde"]
+
+    expected = [
+        ([a], 0, [a]),
+        ([a], 1, [a, b]),
+        ([a], 2, [a, b, c]),
+        ([a], 10, [a, b, c, d]),
+        ([d, e], 1, [c, d, e]),
+        ([], 3, []),
+    ]
+
+    for ids,n_hops,result in expected:
+        neighborhood = graph.get_neighborhood(ids, n_hops).tolist()
+
+        if neighborhood != sorted(result):
+            raise Exception("ERROR: unexpected neighborhood of %s in %d hops: %s" % (str(ids), n_hops, str(neighborhood)))
+
+    # Unsorted ids, the subgraph keeps their order and only the L-lines between them
+    subgraph = graph.get_subgraph([d, b, c])
+
+    if [subgraph.id_map.get_name(i) for i in range(len(subgraph))] != ["d", "b", "c"]:
+        raise Exception("ERROR: unexpected subgraph segments")
+
+    if subgraph.lengths.tolist() != [3, 8, 2] or subgraph.sequences[0] != "AAA":
+        raise Exception("ERROR: unexpected subgraph lengths or sequences")
+
+    links = list(zip(subgraph.edge_a.tolist(), subgraph.edge_reversal_a.tolist(), subgraph.edge_b.tolist(), subgraph.edge_reversal_b.tolist()))
+
+    if links != [(1, False, 2, False), (2, True, 0, False), (0, False, 0, False)]:
+        raise Exception("ERROR: unexpected subgraph links: " + str(links))
+
+    if subgraph.get_neighborhood([1], 1).tolist() != [1, 2]:
+        raise Exception("ERROR: subgraph adjacency was not rebuilt")
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,629 @@
+from modules.Task import run_in_subprocess, run_in_pool, set_stage, update_progress, add_details
+from modules.Gfa import find_connected_components
+from modules.LayoutCache import get_layout_key, load_cached_layout, save_cached_layout
+from modules.Multilevel import layout_multilevel
+from modules.BarnesHut import layout_barnes_hut
+from modules.Chains import ChainCollapse
+
+import importlib.util
+import random
+import numpy
+import time
+import sys
+import os
+
+LAYOUT_SFDP = "sfdp"
+LAYOUT_FORCE_ATLAS2 = "force_atlas2"
+LAYOUT_MULTILEVEL = "multilevel"
+LAYOUT_BARNES_HUT = "barnes_hut"
+
+
+def get_midpoint(a,b):
+    x = float(a[0] + b[0])/2.0
+    y = float(a[1] + b[1])/2.0
+
+    return x,y
+
+
+class Scaffold:
+    def __init__(self, segment_names, subnode_counts):
+        # Every segment s gets a contiguous range of scaffold ids starting at offsets[s]: its left and right ends,
+        # followed by the top/bottom pair of each of its subnodes, interleaved. Ids are derived arithmetically
+        # and names are only generated on request.
+        self.segment_names = segment_names
+        self.subnode_counts = subnode_counts
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(2 + 2*subnode_counts)]).astype(numpy.int64)
+
+        # Ladder edges within segments followed by one edge per L-line, as (a,b) rows with a weight each, and the
+        # length of each edge in a straight ladder whose rungs have length 1
+        self.edges = numpy.zeros((0,2), dtype=numpy.int64)
+        self.weights = numpy.zeros(0, dtype=numpy.float64)
+        self.rest_lengths = numpy.zeros(0, dtype=numpy.float64)
+
+        # Graph of segments only (one node per segment id), used to seed the full layout
+        self.seed_edges = numpy.zeros((0,2), dtype=numpy.int64)
+        self.seed_weights = numpy.zeros(0, dtype=numpy.float64)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def get_left_ids(self):
+        return self.offsets[:-1]
+
+    def get_right_ids(self):
+        return self.offsets[:-1] + 1
+
+    def get_end_ids(self, segment_ids, reversals, leaving):
+        # The scaffold node at which an edge leaves (or enters) each oriented segment
+        use_left = reversals if leaving else ~reversals
+        return self.offsets[segment_ids] + numpy.where(use_left, 0, 1)
+
+    def get_segment_ids(self, ids):
+        return numpy.searchsorted(self.offsets, ids, side="right") - 1
+
+    def get_name(self, id):
+        s = int(self.get_segment_ids(id))
+        name = self.segment_names[s]
+        i = id - self.offsets[s]
+
+        if i == 0:
+            return name + "_left"
+        elif i == 1:
+            return name + "_right"
+        else:
+            return name + "_" + str((i - 2)//2) + ("_top" if i % 2 == 0 else "_bottom")
+
+    def get_polyline_ids(self):
+        # Each segment is drawn through its left end, the midpoint of each top/bottom pair and its right end.
+        # Returns the pair of scaffold ids whose midpoint is each point, and the CSR starts of each segment.
+        counts = self.subnode_counts + 2
+        point_starts = numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64)
+
+        segments = numpy.repeat(numpy.arange(len(counts)), counts)
+        k = numpy.arange(point_starts[-1]) - point_starts[segments]
+        n = self.subnode_counts[segments]
+        base = self.offsets[segments]
+
+        ids_a = numpy.where(k == 0, base, numpy.where(k == n + 1, base + 1, base + 2*k))
+        ids_b = numpy.where(k == 0, base, numpy.where(k == n + 1, base + 1, base + 2*k + 1))
+
+        return ids_a, ids_b, point_starts
+
+
+class GraphLayout:
+    def __init__(self, n_segments=0):
+        # Polyline for each segment id, in CSR layout: the points of segment i are points[point_starts[i]:point_starts[i+1]]
+        self.point_starts = numpy.zeros(n_segments + 1, dtype=numpy.int64)
+        self.points = numpy.zeros((0,2), dtype=numpy.float64)
+
+        # Endpoints (x_a, y_a, x_b, y_b) of each L-line, in scene coordinates
+        self.edge_lines = numpy.zeros((0,4), dtype=numpy.float64)
+
+    def __len__(self):
+        return len(self.point_starts) - 1
+
+    def set_segment_points(self, segment_points):
+        # From a list of point lists, indexed by segment id
+        counts = [len(points) for points in segment_points]
+
+        self.point_starts = numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64)
+        self.points = numpy.array([p for points in segment_points for p in points], dtype=numpy.float64).reshape((-1,2))
+
+    def set_edge_lines(self, graph):
+        # Each L-line joins the end of its first segment's polyline to the start of the second (or the other way around
+        # for reversed segments)
+        edge_a = numpy.asarray(graph.edge_a, dtype=numpy.int64)
+        edge_b = numpy.asarray(graph.edge_b, dtype=numpy.int64)
+
+        a = numpy.where(graph.edge_reversal_a, self.point_starts[edge_a], self.point_starts[edge_a + 1] - 1)
+        b = numpy.where(graph.edge_reversal_b, self.point_starts[edge_b + 1] - 1, self.point_starts[edge_b])
+
+        self.edge_lines = numpy.concatenate([self.points[a], self.points[b]], axis=1).reshape((-1,4))
+
+    def get_segment_points(self, id):
+        return self.points[self.point_starts[id]:self.point_starts[id+1]]
+
+    def iter_segment_points(self):
+        for id in range(len(self)):
+            points = self.get_segment_points(id)
+
+            if len(points) > 0:
+                yield id, points
+
+
+def build_scaffold(graph, length_scale_factor, min_node_length, progress=None):
+    total_length = graph.get_total_length()
+
+    interval_size = (float(total_length)/float(length_scale_factor))
+
+    set_stage(progress, "Building scaffold")
+    add_details(progress, total_length=total_length, length_scale_factor=length_scale_factor, interval_size=interval_size)
+
+    lengths = numpy.asarray(graph.lengths, dtype=numpy.float64)
+    subnode_counts = numpy.maximum(numpy.rint(lengths/interval_size).astype(numpy.int64), max(1, min_node_length))
+
+    scaffold = Scaffold(graph.id_map.id_to_name, subnode_counts)
+
+    # One entry per subnode pair, where top = offset + 2 + 2i and bottom = top + 1
+    segments = numpy.repeat(numpy.arange(len(subnode_counts)), subnode_counts)
+    pair_starts = numpy.concatenate([[0], numpy.cumsum(subnode_counts)])
+    i = numpy.arange(pair_starts[-1]) - pair_starts[segments]
+    top = scaffold.offsets[segments] + 2 + 2*i
+    bottom = top + 1
+
+    # Each pair is joined to the previous pair in the same segment by 4 edges
+    has_previous = i > 0
+    t = top[has_previous]
+    b = bottom[has_previous]
+
+    left = scaffold.get_left_ids()
+    right = scaffold.get_right_ids()
+    first = left + 2
+    last = left + 2*subnode_counts
+
+    ladder = [
+        (top, bottom),
+        (t, t - 2), (b, b - 2), (t, b - 2), (b, t - 2),
+        (left, first), (left, first + 1),
+        (right, last), (right, last + 1),
+    ]
+
+    edge_a = numpy.asarray(graph.edge_a, dtype=numpy.int64)
+    edge_b = numpy.asarray(graph.edge_b, dtype=numpy.int64)
+    edge_reversal_a = numpy.asarray(graph.edge_reversal_a, dtype=bool)
+    edge_reversal_b = numpy.asarray(graph.edge_reversal_b, dtype=bool)
+
+    links = (scaffold.get_end_ids(edge_a, edge_reversal_a, True), scaffold.get_end_ids(edge_b, edge_reversal_b, False))
+
+    scaffold.edges = numpy.stack([
+        numpy.concatenate([a for a,b in ladder] + [links[0]]),
+        numpy.concatenate([b for a,b in ladder] + [links[1]])
+    ], axis=1)
+
+    n_ladder_edges = sum(len(a) for a,b in ladder)
+    scaffold.weights = numpy.concatenate([numpy.ones(n_ladder_edges), numpy.full(len(edge_a), 0.5)])
+
+    # As drawn by layout_straight: rungs and rails are 1 long, diagonals cross a unit square, and the ends are half a
+    # rung off the axis of the first and last pair. L-lines are as long as a rail.
+    ladder_lengths = [1.0, 1.0, 1.0, numpy.sqrt(2), numpy.sqrt(2)] + [numpy.sqrt(1.25)]*4
+    scaffold.rest_lengths = numpy.concatenate([numpy.full(len(a), l) for (a,b),l in zip(ladder, ladder_lengths)] + [numpy.ones(len(edge_a))])
+
+    scaffold.seed_edges = numpy.stack([edge_a, edge_b], axis=1)
+    scaffold.seed_weights = numpy.full(len(edge_a), 0.5)
+
+    return scaffold
+
+
+def has_cugraph():
+    return importlib.util.find_spec("cugraph") is not None and importlib.util.find_spec("cudf") is not None
+
+
+def layout_with_cugraph(seed_positions, scaffold, scale):
+    # Imported here, because loading them initializes CUDA, and they are only needed for this backend
+    from cugraph import Graph as cuGraph
+    from cugraph import force_atlas2
+    from cudf import DataFrame
+
+    seed_df = DataFrame({'vertex':numpy.arange(len(seed_positions)), 'x':seed_positions[:,0], 'y':seed_positions[:,1]})
+
+    seed_edge_df = DataFrame({0:scaffold.seed_edges[:,0], 1:scaffold.seed_edges[:,1], 2:scaffold.seed_weights})
+    edge_df = DataFrame({0:scaffold.edges[:,0], 1:scaffold.edges[:,1], 2:scaffold.weights})
+
+    seed_graph = cuGraph()
+    graph = cuGraph()
+
+    seed_graph.from_cudf_edgelist(seed_edge_df, source=0, destination=1, weight=2)
+    seed_result = force_atlas2(seed_graph, max_iter=1000, pos_list=seed_df, scaling_ratio=8.0)
+
+    # Every scaffold node starts at the position of its segment in the seed layout
+    seed_result = seed_result.sort_values('vertex')
+    seed_x = seed_result['x'].to_numpy()
+    seed_y = seed_result['y'].to_numpy()
+    segment_ids = scaffold.get_segment_ids(numpy.arange(len(scaffold)))
+
+    initial_positions_df = DataFrame({'vertex':numpy.arange(len(scaffold)), 'x':seed_x[segment_ids], 'y':seed_y[segment_ids]})
+
+    graph.from_cudf_edgelist(edge_df, source=0, destination=1, weight=2)
+
+    result = force_atlas2(graph, pos_list=initial_positions_df, max_iter=4000, jitter_tolerance=0.3, scaling_ratio=4.0, barnes_hut_theta=0.90)
+
+    positions = numpy.zeros((len(scaffold),2), dtype=numpy.float64)
+    vertices = result["vertex"].to_numpy().astype(numpy.int64)
+    positions[vertices,0] = scale*result['x'].to_numpy()
+    positions[vertices,1] = scale*result['y'].to_numpy()
+
+    return positions
+
+
+def layout_edges_with_graphviz(n, edges, weights):
+    import networkx
+
+    graph = networkx.Graph()
+
+    graph.add_nodes_from(range(n))
+
+    for (a,b),w in zip(edges.tolist(), weights.tolist()):
+        graph.add_edge(a,b,weight=w)
+
+    s = random.randint(0,2**16-1)
+    result = networkx.drawing.nx_agraph.graphviz_layout(graph, prog="sfdp", args="-Grepulsiveforce=1.2 -Gstart=%d" % s)
+
+    positions = numpy.zeros((n,2), dtype=numpy.float64)
+    for id,item in result.items():
+        positions[id] = item
+
+    return positions
+
+
+def split_scaffold(scaffold, segment_components, n_components):
+    # Returns, for each component, the global ids of its scaffold nodes and its edges (renumbered locally) with weights
+    node_components = segment_components[scaffold.get_segment_ids(numpy.arange(len(scaffold)))]
+
+    node_order = numpy.argsort(node_components, kind="stable")
+    node_starts = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(node_components, minlength=n_components))])
+
+    local_ids = numpy.empty(len(scaffold), dtype=numpy.int64)
+    local_ids[node_order] = numpy.arange(len(scaffold)) - node_starts[node_components[node_order]]
+
+    edge_components = node_components[scaffold.edges[:,0]]
+    edge_order = numpy.argsort(edge_components, kind="stable")
+    edge_starts = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(edge_components, minlength=n_components))])
+
+    local_edges = local_ids[scaffold.edges[edge_order]]
+    weights = scaffold.weights[edge_order]
+
+    components = list()
+    for c in range(n_components):
+        a = edge_starts[c]
+        b = edge_starts[c+1]
+        components.append((node_order[node_starts[c]:node_starts[c+1]], local_edges[a:b], weights[a:b]))
+
+    return components
+
+
+def layout_straight(scaffold, ids, edge_length):
+    # A lone segment with no L-lines is simply drawn as a straight ladder
+    segment_ids = scaffold.get_segment_ids(ids)
+    k = ids - scaffold.offsets[segment_ids]
+    n = scaffold.subnode_counts[segment_ids]
+
+    x = numpy.where(k == 0, 0, numpy.where(k == 1, n + 1, (k - 2)//2 + 1))*edge_length
+    y = numpy.where(k < 2, 0, numpy.where(k % 2 == 0, 0.5, -0.5))*edge_length
+
+    return numpy.stack([x,y], axis=1).astype(numpy.float64)
+
+
+def get_seed_positions(scaffold, edge_length, centers=None):
+    # Every segment starts as a straight ladder with a random orientation, at the given (or a random) position
+    ids = numpy.arange(len(scaffold))
+    segment_ids = scaffold.get_segment_ids(ids)
+
+    local = layout_straight(scaffold, ids, edge_length)
+    local[:,0] -= (scaffold.subnode_counts[segment_ids] + 1)*edge_length/2.0
+
+    n_segments = len(scaffold.subnode_counts)
+    angles = numpy.random.uniform(0, 2*numpy.pi, n_segments)[segment_ids]
+    if centers is None:
+        centers = numpy.random.uniform(-0.5, 0.5, size=(n_segments,2))*numpy.sqrt(len(scaffold))*edge_length
+
+    x = local[:,0]*numpy.cos(angles) - local[:,1]*numpy.sin(angles)
+    y = local[:,0]*numpy.sin(angles) + local[:,1]*numpy.cos(angles)
+
+    return centers[segment_ids] + numpy.stack([x,y], axis=1)
+
+
+def pack_components(component_positions, margin):
+    # Shelf packing of the bounding boxes, tallest first, into rows of roughly square total extent.
+    # Each array of positions is translated in place.
+    if len(component_positions) == 0:
+        return
+
+    lows = numpy.array([p.min(axis=0) for p in component_positions])
+    sizes = numpy.array([p.max(axis=0) for p in component_positions]) - lows + margin
+
+    row_width = max(sizes[:,0].max(), numpy.sqrt((sizes[:,0]*sizes[:,1]).sum()))
+
+    x = 0
+    y = 0
+    row_height = 0
+
+    for c in numpy.argsort(-sizes[:,1], kind="stable"):
+        if x > 0 and x + sizes[c,0] > row_width:
+            x = 0
+            y += row_height
+            row_height = 0
+
+        component_positions[c] += numpy.array([x,y]) - lows[c]
+
+        x += sizes[c,0]
+        row_height = max(row_height, sizes[c,1])
+
+
+def layout_components_with_graphviz(graph, scaffold, n_processes=1, in_subprocess=False, progress=None):
+    components, n_components = find_connected_components(len(graph), graph.edge_a, graph.edge_b)
+
+    parts = split_scaffold(scaffold, components, n_components)
+
+    # Lone segments don't need a force layout, everything else is laid out largest first to balance the pool
+    is_lone = numpy.bincount(components, minlength=n_components) == 1
+    is_lone[components[numpy.asarray(graph.edge_a, dtype=numpy.int64)]] = False
+
+    tasks = [c for c in range(n_components) if not is_lone[c]]
+    tasks.sort(key=lambda c: -len(parts[c][0]))
+
+    set_stage(progress, "Layout (sfdp)", len(tasks))
+    add_details(progress, components=n_components, lone_segments=int(is_lone.sum()), processes=n_processes)
+
+    results = run_in_pool(layout_edges_with_graphviz, [(len(parts[c][0]), parts[c][1], parts[c][2]) for c in tasks], n_processes, progress, in_subprocess=in_subprocess)
+
+    component_positions = [None]*n_components
+    for c,positions in zip(tasks, results):
+        component_positions[c] = positions
+
+    # Lone segments use the typical edge length of the force layouts
+    edge_length = 4.0
+    if len(tasks) > 0:
+        c = tasks[0]
+        edges = parts[c][1]
+        edge_length = float(numpy.median(numpy.sqrt(((component_positions[c][edges[:,0]] - component_positions[c][edges[:,1]])**2).sum(axis=1))))
+
+    for c in numpy.flatnonzero(is_lone):
+        component_positions[c] = layout_straight(scaffold, parts[c][0], edge_length)
+
+    set_stage(progress, "Packing components")
+    pack_components(component_positions, margin=4*edge_length)
+
+    positions = numpy.zeros((len(scaffold),2), dtype=numpy.float64)
+    for c in range(n_components):
+        positions[parts[c][0]] = component_positions[c]
+
+    return positions
+
+
+def pack_layout_components(graph, scaffold, positions, progress=None):
+    # For layouts of the whole scaffold at once, where components that are not connected drift apart under
+    # repulsion. Each component keeps its shape, and they are packed as in layout_components_with_graphviz.
+    components, n_components = find_connected_components(len(graph), graph.edge_a, graph.edge_b)
+
+    set_stage(progress, "Packing components")
+    add_details(progress, components=n_components)
+
+    if n_components <= 1:
+        return positions
+
+    parts = split_scaffold(scaffold, components, n_components)
+    component_positions = [positions[ids] for ids,edges,weights in parts]
+
+    # The margin is in units of the typical edge of the layout
+    lengths = numpy.sqrt(((positions[scaffold.edges[:,0]] - positions[scaffold.edges[:,1]])**2).sum(axis=1))
+    edge_length = float(numpy.median(lengths)) if len(lengths) > 0 else 1.0
+
+    pack_components(component_positions, margin=4*max(edge_length, 1e-9))
+
+    for (ids,edges,weights),p in zip(parts, component_positions):
+        positions[ids] = p
+
+    return positions
+
+
+def resample_polyline(points, n):
+    # n points, evenly spaced along the arc length of the polyline
+    if len(points) == 1:
+        return numpy.repeat(points, n, axis=0)
+
+    steps = numpy.sqrt((numpy.diff(points, axis=0)**2).sum(axis=1))
+    distances = numpy.concatenate([[0], numpy.cumsum(steps)])
+
+    if distances[-1] == 0:
+        return numpy.repeat(points[:1], n, axis=0)
+
+    targets = numpy.linspace(0, distances[-1], n)
+
+    x = numpy.interp(targets, distances, points[:,0])
+    y = numpy.interp(targets, distances, points[:,1])
+
+    return numpy.stack([x,y], axis=1)
+
+
+def get_warm_start_positions(scaffold, previous_layout):
+    # Places every scaffold node on the polyline that its segment had in the previous layout, so that subnodes
+    # which were added or removed by a change in parameters are interpolated rather than placed randomly
+    steps = numpy.sqrt((numpy.diff(previous_layout.points, axis=0)**2).sum(axis=1))
+
+    # Steps that cross from the end of one segment to the start of the next are excluded
+    starts = previous_layout.point_starts[1:-1]
+    starts = starts[(starts > 0) & (starts < len(previous_layout.points))]
+
+    within = numpy.ones(len(steps), dtype=bool)
+    within[starts - 1] = False
+    steps = steps[within]
+
+    rest_length = float(numpy.median(steps)) if len(steps) > 0 else 1.0
+    if rest_length == 0:
+        rest_length = 1.0
+
+    positions = numpy.zeros((len(scaffold),2), dtype=numpy.float64)
+
+    for s,n in enumerate(scaffold.subnode_counts.tolist()):
+        old_points = previous_layout.get_segment_points(s)
+
+        if len(old_points) == 0:
+            old_points = numpy.random.uniform(-50, 50, size=(1,2))
+
+        points = resample_polyline(old_points, n + 2)
+
+        # The top/bottom rungs of the ladder straddle the polyline, perpendicular to it
+        tangents = numpy.gradient(points, axis=0)
+        norms = numpy.sqrt((tangents**2).sum(axis=1))
+        norms[norms == 0] = 1
+        normals = numpy.stack([-tangents[:,1], tangents[:,0]], axis=1)*(0.5*rest_length/norms)[:,None]
+
+        base = scaffold.offsets[s]
+        positions[base] = points[0]
+        positions[base + 1] = points[-1]
+        positions[base + 2:base + 2 + 2*n:2] = points[1:-1] + normals[1:-1]
+        positions[base + 3:base + 3 + 2*n:2] = points[1:-1] - normals[1:-1]
+
+    return positions, rest_length
+
+
+def refine_layout(positions, edges, rest_lengths, iterations, progress=None):
+    # Short spring relaxation of an existing layout, with no repulsion term, so it only corrects local
+    # distortions and does not untangle anything. rest_lengths is one length per edge (or one for all).
+    a = edges[:,0]
+    b = edges[:,1]
+
+    n = len(positions)
+    degree = numpy.bincount(a, minlength=n) + numpy.bincount(b, minlength=n)
+    degree[degree == 0] = 1
+
+    set_stage(progress, "Refining layout", iterations)
+
+    for i in range(iterations):
+        update_progress(progress, i, iterations)
+
+        d = positions[b] - positions[a]
+        length = numpy.sqrt((d**2).sum(axis=1))
+        length[length == 0] = 1e-9
+
+        f = d*(0.5*(length - rest_lengths)/length)[:,None]
+
+        delta = numpy.empty_like(positions)
+        for axis in range(2):
+            delta[:,axis] = numpy.bincount(a, weights=f[:,axis], minlength=n) - numpy.bincount(b, weights=f[:,axis], minlength=n)
+
+        positions += delta/degree[:,None]
+
+    return positions
+
+
+def compute_layout(graph, length_scale_factor, min_node_length, use_cugraph=False, progress=None, in_subprocess=False, read_cache=False, write_cache=False, previous_layout=None, refine_iterations=50, backend=None, n_processes=None, time_budget=None, collapse_chains=False):
+    if backend is None:
+        backend = LAYOUT_FORCE_ATLAS2 if use_cugraph else LAYOUT_SFDP
+
+    if backend not in (LAYOUT_SFDP, LAYOUT_FORCE_ATLAS2, LAYOUT_MULTILEVEL, LAYOUT_BARNES_HUT):
+        raise Exception("ERROR: unknown layout backend: " + str(backend))
+
+    # sfdp is seeded randomly, so a cached entry is only reused when asked for (e.g. reopening a file), while
+    # an explicit redraw recomputes and replaces it
+    key = None
+    if read_cache or write_cache:
+        set_stage(progress, "Hashing graph")
+        key = get_layout_key(graph, backend, length_scale_factor=length_scale_factor, min_node_length=min_node_length, collapse_chains=collapse_chains)
+
+    if read_cache:
+        set_stage(progress, "Reading cached layout")
+        result = load_cached_layout(key, GraphLayout())
+
+        is_valid = result is not None and len(result) == len(graph) and len(result.edge_lines) == graph.get_edge_count()
+        add_details(progress, cache_key=key, cache_hit=is_valid)
+
+        if is_valid:
+            return result
+
+    # Each unitig chain is laid out as a single segment, and its polyline is cut back into segments afterwards
+    if collapse_chains:
+        set_stage(progress, "Collapsing unitig chains")
+        chains = ChainCollapse(graph)
+        add_details(progress, segments=len(graph), chains=len(chains.collapsed))
+
+        previous_chain_layout = None
+        if previous_layout is not None and len(previous_layout) == len(graph):
+            previous_chain_layout = GraphLayout(len(chains.collapsed))
+            previous_chain_layout.point_starts, previous_chain_layout.points = chains.merge_polylines(previous_layout.point_starts, previous_layout.points)
+
+        chain_layout = compute_layout(
+            chains.collapsed, length_scale_factor, min_node_length, progress=progress, in_subprocess=in_subprocess,
+            previous_layout=previous_chain_layout, refine_iterations=refine_iterations, backend=backend,
+            n_processes=n_processes, time_budget=time_budget
+        )
+
+        result = GraphLayout(len(graph))
+        result.point_starts, result.points = chains.expand_polylines(chain_layout.point_starts, chain_layout.points)
+        result.set_edge_lines(graph)
+
+        if write_cache and previous_chain_layout is None:
+            save_cached_layout(key, result)
+
+        return result
+
+    scaffold = build_scaffold(graph, length_scale_factor, min_node_length, progress=progress)
+
+    # Warm start: reuse the previous polylines and skip the global layout entirely. The result is only an
+    # approximation of a full layout, so it is not cached.
+    if previous_layout is not None and len(previous_layout) == len(graph):
+        positions, rest_length = get_warm_start_positions(scaffold, previous_layout)
+        positions = refine_layout(positions, scaffold.edges, rest_length*scaffold.rest_lengths, refine_iterations, progress=progress)
+
+        return collect_layout(graph, scaffold, positions, None, progress)
+
+    # Pure numpy, so it runs in the calling thread where it can report progress
+    if backend == LAYOUT_MULTILEVEL:
+        positions = layout_multilevel(graph, scaffold, progress=progress)
+        positions = pack_layout_components(graph, scaffold, positions, progress=progress)
+
+        return collect_layout(graph, scaffold, positions, key if write_cache else None, progress)
+
+    if backend == LAYOUT_BARNES_HUT:
+        # Two stages, like force_atlas2: the segment graph first, with edges as long as a typical segment, then the scaffold
+        set_stage(progress, "Layout (Barnes-Hut): segments", 300)
+        segment_length = 4.0*(numpy.mean(scaffold.subnode_counts) + 1) if len(graph) > 0 else 4.0
+        # The time budget is shared between the stages
+        start_time = time.monotonic()
+        centers = layout_barnes_hut(len(graph), scaffold.seed_edges, positions=None, edge_length=segment_length, time_budget=None if time_budget is None else 0.25*time_budget, progress=progress)
+
+        if time_budget is not None:
+            time_budget = max(0, time_budget - (time.monotonic() - start_time))
+
+        set_stage(progress, "Layout (Barnes-Hut)", 300)
+        seed_positions = get_seed_positions(scaffold, 4.0, centers)
+        positions = layout_barnes_hut(len(scaffold), scaffold.edges, scaffold.weights, positions=seed_positions, edge_length=4.0, time_budget=time_budget, progress=progress)
+        positions = pack_layout_components(graph, scaffold, positions, progress=progress)
+
+        return collect_layout(graph, scaffold, positions, key if write_cache else None, progress)
+
+    # Components are laid out independently in a pool of processes and then packed
+    if backend == LAYOUT_SFDP:
+        if n_processes is None:
+            n_processes = os.cpu_count() if in_subprocess else 1
+
+        positions = layout_components_with_graphviz(graph, scaffold, n_processes=n_processes, in_subprocess=in_subprocess, progress=progress)
+
+        return collect_layout(graph, scaffold, positions, key if write_cache else None, progress)
+
+    if not has_cugraph():
+        raise Exception("ERROR: cugraph and cudf are required for the " + backend + " layout")
+
+    seed_positions = numpy.random.randint(-50, 51, size=(len(graph),2)).astype(numpy.float64)
+
+    set_stage(progress, "Layout (" + backend + ")")
+    add_details(progress, seed_edges=len(scaffold.seed_edges), nodes=len(scaffold), edges=len(scaffold.edges), in_subprocess=in_subprocess)
+
+    scale = 0.03
+    args = (seed_positions, scaffold, scale)
+
+    if in_subprocess:
+        positions = run_in_subprocess(layout_with_cugraph, args, progress)
+    else:
+        positions = layout_with_cugraph(*args)
+
+    return collect_layout(graph, scaffold, positions, key if write_cache else None, progress)
+
+
+def collect_layout(graph, scaffold, positions, cache_key=None, progress=None):
+    # Positions are indexed by scaffold id, the L-line edges are the last ones in the scaffold
+    set_stage(progress, "Collecting layout")
+
+    result = GraphLayout(len(graph))
+
+    link_ids = scaffold.edges[len(scaffold.edges) - graph.get_edge_count():]
+    result.edge_lines = numpy.concatenate([positions[link_ids[:,0]], positions[link_ids[:,1]]], axis=1)
+
+    ids_a, ids_b, point_starts = scaffold.get_polyline_ids()
+    result.point_starts = point_starts
+    result.points = (positions[ids_a] + positions[ids_b])/2.0
+
+    if cache_key is not None:
+        save_cached_layout(cache_key, result)
+
+    return result
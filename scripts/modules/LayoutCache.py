@@ -0,0 +1,78 @@
+import hashlib
+import numpy
+import sys
+import os
+
+
+CACHE_VERSION = 1
+
+
+def get_cache_directory():
+    directory = os.environ.get("JACKALOPE_CACHE")
+
+    if directory is None:
+        directory = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "jackalope")
+
+    return os.path.join(directory, "layouts")
+
+
+def get_layout_key(graph, backend, **parameters):
+    # Identifies the graph by its content (names, lengths and L-lines), so the key is the same wherever the file is
+    h = hashlib.sha1()
+
+    h.update(("version=%d\n" % CACHE_VERSION).encode("utf8"))
+    h.update(("backend=%s\n" % backend).encode("utf8"))
+
+    for name in sorted(parameters):
+        h.update(("%s=%s\n" % (name, str(parameters[name]))).encode("utf8"))
+
+    for name in graph.id_map.id_to_name:
+        h.update(name.encode("utf8"))
+        h.update(b'\n')
+
+    for array in (graph.lengths, graph.edge_a, graph.edge_b, graph.edge_reversal_a, graph.edge_reversal_b):
+        h.update(numpy.ascontiguousarray(array).tobytes())
+
+    return h.hexdigest()
+
+
+def get_cache_path(key):
+    return os.path.join(get_cache_directory(), key + ".npz")
+
+
+def load_cached_layout(key, layout):
+    # Fills the (empty) GraphLayout that is given, returns None if there is no usable entry
+    path = get_cache_path(key)
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with numpy.load(path) as data:
+            layout.point_starts = data["point_starts"]
+            layout.points = data["points"]
+            layout.edge_lines = data["edge_lines"]
+
+    except Exception as e:
+        sys.stderr.write("WARNING: could not read cached layout: " + str(e) + '\n')
+        return None
+
+    return layout
+
+
+def save_cached_layout(key, layout):
+    path = get_cache_path(key)
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written to a temporary file first, so that concurrent readers never see a partial entry
+        temp_path = path + ".%d.tmp" % os.getpid()
+
+        with open(temp_path, 'wb') as file:
+            numpy.savez(file, point_starts=layout.point_starts, points=layout.points, edge_lines=layout.edge_lines)
+
+        os.replace(temp_path, path)
+
+    except OSError as e:
+        sys.stderr.write("WARNING: could not write cached layout: " + str(e) + '\n')
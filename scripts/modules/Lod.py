@@ -0,0 +1,198 @@
+import numpy
+
+
+# Edges are batched into square tiles of this many pixels (at the zoom level of their LOD level)
+TILE_PIXELS = 512
+
+
+class LayoutLod:
+    def __init__(self, layout, n_levels=10):
+        # Level 0 is the layout itself. At level l > 0 polylines are decimated so that consecutive points are at
+        # least get_tolerance(l) apart, and edges that short are dropped, with the others snapped to that grid
+        # and deduplicated. Levels are built on first use.
+        self.layout = layout
+        self.n_levels = n_levels
+
+        starts = layout.point_starts[:-1]
+        stops = layout.point_starts[1:]
+        has_points = stops > starts
+
+        # Segments without points are never visible
+        self.bounds = numpy.empty((len(layout),4), dtype=numpy.float64)
+        self.bounds[:] = numpy.array([numpy.inf, numpy.inf, -numpy.inf, -numpy.inf])
+
+        # Reduced over the starts of non-empty segments only, each of which then ends where the next one starts
+        index = starts[has_points]
+
+        if len(index) > 0:
+            self.bounds[has_points,0] = numpy.minimum.reduceat(layout.points[:,0], index)
+            self.bounds[has_points,1] = numpy.minimum.reduceat(layout.points[:,1], index)
+            self.bounds[has_points,2] = numpy.maximum.reduceat(layout.points[:,0], index)
+            self.bounds[has_points,3] = numpy.maximum.reduceat(layout.points[:,1], index)
+
+        steps = numpy.sqrt((numpy.diff(layout.points, axis=0)**2).sum(axis=1))
+        self.step_lengths = steps
+
+        within = numpy.ones(len(steps), dtype=bool)
+        inner_starts = starts[(starts > 0) & (starts < len(layout.points))]
+        within[inner_starts - 1] = False
+
+        # The finest tolerance is about the spacing of the layout's own points
+        self.spacing = float(numpy.median(steps[within])) if within.any() else 1.0
+        if self.spacing <= 0:
+            self.spacing = 1.0
+
+        self.polylines = {0: (layout.point_starts, layout.points)}
+        self.edge_tiles = dict()
+
+    def get_extent(self):
+        if len(self.layout.points) == 0:
+            return 0.0, 0.0, 0.0, 0.0
+
+        low = self.layout.points.min(axis=0)
+        high = self.layout.points.max(axis=0)
+
+        if len(self.layout.edge_lines) > 0:
+            low = numpy.minimum(low, self.layout.edge_lines.reshape((-1,2)).min(axis=0))
+            high = numpy.maximum(high, self.layout.edge_lines.reshape((-1,2)).max(axis=0))
+
+        return float(low[0]), float(low[1]), float(high[0]), float(high[1])
+
+    def get_tolerance(self, level):
+        if level == 0:
+            return 0.0
+
+        return self.spacing*(2**(level - 1))
+
+    def get_level(self, pixel_size):
+        # The coarsest level whose tolerance is still below a pixel
+        if pixel_size < self.spacing:
+            return 0
+
+        return int(min(self.n_levels - 1, numpy.floor(numpy.log2(pixel_size/self.spacing)) + 1))
+
+    def get_visible_segments(self, x_min, y_min, x_max, y_max):
+        b = self.bounds
+        return numpy.flatnonzero((b[:,2] >= x_min) & (b[:,0] <= x_max) & (b[:,3] >= y_min) & (b[:,1] <= y_max))
+
+    def get_polylines(self, level):
+        if level not in self.polylines:
+            self.polylines[level] = self.simplify(self.get_tolerance(level))
+
+        return self.polylines[level]
+
+    def get_segment_points(self, level, id):
+        point_starts, points = self.get_polylines(level)
+        return points[point_starts[id]:point_starts[id+1]]
+
+    def simplify(self, tolerance):
+        # Keeps the first point of every stretch of arc length `tolerance`, and both ends of every segment
+        point_starts = self.layout.point_starts
+        points = self.layout.points
+
+        if len(points) == 0:
+            return point_starts, points
+
+        cumulative = numpy.concatenate([[0], numpy.cumsum(self.step_lengths)])
+        segments = numpy.repeat(numpy.arange(len(self.layout)), numpy.diff(point_starts))
+        local = cumulative - cumulative[point_starts[segments]]
+
+        buckets = numpy.floor(local/tolerance).astype(numpy.int64)
+
+        keep = numpy.ones(len(points), dtype=bool)
+        keep[1:] = buckets[1:] != buckets[:-1]
+        keep[point_starts[:-1][numpy.diff(point_starts) > 0]] = True
+        keep[point_starts[1:][numpy.diff(point_starts) > 0] - 1] = True
+
+        counts = numpy.bincount(segments[keep], minlength=len(self.layout))
+
+        return numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64), points[keep]
+
+    def get_tile_size(self, level):
+        return TILE_PIXELS*max(self.get_tolerance(level), self.spacing)
+
+    def get_edge_tiles(self, level):
+        # Dict of (tile_x, tile_y) -> array of lines (x_a, y_a, x_b, y_b), by the midpoint of each line. Lines longer
+        # than a tile are kept separately under None and are always visible.
+        if level in self.edge_tiles:
+            return self.edge_tiles[level]
+
+        lines = self.layout.edge_lines
+        tolerance = self.get_tolerance(level)
+
+        if level > 0 and len(lines) > 0:
+            lengths = numpy.sqrt((lines[:,2] - lines[:,0])**2 + (lines[:,3] - lines[:,1])**2)
+            lines = lines[lengths >= tolerance]
+
+            lines = numpy.round(lines/tolerance)*tolerance
+            lines = numpy.unique(lines, axis=0)
+
+        tile_size = self.get_tile_size(level)
+        result = dict()
+
+        lengths = numpy.sqrt((lines[:,2] - lines[:,0])**2 + (lines[:,3] - lines[:,1])**2)
+        is_long = lengths > tile_size
+
+        if is_long.any():
+            result[None] = lines[is_long]
+            lines = lines[~is_long]
+
+        midpoints = numpy.stack([(lines[:,0] + lines[:,2])/2, (lines[:,1] + lines[:,3])/2], axis=1)
+        tiles = numpy.floor(midpoints/tile_size).astype(numpy.int64)
+
+        order = numpy.lexsort((tiles[:,1], tiles[:,0]))
+        tiles = tiles[order]
+        lines = lines[order]
+
+        boundaries = numpy.flatnonzero((tiles[1:] != tiles[:-1]).any(axis=1)) + 1
+        starts = numpy.concatenate([[0], boundaries]).astype(numpy.int64)
+        stops = numpy.concatenate([boundaries, [len(lines)]]).astype(numpy.int64)
+
+        if len(lines) > 0:
+            for start,stop in zip(starts.tolist(), stops.tolist()):
+                result[(int(tiles[start,0]), int(tiles[start,1]))] = lines[start:stop]
+
+        self.edge_tiles[level] = result
+
+        return result
+
+    def get_visible_tiles(self, level, x_min, y_min, x_max, y_max):
+        # Lines may stick out of their tile by up to half their length, so the query is widened by one tile
+        tile_size = self.get_tile_size(level)
+        tiles = self.get_edge_tiles(level)
+
+        visible = [None] if None in tiles else list()
+
+        x_range = range(int(numpy.floor(x_min/tile_size)) - 1, int(numpy.floor(x_max/tile_size)) + 2)
+        y_range = range(int(numpy.floor(y_min/tile_size)) - 1, int(numpy.floor(y_max/tile_size)) + 2)
+
+        if len(x_range)*len(y_range) > len(tiles):
+            return visible + [tile for tile in tiles if tile is not None and tile[0] in x_range and tile[1] in y_range]
+
+        return visible + [(x,y) for x in x_range for y in y_range if (x,y) in tiles]
+
+
+def test():
+    from modules.Layout import GraphLayout
+
+    # Empty segments first, in between and last, as in the layouts of local mode
+    layout = GraphLayout(5)
+    layout.point_starts = numpy.array([0, 0, 2, 2, 4, 4], dtype=numpy.int64)
+    layout.points = numpy.array([[0,1], [2,3], [4,5], [8,9]], dtype=numpy.float64)
+
+    lod = LayoutLod(layout)
+
+    if not numpy.array_equal(lod.bounds[[1,3]], [[0,1,2,3], [4,5,8,9]]):
+        raise Exception("ERROR: unexpected bounds: " + str(lod.bounds))
+
+    if not numpy.isinf(lod.bounds[[0,2,4]]).all():
+        raise Exception("ERROR: empty segments have bounds: " + str(lod.bounds))
+
+    if lod.get_visible_segments(7, 8, 10, 10).tolist() != [3]:
+        raise Exception("ERROR: unexpected visible segments: " + str(lod.get_visible_segments(7, 8, 10, 10)))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
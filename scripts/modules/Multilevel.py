@@ -0,0 +1,298 @@
+from modules.Task import set_stage, update_progress
+from modules.Chains import find_unitig_chains
+import numpy
+
+
+# Above this many nodes, repulsion is approximated on a grid instead of being computed for every pair. Only the
+# coarsest level is normally this small, the finer levels get their long range structure from it.
+MAX_EXACT_NODES = 300
+
+# Coarsening stops once a level is this small, or when it no longer shrinks much
+COARSEST_SIZE = 200
+MIN_REDUCTION = 0.8
+
+
+class Level:
+    def __init__(self, n, edges, weights=None):
+        self.n = n
+        self.edges = edges
+        self.weights = weights
+
+        # Mapping to the next coarser level, with the position (rank) of each node among the nodes that share a parent
+        self.parents = None
+        self.ranks = None
+
+
+def get_coarse_edges(edges, parents):
+    # Edges between distinct parents, without duplicates
+    if len(edges) == 0:
+        return edges
+
+    a = parents[edges[:,0]]
+    b = parents[edges[:,1]]
+    keep = a != b
+
+    pairs = numpy.stack([numpy.minimum(a[keep], b[keep]), numpy.maximum(a[keep], b[keep])], axis=1)
+
+    return numpy.unique(pairs, axis=0)
+
+
+def match_neighbors(n, edges):
+    # Each node picks its incident edge with the lowest random key, and edges that are picked by both endpoints
+    # are contracted. Returns parents and ranks (0 or 1).
+    parents = numpy.arange(n, dtype=numpy.int64)
+    ranks = numpy.zeros(n, dtype=numpy.int64)
+
+    if len(edges) == 0:
+        return parents, ranks, n
+
+    keys = numpy.random.random(len(edges))
+
+    nodes = numpy.concatenate([edges[:,0], edges[:,1]])
+    all_keys = numpy.concatenate([keys, keys])
+    edge_ids = numpy.concatenate([numpy.arange(len(edges)), numpy.arange(len(edges))])
+
+    order = numpy.lexsort((all_keys, nodes))
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = nodes[order][1:] != nodes[order][:-1]
+
+    best = numpy.full(n, -1, dtype=numpy.int64)
+    best[nodes[order][first]] = edge_ids[order][first]
+
+    matched = (best[edges[:,0]] == numpy.arange(len(edges))) & (best[edges[:,1]] == numpy.arange(len(edges)))
+
+    # The second node of each matched edge joins the first one
+    parents[edges[matched,1]] = edges[matched,0]
+    ranks[edges[matched,1]] = 1
+
+    unique_parents, parents = numpy.unique(parents, return_inverse=True)
+
+    return parents, ranks, len(unique_parents)
+
+
+def build_hierarchy(graph, scaffold):
+    # Finest first: scaffold subnodes -> segments -> unitig chains -> repeated matchings
+    levels = list()
+
+    level = Level(len(scaffold), scaffold.edges, scaffold.weights)
+    segment_ids = scaffold.get_segment_ids(numpy.arange(len(scaffold)))
+    k = numpy.arange(len(scaffold)) - scaffold.offsets[segment_ids]
+    n = scaffold.subnode_counts[segment_ids]
+
+    # Order of scaffold nodes along their segment: left end, subnode pairs, right end
+    level.parents = segment_ids
+    level.ranks = numpy.where(k == 0, 0, numpy.where(k == 1, n + 1, (k - 2)//2 + 1))
+    levels.append(level)
+
+    segment_edges = get_coarse_edges(scaffold.seed_edges, numpy.arange(len(graph)))
+    level = Level(len(graph), segment_edges)
+    level.parents, level.ranks, reversals = find_unitig_chains(len(graph), graph.edge_a, graph.edge_reversal_a, graph.edge_b, graph.edge_reversal_b)
+    levels.append(level)
+
+    n_chains = int(level.parents.max()) + 1 if len(graph) > 0 else 0
+    level = Level(n_chains, get_coarse_edges(level.edges, level.parents))
+
+    while level.n > COARSEST_SIZE:
+        parents, ranks, n_parents = match_neighbors(level.n, level.edges)
+
+        if n_parents > MIN_REDUCTION*level.n:
+            break
+
+        level.parents = parents
+        level.ranks = ranks
+        levels.append(level)
+
+        level = Level(n_parents, get_coarse_edges(level.edges, parents))
+
+    levels.append(level)
+
+    return levels
+
+
+def get_repulsion_exact(positions, k):
+    diff = positions[:,None,:] - positions[None,:,:]
+    distance2 = (diff**2).sum(axis=2)
+    numpy.fill_diagonal(distance2, numpy.inf)
+    distance2 = numpy.maximum(distance2, (0.01*k)**2)
+
+    return (diff*(k*k/distance2)[:,:,None]).sum(axis=1)
+
+
+def get_repulsion_grid(positions, k):
+    # Only nearby nodes repel: each node is pushed away from the centroid of every cell in the surrounding 3x3
+    # block, in proportion to the number of nodes in it. Long range structure comes from the coarser levels.
+    size = 2*k
+    cells = numpy.floor(positions/size).astype(numpy.int64)
+    cells -= cells.min(axis=0) - 1
+    width = int(cells[:,1].max()) + 2
+
+    keys = cells[:,0]*width + cells[:,1]
+    unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+
+    counts = numpy.bincount(inverse).astype(numpy.float64)
+    sums = numpy.stack([numpy.bincount(inverse, weights=positions[:,0]), numpy.bincount(inverse, weights=positions[:,1])], axis=1)
+
+    force = numpy.zeros_like(positions)
+
+    for dx in (-1,0,1):
+        for dy in (-1,0,1):
+            if dx == 0 and dy == 0:
+                # Own cell, excluding the node itself
+                mass = counts[inverse] - 1
+                centroid = (sums[inverse] - positions)/numpy.maximum(mass, 1)[:,None]
+            else:
+                neighbor_keys = keys + dx*width + dy
+                index = numpy.minimum(numpy.searchsorted(unique_keys, neighbor_keys), len(unique_keys) - 1)
+                found = unique_keys[index] == neighbor_keys
+
+                mass = numpy.where(found, counts[index], 0)
+                centroid = sums[index]/counts[index][:,None]
+
+            diff = positions - centroid
+            distance2 = numpy.maximum((diff**2).sum(axis=1), (0.01*k)**2)
+
+            force += diff*(mass*k*k/distance2)[:,None]
+
+    return force
+
+
+def apply_forces(positions, edges, weights, k, temperature):
+    n = len(positions)
+
+    if n <= MAX_EXACT_NODES:
+        displacement = get_repulsion_exact(positions, k)
+    else:
+        displacement = get_repulsion_grid(positions, k)
+
+    if len(edges) > 0:
+        a = edges[:,0]
+        b = edges[:,1]
+
+        d = positions[b] - positions[a]
+        distance = numpy.sqrt((d**2).sum(axis=1))
+        f = d*(distance/k)[:,None]
+
+        if weights is not None:
+            f *= weights[:,None]
+
+        for axis in range(2):
+            displacement[:,axis] += numpy.bincount(a, weights=f[:,axis], minlength=n) - numpy.bincount(b, weights=f[:,axis], minlength=n)
+
+    # Displacements are capped by the temperature
+    length = numpy.sqrt((displacement**2).sum(axis=1))
+    length[length == 0] = 1
+
+    positions += displacement*(numpy.minimum(length, temperature)/length)[:,None]
+
+
+def run_level(positions, level, k, iterations, start_temperature, stop_temperature, progress=None):
+    for i in range(iterations):
+        update_progress(progress, i, iterations)
+
+        temperature = start_temperature + (stop_temperature - start_temperature)*i/max(1, iterations - 1)
+        apply_forces(positions, level.edges, level.weights, k, temperature)
+
+    return positions
+
+
+def prolong(coarse_positions, level, k):
+    # Children start on a short randomly oriented line through their parent, in rank order, which
+    # gives chains (and the subnodes of a segment) a good starting point to unfold from
+    sizes = numpy.bincount(level.parents)
+    angles = numpy.random.uniform(0, 2*numpy.pi, len(coarse_positions))
+    directions = numpy.stack([numpy.cos(angles), numpy.sin(angles)], axis=1)
+
+    offsets = (level.ranks - (sizes[level.parents] - 1)/2.0)*k
+    jitter = numpy.random.uniform(-0.1*k, 0.1*k, size=(level.n,2))
+
+    return coarse_positions[level.parents] + directions[level.parents]*offsets[:,None] + jitter
+
+
+def layout_multilevel(graph, scaffold, edge_length=20.0, iterations=50, progress=None):
+    set_stage(progress, "Coarsening")
+    levels = build_hierarchy(graph, scaffold)
+
+    # Ideal edge length grows with the coarseness of the level, so that every level covers the same area
+    n_finest = max(1, levels[0].n)
+
+    coarsest = levels[-1]
+    k = edge_length*numpy.sqrt(n_finest/max(1, coarsest.n))
+
+    positions = numpy.random.uniform(-0.5, 0.5, size=(coarsest.n,2))*numpy.sqrt(coarsest.n)*k
+
+    set_stage(progress, "Layout (multilevel): level %d of %d" % (len(levels), len(levels)), 4*iterations)
+    positions = run_level(positions, coarsest, k, 4*iterations, 0.1*numpy.sqrt(coarsest.n)*k, 0.01*k, progress)
+
+    for l in reversed(range(len(levels) - 1)):
+        level = levels[l]
+        k = edge_length*numpy.sqrt(n_finest/max(1, level.n))
+
+        positions = prolong(positions, level, k)
+
+        set_stage(progress, "Layout (multilevel): level %d of %d" % (l + 1, len(levels)), iterations)
+        positions = run_level(positions, level, k, iterations, k, 0.05*k, progress)
+
+    return positions
+
+
+def test():
+    from modules.Synthetic import GRAPH_TANGLE, GRAPH_COMPONENTS, generate_graph, write_gfa
+    from modules.Layout import LAYOUT_MULTILEVEL, build_scaffold, compute_layout
+    from modules.Gfa import load_gfa, find_connected_components
+    import tempfile
+    import os
+
+    numpy.random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        graphs = dict()
+
+        for kind in [GRAPH_TANGLE, GRAPH_COMPONENTS]:
+            gfa_path = os.path.join(directory, kind + ".gfa")
+            write_gfa(generate_graph(kind, 600, mean_length=50, seed=1), gfa_path)
+            graphs[kind] = load_gfa(gfa_path)
+
+    # Finest level is the scaffold, then segments, and every level maps onto the next, smaller one
+    graph = graphs[GRAPH_TANGLE]
+    scaffold = build_scaffold(graph, 100, 3)
+    levels = build_hierarchy(graph, scaffold)
+
+    if not (levels[0].n == len(scaffold) and levels[1].n == len(graph) and levels[-1].n <= COARSEST_SIZE):
+        raise Exception("ERROR: unexpected hierarchy sizes: " + str([level.n for level in levels]))
+
+    for level,coarser in zip(levels[:-1], levels[1:]):
+        sizes = numpy.bincount(level.parents, minlength=coarser.n)
+
+        if not (len(level.parents) == level.n and coarser.n < level.n and len(sizes) == coarser.n and (sizes > 0).all()):
+            raise Exception("ERROR: level of %d nodes does not map onto the next level of %d" % (level.n, coarser.n))
+
+        if not ((level.ranks >= 0) & (level.ranks < sizes[level.parents])).all():
+            raise Exception("ERROR: ranks out of range in level of %d nodes" % level.n)
+
+    positions = layout_multilevel(graph, scaffold)
+
+    if not (positions.shape == (len(scaffold), 2) and numpy.isfinite(positions).all()):
+        raise Exception("ERROR: multilevel layout has missing or non-finite positions")
+
+    # Components do not overlap in the final layout
+    graph = graphs[GRAPH_COMPONENTS]
+    layout = compute_layout(graph, 100, 3, backend=LAYOUT_MULTILEVEL)
+    components, n_components = find_connected_components(len(graph), graph.edge_a, graph.edge_b)
+
+    boxes = list()
+    for c in range(n_components):
+        points = numpy.concatenate([layout.get_segment_points(id) for id in numpy.flatnonzero(components == c)])
+        boxes.append((points.min(axis=0), points.max(axis=0)))
+
+    for i in range(n_components):
+        for j in range(i + 1, n_components):
+            (min_a, max_a), (min_b, max_b) = boxes[i], boxes[j]
+
+            if ((max_a >= min_b) & (max_b >= min_a)).all():
+                raise Exception("ERROR: components %d and %d overlap" % (i, j))
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,109 @@
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+import matplotlib
+import numpy
+import re
+
+
+# Path positions are mapped onto this many colors of the colormap, as in the GUI
+PALETTE_SIZE = 256
+
+# Qt.gray, the color of nodes that are not on any path
+NODE_COLOR = "#a0a0a4"
+
+
+def get_output_name(query_name):
+    # Query names may contain path separators or other characters that are awkward in file names
+    return re.sub(r'[^A-Za-z0-9._-]', '_', query_name)
+
+
+class Renderer:
+    def __init__(self, point_starts, points, edge_lines, colormap="jet", line_width=1.0, width=8.0, dpi=150, crop_margin=None):
+        # Draws a layout without Qt, with nodes colored by their position along alignment paths. If crop_margin is
+        # given, images only cover the colored nodes plus that fraction of their extent on each side.
+        self.point_starts = numpy.asarray(point_starts, dtype=numpy.int64)
+        self.points = numpy.asarray(points, dtype=numpy.float64)
+        self.edge_lines = numpy.asarray(edge_lines, dtype=numpy.float64).reshape((-1,2,2))
+
+        self.colormap = matplotlib.colormaps[colormap]
+        self.palette = self.colormap(numpy.arange(PALETTE_SIZE)/PALETTE_SIZE)
+
+        self.line_width = line_width
+        self.width = width
+        self.dpi = dpi
+        self.crop_margin = crop_margin
+
+        # Built once, and shared by every image
+        self.segments = numpy.split(self.points, self.point_starts[1:-1])
+        self.drawn = numpy.flatnonzero(numpy.diff(self.point_starts) > 0)
+
+    def get_path_colors(self, paths):
+        # Color of each node that is on a path. Paths are applied in order, so later ones win where they overlap.
+        if len(paths) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros((0,4))
+
+        ids = numpy.concatenate([numpy.asarray(path, dtype=numpy.int64) for path in paths])
+        colors = numpy.concatenate([self.palette[(numpy.arange(len(path))*PALETTE_SIZE)//max(1,len(path))] for path in paths])
+
+        # Last occurrence of each id
+        unique_ids, index = numpy.unique(ids[::-1], return_index=True)
+        colors = colors[::-1][index]
+
+        has_points = self.point_starts[unique_ids + 1] > self.point_starts[unique_ids]
+
+        return unique_ids[has_points], colors[has_points]
+
+    def get_limits(self, ids):
+        points = self.points
+
+        if self.crop_margin is not None and len(ids) > 0:
+            points = numpy.concatenate([self.segments[id] for id in ids.tolist()])
+
+        if len(points) == 0:
+            return 0.0, 0.0, 1.0, 1.0
+
+        x_min, y_min = points.min(axis=0)
+        x_max, y_max = points.max(axis=0)
+
+        margin = 0.02 if self.crop_margin is None else self.crop_margin
+        margin = max(margin*max(x_max - x_min, y_max - y_min), 1.0)
+
+        return x_min - margin, y_min - margin, x_max + margin, y_max + margin
+
+    def render(self, output_path, paths):
+        ids, colors = self.get_path_colors(paths)
+        x_min, y_min, x_max, y_max = self.get_limits(ids)
+
+        aspect = min(10.0, max(0.1, (y_max - y_min)/(x_max - x_min)))
+
+        figure = Figure(figsize=(self.width, self.width*aspect), dpi=self.dpi)
+        axes = figure.add_axes((0,0,1,1))
+        axes.set_axis_off()
+
+        axes.add_collection(LineCollection(self.edge_lines, colors=[(0,0,0,0.7)], linewidths=self.line_width/3, zorder=0))
+        axes.add_collection(LineCollection([self.segments[id] for id in self.drawn.tolist()], colors=NODE_COLOR, linewidths=self.line_width, zorder=1))
+
+        if len(ids) > 0:
+            axes.add_collection(LineCollection([self.segments[id] for id in ids.tolist()], colors=colors, linewidths=self.line_width, zorder=2))
+
+        # Scene coordinates have y pointing down, as in the GUI
+        axes.set_xlim(x_min, x_max)
+        axes.set_ylim(y_max, y_min)
+        axes.set_aspect("equal")
+
+        figure.savefig(output_path)
+
+        return output_path
+
+
+# One renderer per worker process, see init_renderer
+renderer = None
+
+
+def init_renderer(*args):
+    global renderer
+    renderer = Renderer(*args)
+
+
+def render_paths(output_path, paths):
+    return renderer.render(output_path, paths)
@@ -0,0 +1,301 @@
+import random
+import numpy
+
+
+GRAPH_CHAIN = "chain"
+GRAPH_BUBBLES = "bubbles"
+GRAPH_TANGLE = "tangle"
+GRAPH_COMPONENTS = "components"
+
+GRAPH_KINDS = [GRAPH_CHAIN, GRAPH_BUBBLES, GRAPH_TANGLE, GRAPH_COMPONENTS]
+
+# Segments per component, for GRAPH_COMPONENTS
+COMPONENT_SIZE = 60
+
+
+class SyntheticGraph:
+    def __init__(self, lengths, edge_a, reversal_a, edge_b, reversal_b):
+        self.lengths = lengths
+        self.edge_a = edge_a
+        self.edge_b = edge_b
+        self.reversal_a = reversal_a
+        self.reversal_b = reversal_b
+
+        # Oriented adjacency for walks, oriented node 2*id + reversal leads to targets[starts[o]:starts[o+1]]. Each
+        # L-line can be walked in both directions, the reverse step enters a from its other side.
+        sources = numpy.concatenate([2*edge_a + reversal_a, 2*edge_b + (1 - reversal_b)])
+        targets = numpy.concatenate([2*edge_b + reversal_b, 2*edge_a + (1 - reversal_a)])
+
+        order = numpy.argsort(sources, kind="stable")
+        self.targets = targets[order]
+        self.starts = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(sources, minlength=2*len(lengths)))]).astype(numpy.int64)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def get_name(self, id):
+        return "s" + str(id)
+
+
+def get_chain_edges(ids, rng):
+    # Consecutive ids, each segment randomly traversed in either orientation
+    reversals = rng.random(len(ids)) < 0.5
+
+    return ids[:-1], reversals[:-1], ids[1:], reversals[1:]
+
+
+def get_bubble_edges(ids):
+    # Anchors alternate with pairs of alleles: a0 (b0|c0) a1 (b1|c1) a2 ...
+    anchors = ids[0::3]
+    alleles = [ids[1::3], ids[2::3]]
+
+    edges = list()
+    for allele in alleles:
+        n = min(len(allele), len(anchors) - 1)
+        edges.append((anchors[:n], allele[:n]))
+        edges.append((allele[:n], anchors[1:n + 1]))
+
+    edge_a = numpy.concatenate([a for a,b in edges])
+    edge_b = numpy.concatenate([b for a,b in edges])
+    reversals = numpy.zeros(len(edge_a), dtype=numpy.int64)
+
+    return edge_a, reversals, edge_b, reversals
+
+
+def generate_graph(kind, n_segments, mean_length=1000, seed=0):
+    rng = numpy.random.default_rng(seed)
+
+    lengths = numpy.maximum(1, rng.exponential(mean_length, n_segments)).astype(numpy.int64)
+    ids = numpy.arange(n_segments, dtype=numpy.int64)
+
+    if kind == GRAPH_CHAIN:
+        edges = get_chain_edges(ids, rng)
+        edges = [e.astype(numpy.int64) for e in edges]
+
+    elif kind == GRAPH_BUBBLES:
+        edges = get_bubble_edges(ids)
+
+    elif kind == GRAPH_TANGLE:
+        # A chain with repeats: about one extra edge per 10 segments, between random segments and sides
+        edges = [e.astype(numpy.int64) for e in get_chain_edges(ids, rng)]
+
+        n_extra = n_segments//10
+        extra = [
+            rng.integers(0, n_segments, n_extra),
+            rng.integers(0, 2, n_extra),
+            rng.integers(0, n_segments, n_extra),
+            rng.integers(0, 2, n_extra)
+        ]
+
+        edges = [numpy.concatenate([e, x]) for e,x in zip(edges, extra)]
+
+    elif kind == GRAPH_COMPONENTS:
+        # Independent bubble chains
+        parts = [get_bubble_edges(ids[start:start + COMPONENT_SIZE]) for start in range(0, n_segments, COMPONENT_SIZE)]
+        edges = [numpy.concatenate([p[i] for p in parts]) for i in range(4)]
+
+    else:
+        raise Exception("ERROR: unrecognized synthetic graph kind: " + str(kind))
+
+    edge_a, reversal_a, edge_b, reversal_b = edges
+
+    return SyntheticGraph(lengths, edge_a, reversal_a.astype(numpy.int64), edge_b, reversal_b.astype(numpy.int64))
+
+
+def write_gfa(graph, gfa_path, sequences=False, seed=0):
+    # Without sequences, segments only carry an LN tag
+    rng = numpy.random.default_rng(seed)
+    bases = numpy.frombuffer(b"ACGT", dtype=numpy.uint8)
+
+    with open(gfa_path, 'w') as file:
+        file.write("H\tVN:Z:1.0\n")
+
+        for id,length in enumerate(graph.lengths.tolist()):
+            if sequences:
+                sequence = bases[rng.integers(0, 4, length)].tobytes().decode("ascii")
+                file.write("S\t%s\t%s\n" % (graph.get_name(id), sequence))
+            else:
+                file.write("S\t%s\t*\tLN:i:%d\n" % (graph.get_name(id), length))
+
+        signs = "+-"
+        for a,ra,b,rb in zip(graph.edge_a.tolist(), graph.reversal_a.tolist(), graph.edge_b.tolist(), graph.reversal_b.tolist()):
+            file.write("L\t%s\t%s\t%s\t%s\t0M\n" % (graph.get_name(a), signs[ra], graph.get_name(b), signs[rb]))
+
+
+def generate_walk(graph, max_nodes, rng):
+    # Random walk through the oriented adjacency, stops early at dead ends
+    o = rng.randrange(2*len(graph))
+    walk = [o]
+
+    for i in range(max_nodes - 1):
+        start = int(graph.starts[o])
+        stop = int(graph.starts[o + 1])
+
+        if stop == start:
+            break
+
+        o = int(graph.targets[rng.randrange(start, stop)])
+        walk.append(o)
+
+    return walk
+
+
+# Error types (mismatch, insertion, deletion) and their relative frequencies
+ERROR_TYPES = ["X", "I", "D"]
+ERROR_FREQUENCIES = [0.6, 0.2, 0.2]
+
+# Alignments whose cigars are generated together
+BATCH_SIZE = 10000
+
+
+def generate_cigars(ref_spans, rng, error_rate=0.02, formats=dict()):
+    # Runs of matches separated by single base errors, about error_rate of the aligned bases. Generated for many
+    # alignments at once, only the formatting is done per cigar (in one call, with a template per number of errors).
+    # Returns lists of cigars, query spans, match counts and edit counts.
+    ref_spans = numpy.asarray(ref_spans, dtype=numpy.int64)
+
+    n_errors = numpy.minimum(rng.binomial(ref_spans, error_rate), numpy.maximum(0, (ref_spans - 1)//2))
+    alignments = numpy.repeat(numpy.arange(len(ref_spans)), n_errors)
+    types = rng.choice(3, len(alignments), p=ERROR_FREQUENCIES)
+
+    n_mismatch = numpy.bincount(alignments[types == 0], minlength=len(ref_spans))
+    n_insert = numpy.bincount(alignments[types == 1], minlength=len(ref_spans))
+    n_match = ref_spans - (n_errors - n_insert)
+
+    # Every run has at least one match, the rest of the matches are spread over the runs at random cuts
+    free = n_match - n_errors - 1
+    cuts = numpy.floor(rng.random(len(alignments))*(free[alignments] + 1)).astype(numpy.int64)
+    cuts = cuts[numpy.lexsort((cuts, alignments))]
+
+    # Cuts of each alignment, bracketed by 0 and its number of free matches
+    bound_starts = numpy.concatenate([[0], numpy.cumsum(n_errors + 2)])
+    bounds = numpy.zeros(bound_starts[-1], dtype=numpy.int64)
+    is_cut = numpy.ones(len(bounds), dtype=bool)
+    is_cut[bound_starts[:-1]] = False
+    is_cut[bound_starts[1:] - 1] = False
+    bounds[is_cut] = cuts
+    bounds[bound_starts[1:] - 1] = free
+
+    # Without the differences across alignments
+    runs = numpy.delete(numpy.diff(bounds) + 1, bound_starts[1:-1] - 1)
+
+    runs = runs.tolist()
+    types = [ERROR_TYPES[t] for t in types.tolist()]
+    starts = numpy.concatenate([[0], numpy.cumsum(n_errors)]).tolist()
+    n_errors = n_errors.tolist()
+
+    cigars = list()
+    for i,n in enumerate(n_errors):
+        if n not in formats:
+            formats[n] = "%d=" + "1%s%d="*n
+
+        values = [None]*(2*n + 1)
+        values[0::2] = runs[starts[i] + i:starts[i+1] + i + 1]
+        values[1::2] = types[starts[i]:starts[i+1]]
+
+        cigars.append(formats[n] % tuple(values))
+
+    return cigars, (n_match + n_mismatch + n_insert).tolist(), n_match.tolist(), n_errors
+
+
+def write_gaf(graph, gaf_path, n_records, max_nodes=8, max_alignments_per_read=3, error_rate=0.02, seed=0):
+    # Reads with one or more alignments along random walks, in batches of complete reads
+    rng = random.Random(seed)
+    cigar_rng = numpy.random.default_rng(seed)
+    lengths = graph.lengths
+
+    n_written = 0
+    n_reads = 0
+
+    with open(gaf_path, 'w') as file:
+        while n_written < n_records:
+            reads = list()
+            alignments = list()
+
+            while n_written < n_records and len(alignments) < BATCH_SIZE:
+                n_alignments = min(rng.randint(1, max_alignments_per_read), n_records - n_written)
+                reads.append(n_alignments)
+
+                for a in range(n_alignments):
+                    walk = generate_walk(graph, rng.randint(1, max_nodes), rng)
+                    path = "".join(("<" if o % 2 else ">") + graph.get_name(o//2) for o in walk)
+                    path_length = sum(int(lengths[o//2]) for o in walk)
+
+                    # Starts in the first node and ends in the last one
+                    path_start = rng.randrange(int(lengths[walk[0]//2]))
+                    path_stop = max(path_start + 1, path_length - rng.randrange(int(lengths[walk[-1]//2])))
+
+                    alignments.append((path, path_length, path_start, path_stop))
+
+                n_written += n_alignments
+
+            cigars, query_spans, n_matches, n_edits = generate_cigars([stop - start for path,length,start,stop in alignments], cigar_rng, error_rate)
+
+            i = 0
+            for n_alignments in reads:
+                read_name = "read" + str(n_reads)
+                n_reads += 1
+
+                # Alignments follow each other along the read, with some unaligned sequence in between
+                query_starts = list()
+                query_length = 0
+                for a in range(i, i + n_alignments):
+                    query_starts.append(query_length + rng.randrange(100))
+                    query_length = query_starts[-1] + query_spans[a]
+
+                query_length += rng.randrange(100)
+
+                for a,query_start in zip(range(i, i + n_alignments), query_starts):
+                    path, path_length, path_start, path_stop = alignments[a]
+
+                    file.write("%s\t%d\t%d\t%d\t+\t%s\t%d\t%d\t%d\t%d\t%d\t%d\tNM:i:%d\tcg:Z:%s\n" % (
+                        read_name, query_length, query_start, query_start + query_spans[a], path, path_length,
+                        path_start, path_stop, n_matches[a], path_stop - path_start, rng.randrange(61), n_edits[a], cigars[a]
+                    ))
+
+                i += n_alignments
+
+    return n_reads
+
+
+def test():
+    from modules.Gfa import load_gfa
+    from modules.Gaf import GafTable
+    from modules.Cigar import get_cigar_stats
+    import tempfile
+    import os
+
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in GRAPH_KINDS:
+            graph = generate_graph(kind, 300, mean_length=50, seed=1)
+
+            gfa_path = os.path.join(directory, kind + ".gfa")
+            gaf_path = os.path.join(directory, kind + ".gaf")
+
+            write_gfa(graph, gfa_path, sequences=(kind == GRAPH_CHAIN))
+            write_gaf(graph, gaf_path, 200)
+
+            loaded = load_gfa(gfa_path)
+
+            if not (len(loaded) == len(graph) and loaded.get_edge_count() == len(graph.edge_a) and (loaded.lengths == graph.lengths).all()):
+                raise Exception("ERROR: synthetic GFA does not load as generated: " + kind)
+
+            table = GafTable(store_tags=True)
+            table.load(gaf_path)
+            table.set_node_id_map(loaded.id_map)
+
+            if not len(table) == 200 or len(table.find_unknown_paths()) > 0:
+                raise Exception("ERROR: synthetic GAF does not match its GFA: " + kind)
+
+            # Cigars are consistent with the coordinates
+            for i in range(len(table)):
+                stats = get_cigar_stats(table.get_cigar_string(i))
+
+                if not (stats.ref_span == table.ref_stops[i] - table.ref_starts[i] and stats.query_span == table.query_stops[i] - table.query_starts[i]):
+                    raise Exception("ERROR: synthetic cigar does not match alignment coordinates: " + kind)
+
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    test()
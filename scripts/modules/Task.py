@@ -0,0 +1,137 @@
+import multiprocessing
+import time
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskProgress:
+    def __init__(self, callback=None, interval=0.1, diagnostics=None, task_name=None):
+        # callback(stage, value, total), where a total of 0 means the amount of work is unknown. If diagnostics are
+        # given, each stage is recorded from its set_stage until the next one, or until finish().
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+        self.last_update = 0
+        self.stage = ""
+
+        self.diagnostics = diagnostics
+        self.task_name = task_name
+        self.record = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise TaskCancelled("Cancelled during: " + self.stage)
+
+    def set_stage(self, stage, total=0):
+        self.stage = stage
+        self.last_update = time.monotonic()
+
+        if self.diagnostics is not None:
+            self.finish()
+            self.record = self.diagnostics.start(stage, task=self.task_name)
+
+            if total > 0:
+                self.record.details["total"] = total
+
+        self.check()
+
+        if self.callback is not None:
+            self.callback(stage, 0, total)
+
+    def update(self, value, total=0):
+        self.check()
+
+        # Throttled, so that it is cheap to call from inner loops
+        now = time.monotonic()
+        if self.callback is not None and now - self.last_update > self.interval:
+            self.last_update = now
+            self.callback(self.stage, value, total)
+
+    def finish(self):
+        if self.record is not None:
+            self.diagnostics.stop(self.record)
+            self.record = None
+
+
+def set_stage(progress, stage, total=0):
+    if progress is not None:
+        progress.set_stage(stage, total)
+
+
+def update_progress(progress, value, total=0):
+    if progress is not None:
+        progress.update(value, total)
+
+
+def add_details(progress, **details):
+    # Attaches values (e.g. sizes) to the stage that is being recorded, if any
+    if progress is not None and progress.record is not None:
+        progress.record.details.update(details)
+
+
+def run_in_subprocess(function, args, progress=None):
+    # For work that holds the GIL (e.g. graphviz layout), which would otherwise freeze the GUI thread.
+    # The process is terminated if the task is cancelled.
+    context = multiprocessing.get_context("spawn")
+
+    with context.Pool(1) as pool:
+        result = pool.apply_async(function, args)
+
+        while True:
+            try:
+                return result.get(timeout=0.1)
+            except multiprocessing.TimeoutError:
+                if progress is not None:
+                    progress.check()
+
+
+def run_in_pool(function, args_list, n_processes, progress=None, initializer=None, initargs=(), in_subprocess=False):
+    # Same as run_in_subprocess, for many independent calls. Results are returned in the order of args_list.
+    # The initializer is called once per process, e.g. to set up state that is shared by all calls. With a single
+    # process the calls are made inline, unless in_subprocess is set (e.g. from a GUI task, which would otherwise
+    # be frozen and impossible to cancel while a call holds the GIL).
+    if len(args_list) == 0:
+        return list()
+
+    if in_subprocess:
+        n_processes = max(1, n_processes)
+
+    elif n_processes <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+
+        results = list()
+
+        for i,args in enumerate(args_list):
+            update_progress(progress, i, len(args_list))
+            results.append(function(*args))
+
+        return results
+
+    context = multiprocessing.get_context("spawn")
+
+    with context.Pool(n_processes, initializer=initializer, initargs=initargs) as pool:
+        pending = [pool.apply_async(function, args) for args in args_list]
+        results = [None]*len(pending)
+        n_done = 0
+
+        while n_done < len(pending):
+            for i,result in enumerate(pending):
+                if result is None:
+                    continue
+
+                try:
+                    results[i] = result.get(timeout=0.01)
+                    pending[i] = None
+                    n_done += 1
+                except multiprocessing.TimeoutError:
+                    break
+
+            update_progress(progress, n_done, len(pending))
+
+        return results
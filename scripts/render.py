@@ -0,0 +1,135 @@
+from modules.Gfa import load_gfa, SEQUENCES_LENGTH_ONLY
+from modules.Gaf import GafTable
+from modules.GafIndex import GafIndex
+from modules.Layout import compute_layout, LAYOUT_SFDP, LAYOUT_FORCE_ATLAS2, LAYOUT_MULTILEVEL, LAYOUT_BARNES_HUT
+from modules.Render import init_renderer, render_paths, get_output_name
+from modules.Task import TaskProgress, run_in_pool
+from modules.Diagnostics import Diagnostics
+
+import multiprocessing
+import argparse
+import numpy
+import sys
+import os
+
+
+def print_progress(stage, value, total):
+    if total > 0:
+        sys.stderr.write("%s: %d/%d\n" % (stage, value, total))
+    elif value == 0:
+        sys.stderr.write(stage + "\n")
+
+
+def get_query_names(indexes, read_names=None, read_list_path=None):
+    names = list()
+
+    if read_names is not None:
+        names.extend(read_names)
+
+    if read_list_path is not None:
+        with open(read_list_path, 'r') as file:
+            names.extend(line.strip() for line in file if line.strip() != "")
+
+    if len(names) > 0:
+        return names
+
+    # Every read in the GAFs by default
+    query_names = set()
+    for index in indexes:
+        query_names.update(index.get_query_names())
+
+    return sorted(query_names)
+
+
+def get_read_paths(indexes, graph, query_names):
+    # Node id paths of the alignments of each read, ordered by their midpoint on the read (as in the GUI)
+    table = GafTable()
+    table.set_node_id_map(graph.id_map)
+
+    for query_name in query_names:
+        start = len(table)
+
+        for index in indexes:
+            lines, offsets = index.read_lines(query_name)
+            table.load_lines(lines, source=index.gaf_path, offsets=offsets)
+
+        stop = len(table)
+
+        if stop == start:
+            sys.stderr.write("WARNING: no alignments found for read: " + query_name + '\n')
+            continue
+
+        unknown_paths = table.find_unknown_paths(start, stop)
+        if len(unknown_paths) > 0:
+            raise Exception("ERROR: GAF path contains nodes which do not exist in GFA: " + unknown_paths[0])
+
+        midpoints = table.query_starts[start:stop] + table.query_stops[start:stop]
+        rows = start + numpy.argsort(midpoints, kind="stable")
+
+        yield query_name, [table.get_path_ids(int(i))[0] for i in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a GFA layout with alignments colored, one image per read, without a display")
+    parser.add_argument("-g", "--gfa", required=True, help="Graph to draw")
+    parser.add_argument("-a", "--gaf", nargs="+", default=list(), help="Alignments to the graph, one or more GAF files")
+    parser.add_argument("-o", "--output_directory", required=True)
+    parser.add_argument("-r", "--reads", nargs="+", default=None, help="Names of the reads to render (default: all)")
+    parser.add_argument("--read_list", default=None, help="File with one read name per line, to render only those")
+    parser.add_argument("--format", default="png", choices=["png", "svg", "pdf"])
+    parser.add_argument("-t", "--n_processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--layout_engine", default=LAYOUT_SFDP, choices=[LAYOUT_SFDP, LAYOUT_MULTILEVEL, LAYOUT_BARNES_HUT, LAYOUT_FORCE_ATLAS2])
+    parser.add_argument("--length_scale_factor", type=int, default=100, help="Target total points of the layout")
+    parser.add_argument("--min_node_length", type=int, default=3)
+    parser.add_argument("--collapse_chains", action="store_true", help="Lay out unitig chains as single segments")
+    parser.add_argument("--time_budget", type=float, default=None, help="Seconds, for the layout engines that can stop early")
+    parser.add_argument("--line_width", type=float, default=1.0)
+    parser.add_argument("--width", type=float, default=8.0, help="Image width in inches")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--crop", type=float, default=None, help="Only show the aligned nodes, with this fraction of their extent as margin")
+    parser.add_argument("--overview", action="store_true", help="Also render the graph without alignments")
+    parser.add_argument("--diagnostics", default=None, help="Write the time and memory of each stage to this JSON file")
+
+    args = parser.parse_args()
+
+    diagnostics = Diagnostics() if args.diagnostics is not None else None
+    progress = TaskProgress(print_progress, interval=5, diagnostics=diagnostics)
+
+    graph = load_gfa(args.gfa, sequence_mode=SEQUENCES_LENGTH_ONLY, progress=progress)
+
+    # The same cache as the GUI, so that a layout that was already drawn interactively is reused and vice versa
+    layout = compute_layout(
+        graph, args.length_scale_factor, args.min_node_length, progress=progress, read_cache=True, write_cache=True,
+        backend=args.layout_engine, n_processes=args.n_processes, time_budget=args.time_budget, collapse_chains=args.collapse_chains
+    )
+
+    os.makedirs(args.output_directory, exist_ok=True)
+
+    indexes = [GafIndex.load_or_build(gaf_path, progress=progress) for gaf_path in args.gaf]
+    query_names = get_query_names(indexes, args.reads, args.read_list)
+
+    args_list = list()
+
+    if args.overview:
+        args_list.append((os.path.join(args.output_directory, "graph." + args.format), list()))
+
+    for query_name,paths in get_read_paths(indexes, graph, query_names):
+        output_path = os.path.join(args.output_directory, get_output_name(query_name) + "." + args.format)
+        args_list.append((output_path, paths))
+
+    progress.set_stage("Rendering", len(args_list))
+
+    renderer_args = (layout.point_starts, layout.points, layout.edge_lines, "jet", args.line_width, args.width, args.dpi, args.crop)
+    n_processes = min(args.n_processes, len(args_list))
+
+    output_paths = run_in_pool(render_paths, args_list, n_processes, progress=progress, initializer=init_renderer, initargs=renderer_args)
+    progress.finish()
+
+    if diagnostics is not None:
+        diagnostics.write_json(args.diagnostics)
+
+    sys.stderr.write("Rendered %d images to %s\n" % (len(output_paths), args.output_directory))
+
+
+if __name__ == "__main__":
+    main()